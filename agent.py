@@ -33,12 +33,15 @@ if int(sys.version_info[1]) <= 3:
     sys.exit(2)
 
 # Custom modules
+from checks import benchmark_check, print_benchmark
+from checks.fixtures import Fixtures, FixtureNotFound
 from checks.collector import Collector
 from checks.check_status import CollectorStatus
-from config import get_config, get_system_stats, get_parsed_args, load_check_directory
+from config import get_config, get_system_stats, get_parsed_args, load_check_directory, \
+    CheckDirectoryWatcher, _is_affirmative
 from daemon import Daemon
 from emitter import http_emitter
-from util import Watchdog, PidFile, AgentSupervisor, EC2
+from util import Watchdog, PidFile, AgentSupervisor, EC2, RunScheduler
 
 
 # Constants
@@ -95,7 +98,10 @@ class Agent(Daemon):
         emitters = self._get_emitters(agentConfig)
         self.collector = Collector(agentConfig, emitters, systemStats)
 
-        # Load the checks.d checks
+        # Load the checks.d checks, and watch their files to reload them
+        watcher = None
+        if _is_affirmative(str(agentConfig.get('reload_checks', 'no'))):
+            watcher = CheckDirectoryWatcher(agentConfig)
         checksd = load_check_directory(agentConfig)
 
         # Configure the watchdog.
@@ -106,10 +112,22 @@ class Agent(Daemon):
         self.restart_interval = int(agentConfig.get('restart_interval', RESTART_INTERVAL))
         self.agent_start = time.time()
 
+        # Runs start every check_frequency seconds, whatever their duration
+        scheduler = RunScheduler(check_frequency)
+
         # Run the main loop.
         while self.run_forever:
+            # Pick up the changes in checks.d and conf.d
+            if watcher:
+                try:
+                    checksd = watcher.reload(checksd)
+                except Exception:
+                    log.exception("Unable to reload the checks.d checks")
+
             # Do the work.
-            self.collector.run(checksd=checksd, start_event=self.start_event)
+            scheduler.start_run()
+            self.collector.run(checksd=checksd, start_event=self.start_event,
+                scheduler_stats=scheduler.get_stats())
 
             # Check if we should restart.
             if self.autorestart and self._should_restart():
@@ -120,7 +138,18 @@ class Agent(Daemon):
             if self.run_forever:
                 if watchdog:
                     watchdog.reset()
-                time.sleep(check_frequency)
+                skipped_runs = scheduler.skipped_runs
+                sleep_time = scheduler.get_sleep_time()
+                if scheduler.skipped_runs > skipped_runs:
+                    log.warn("Collection run #%s overran its %ss slot, skipping %s runs" %
+                        (self.collector.run_count, check_frequency, scheduler.skipped_runs - skipped_runs))
+                elif sleep_time == 0:
+                    log.info("Collection run #%s overran its %ss slot, starting the next one right away" %
+                        (self.collector.run_count, check_frequency))
+                while self.run_forever and sleep_time > 0:
+                    # A signal may wake us up early
+                    time.sleep(sleep_time)
+                    sleep_time = scheduler.get_sleep_time()
 
         # Now clean-up.
         try:
@@ -228,6 +257,24 @@ def main():
 
         elif 'check' == command:
             check_name = args[1]
+            runs = 10
+            if len(args) >= 4 and args[2] == 'benchmark':
+                try:
+                    runs = int(args[3])
+                    if runs < 1:
+                        raise ValueError(runs)
+                except ValueError:
+                    sys.stderr.write("Usage: %s check <check name> benchmark [number of runs] "
+                        "[--fixtures <directory> [--record]]\n" % sys.argv[0])
+                    return 2
+            fixtures = None
+            if options.fixtures:
+                # Replay (or record) the responses of the service it monitors
+                try:
+                    fixtures = Fixtures(options.fixtures, options.record)
+                except FixtureNotFound, e:
+                    sys.stderr.write("%s\n" % e)
+                    return 2
             try:
                 import checks.collector
                 # Try the old-style check first
@@ -237,6 +284,10 @@ def main():
                 checks = load_check_directory(agentConfig)
                 for check in checks:
                     if check.name == check_name:
+                        check.fixtures = fixtures
+                    if check.name == check_name and len(args) >= 3 and args[2] == 'benchmark':
+                        print_benchmark(benchmark_check(check, runs))
+                    elif check.name == check_name:
                         check.run()
                         print check.get_metrics()
                         print check.get_events()
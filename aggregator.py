@@ -1,4 +1,5 @@
 import logging
+import threading
 from time import time
 
 log = logging.getLogger(__name__)
@@ -6,6 +7,46 @@ log = logging.getLogger(__name__)
 class Infinity(Exception): pass
 class UnknownValue(Exception): pass
 
+# Process-wide intern tables. Every check and dogstatsd submit the same
+# metric names and tags on every run: the series share a single copy of
+# them. The tables are bounded, they start over when they're full.
+INTERN_TABLE_SIZE = 100000
+_interned_strings = {}
+_interned_tags = {}
+_tag_lists = {}
+
+def intern_string(value):
+    """ Return the shared copy of a metric name, tag, hostname... """
+    if value is None:
+        return None
+    interned = _interned_strings.get(value)
+    if interned is None:
+        if len(_interned_strings) >= INTERN_TABLE_SIZE:
+            _interned_strings.clear()
+        interned = _interned_strings[value] = value
+    return interned
+
+def intern_tags(tags):
+    """ Return the shared copy of a tuple of sorted and unique tags. """
+    interned = _interned_tags.get(tags)
+    if interned is None:
+        if len(_interned_tags) >= INTERN_TABLE_SIZE:
+            _interned_tags.clear()
+        interned = _interned_tags[tags] = tuple([intern_string(t) for t in tags])
+    return interned
+
+def get_tag_list(tags):
+    """
+    Return the shared list of an interned tuple of tags, for the payloads.
+    It must not be modified.
+    """
+    tag_list = _tag_lists.get(tags)
+    if tag_list is None:
+        if len(_tag_lists) >= INTERN_TABLE_SIZE:
+            _tag_lists.clear()
+        tag_list = _tag_lists[tags] = list(tags)
+    return tag_list
+
 class Metric(object):
     """
     A base metric class that accepts points, slices them into time intervals
@@ -95,6 +136,11 @@ class Histogram(Metric):
         self.tags = tags
         self.hostname = hostname
         self.device_name = device_name
+        # Built once instead of on every flush
+        self.aggregate_names = [intern_string('%s.%s' % (name, suffix))
+            for suffix in ['max', 'median', 'avg', 'count']]
+        self.percentile_names = [intern_string('%s.%spercentile' % (name, int(p * 100)))
+            for p in self.percentiles]
 
     def sample(self, value, sample_rate):
         self.count += int(1 / sample_rate)
@@ -112,26 +158,20 @@ class Histogram(Metric):
         med = self.samples[int(round(length/2 - 1))]
         avg = sum(self.samples) / float(length)
 
-        metric_aggrs = [
-            ('max', max_),
-            ('median', med),
-            ('avg', avg),
-            ('count', self.count/interval)
-        ]
+        metric_aggrs = zip(self.aggregate_names, [max_, med, avg, self.count/interval])
 
         metrics = [self.formatter(
                 hostname=self.hostname,
                 device_name=self.device_name,
                 tags=self.tags,
-                metric='%s.%s' % (self.name, suffix),
+                metric=name,
                 value=value,
                 timestamp=ts
-            ) for suffix, value in metric_aggrs
+            ) for name, value in metric_aggrs
         ]
 
-        for p in self.percentiles:
+        for p, name in zip(self.percentiles, self.percentile_names):
             val = self.samples[int(round(p * length - 1))]
-            name = '%s.%spercentile' % (self.name, int(p * 100))
             metrics.append(self.formatter(
                 hostname=self.hostname,
                 tags=self.tags,
@@ -314,11 +354,43 @@ class MetricsAggregator(object):
             context = (name, tuple(), hostname, device_name)
         else:
             context = (name, tuple(sorted(set(tags))), hostname, device_name)
-        if context not in self.metrics:
-            metric_class = self.metric_type_to_class[mtype]
-            self.metrics[context] = metric_class(self.formatter, name, tags,
-                hostname or self.hostname, device_name)
-        self.metrics[context].sample(value, sample_rate)
+        metric = self.metrics.get(context)
+        if metric is None:
+            metric = self._create_metric(context, mtype, tags is not None)
+        metric.sample(value, sample_rate)
+
+    def _create_metric(self, context, mtype, tagged):
+        """ Create the series of a new context, with interned names and tags. """
+        name, tags, hostname, device_name = context
+        name = intern_string(name)
+        tags = intern_tags(tags)
+        hostname = intern_string(hostname)
+        device_name = intern_string(device_name)
+        metric_tags = None
+        if tagged:
+            metric_tags = tags
+        metric_class = self.metric_type_to_class[mtype]
+        metric = metric_class(self.formatter, name, metric_tags,
+            hostname or self.hostname, device_name)
+        self.metrics[(name, tags, hostname, device_name)] = metric
+        return metric
+
+    def submit_metrics(self, metrics, tags=None, hostname=None, device_name=None):
+        """
+        Submit (name, value, mtype) rows sharing the same tags, hostname and
+        device name. The tags are deduped and sorted once for all the rows.
+        """
+        if tags is None:
+            context_tags = tuple()
+        else:
+            context_tags = tuple(sorted(set(tags)))
+        contexts = self.metrics
+        for name, value, mtype in metrics:
+            metric = contexts.get((name, context_tags, hostname, device_name))
+            if metric is None:
+                metric = self._create_metric((name, context_tags, hostname, device_name),
+                    mtype, tags is not None)
+            metric.sample(value, 1)
 
     def gauge(self, name, value, tags=None, hostname=None, device_name=None, timestamp=None):
         self.submit_metric(name, value, 'g', tags, hostname, device_name, timestamp)
@@ -361,12 +433,42 @@ class MetricsAggregator(object):
     def send_packet_count(self, metric_name):
         self.submit_metric(metric_name, self.count, 'g')
 
+
+class LockingMetricsAggregator(MetricsAggregator):
+    """ A MetricsAggregator which can be fed by several threads. """
+
+    def __init__(self, *args, **kwargs):
+        MetricsAggregator.__init__(self, *args, **kwargs)
+        self._lock = threading.Lock()
+
+    def submit_metric(self, *args, **kwargs):
+        self._lock.acquire()
+        try:
+            MetricsAggregator.submit_metric(self, *args, **kwargs)
+        finally:
+            self._lock.release()
+
+    def submit_metrics(self, *args, **kwargs):
+        self._lock.acquire()
+        try:
+            MetricsAggregator.submit_metrics(self, *args, **kwargs)
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        self._lock.acquire()
+        try:
+            return MetricsAggregator.flush(self)
+        finally:
+            self._lock.release()
+
 def api_formatter(metric, value, timestamp, tags, hostname, device_name=None):
 
     # Workaround for a bug in minjson serialization
-    # (https://github.com/DataDog/dd-agent/issues/422)
+    # (https://github.com/DataDog/dd-agent/issues/422). The list is shared
+    # by the series with the same tags, like the metric names.
     if tags is not None and isinstance(tags, tuple) and len(tags) == 1:
-        tags = list(tags)
+        tags = get_tag_list(tags)
     return {
         'metric' : metric,
         'points' : [(timestamp, value)],
@@ -1,6 +1,3 @@
-import urllib2
-
-from util import headers
 from checks import AgentCheck
 
 class Apache(AgentCheck):
@@ -33,10 +30,7 @@ class Apache(AgentCheck):
         url = self.assumed_url.get(instance['apache_status_url'], instance['apache_status_url'])
 
         tags = instance.get('tags', [])
-        req = urllib2.Request(url, None,
-            headers(self.agentConfig))
-        request = urllib2.urlopen(req)
-        response = request.read()
+        _, response = self.http_get(url, timeout=instance.get('timeout'))
 
         metric_count = 0
         # Loop through and extract the numerical values
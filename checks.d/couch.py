@@ -1,5 +1,4 @@
-import urllib2
-from util import json, headers
+from util import json
 
 from checks import AgentCheck
 
@@ -27,11 +26,7 @@ class CouchDb(AgentCheck):
     def _get_stats(self, url):
         "Hit a given URL and return the parsed json"
         self.log.debug('Fetching Couchdb stats at url: %s' % url)
-        req = urllib2.Request(url, None, headers(self.agentConfig))
-
-        # Do the request, log any errors
-        request = urllib2.urlopen(req)
-        response = request.read()
+        _, response = self.http_get(url)
         return json.loads(response)
 
     def check(self, instance):
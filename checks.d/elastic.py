@@ -1,5 +1,4 @@
 import urlparse
-import urllib2
 import socket
 import subprocess
 import sys
@@ -7,20 +6,13 @@ from datetime import datetime
 import time
 
 from checks import AgentCheck
-from util import json, headers
+from util import json
 
 HEALTH_URL = "/_cluster/health?pretty=true"
 STATS_URL = "/_cluster/nodes/stats?all=true"
 NODES_URL = "/_cluster/nodes?network=true"
 
 
-def _get_data(agentConfig, url):
-    "Hit a given URL and return the parsed json"
-    req = urllib2.Request(url, None, headers(agentConfig))
-    request = urllib2.urlopen(req)
-    response = request.read()
-    return json.loads(response)
-
 class NodeNotFound(Exception): pass
 
 
@@ -173,7 +165,7 @@ class ElasticSearch(AgentCheck):
         self.log.debug("Fetching elasticsearch data from: %s" % url)
 
         try:
-            data = _get_data(self.agentConfig, url)
+            data = self._get_data(url)
 
             if url_suffix==STATS_URL:
                 self._process_data(data, tags=tags, instance=instance)
@@ -187,6 +179,11 @@ class ElasticSearch(AgentCheck):
             self.log.exception('Unable to get elasticsearch statistics %s' % str(e))
             raise
 
+    def _get_data(self, url):
+        "Hit a given URL and return the parsed json"
+        _, response = self.http_get(url)
+        return json.loads(response)
+
     def _base_es_url(self, config_url):
         parsed = urlparse.urlparse(config_url)
         if parsed.path == "":
@@ -217,21 +214,18 @@ class ElasticSearch(AgentCheck):
                 try:
                     base_url = self._base_es_url(instance['url'])
                     url = "%s%s" % (base_url, NODES_URL)
-                    primary_addr = self._get_primary_addr(self.agentConfig, url, node)
+                    primary_addr = self._get_primary_addr(url, node)
                 except NodeNotFound:
                     # Skip any nodes that aren't found
                     continue
                 if self._host_matches_node(primary_addr):
                     self._map_metric(process_metric)
 
-    def _get_primary_addr(self, agentConfig, url, node_name):
+    def _get_primary_addr(self, url, node_name):
         ''' Returns a list of primary interface addresses as seen by ES.
         Used in ES < 0.19
         '''
-        req = urllib2.Request(url, None, headers(agentConfig))
-        request = urllib2.urlopen(req)
-        response = request.read()
-        data = json.loads(response)
+        data = self._get_data(url)
 
         if node_name in data['nodes']:
             node = data['nodes'][node_name]
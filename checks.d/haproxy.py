@@ -1,9 +1,8 @@
 import urlparse
-import urllib2
 import socket
 
 from checks import AgentCheck
-from util import json, headers
+from util import json
 
 import time
 
@@ -51,7 +50,7 @@ class HAProxy(AgentCheck):
 
         self.log.debug('Processing HAProxy data for %s' % url)
        
-        data = self._fetch_data(url, username, password)
+        data = self._fetch_data(url, username, password, instance.get('timeout'))
 
         if instance.get('status_check', self.init_config.get('status_check', False)):
             events_cb = self._process_events
@@ -61,22 +60,14 @@ class HAProxy(AgentCheck):
         self._process_data(data, self.hostname, self._process_metrics,
             events_cb, url)
 
-    def _fetch_data(self, url, username, password):
+    def _fetch_data(self, url, username, password, timeout=None):
         ''' Hit a given URL and return the parsed json '''
         # Try to fetch data from the stats URL
-
-        passman = urllib2.HTTPPasswordMgrWithDefaultRealm()
-        passman.add_password(None, url, username, password)
-        authhandler = urllib2.HTTPBasicAuthHandler(passman)
-        opener = urllib2.build_opener(authhandler)
-        urllib2.install_opener(opener)
         url = "%s%s" % (url, STATS_URL)
 
         self.log.debug("HAProxy Fetching haproxy search data from: %s" % url)
 
-        req = urllib2.Request(url, None, headers(self.agentConfig))
-        request = urllib2.urlopen(req)
-        response = request.read()
+        _, response = self.http_get(url, username, password, timeout)
         # Split the data by line
         return response.split('\n')
 
@@ -1,5 +1,4 @@
 import re
-import urllib2
 try:
     from collections import defaultdict
 except ImportError:
@@ -56,8 +55,7 @@ class KyotoTycoonCheck(AgentCheck):
         if name is not None:
             tags.append('instance:%s' % name)
 
-        response = urllib2.urlopen(url)
-        body = response.read()
+        _, body = self.http_get(url, timeout=instance.get('timeout'))
 
         totals = defaultdict(lambda: 0)
         for line in body.split('\n'):
@@ -1,6 +1,3 @@
-import urllib2
-
-from util import headers
 from checks import AgentCheck
 
 class Lighttpd(AgentCheck):
@@ -67,12 +64,8 @@ class Lighttpd(AgentCheck):
 
         tags = instance.get('tags', [])
         self.log.debug("Connecting to %s" % url)
-        req = urllib2.Request(url, None,
-            headers(self.agentConfig))
-        request = urllib2.urlopen(req)
-        headers_resp = request.info().headers
+        headers_resp, response = self.http_get(url, timeout=instance.get('timeout'))
         server_version = self._get_server_version(headers_resp)
-        response = request.read()
 
         metric_count = 0
         # Loop through and extract the numerical values
@@ -117,17 +110,15 @@ class Lighttpd(AgentCheck):
                 raise Exception("No metrics were fetched for this instance. Make sure that %s is the proper url." % instance['lighttpd_status_url'])
 
     def _get_server_version(self, headers):
-        for h in headers:
-            if "Server:" not in h:
-                continue
-            try:
-                version = int(h.split('/')[1][0])
-            except Exception, e:
-                self.log.debug("Error while trying to get server version %s" % str(e))
-                version = "Unknown"
-            self.log.debug("Lighttpd server version is %s" % version)
-            return version
-
-        self.log.debug("Lighttpd server version is Unknown")
-        return "Unknown"
+        server = headers.get('server')
+        if server is None:
+            self.log.debug("Lighttpd server version is Unknown")
+            return "Unknown"
+        try:
+            version = int(server.split('/')[1][0])
+        except Exception, e:
+            self.log.debug("Error while trying to get server version %s" % str(e))
+            version = "Unknown"
+        self.log.debug("Lighttpd server version is %s" % version)
+        return version
 
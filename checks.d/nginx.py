@@ -1,8 +1,6 @@
 import re
 import time
-import urllib2
 
-from util import headers
 from checks import AgentCheck
 
 class Nginx(AgentCheck):
@@ -25,12 +23,10 @@ class Nginx(AgentCheck):
             raise Exception('NginX instance missing "nginx_status_url" value.')
         tags = instance.get('tags', [])
 
-        self._get_metrics(instance['nginx_status_url'], tags)
+        self._get_metrics(instance['nginx_status_url'], tags, instance.get('timeout'))
 
-    def _get_metrics(self, url, tags):
-        req = urllib2.Request(url, None, headers(self.agentConfig))
-        request = urllib2.urlopen(req)
-        response = request.read()
+    def _get_metrics(self, url, tags, timeout=None):
+        _, response = self.http_get(url, timeout=timeout)
 
         # Thanks to http://hostingfu.com/files/nginx/nginxstats.py for this code
         # Connections
@@ -1,7 +1,8 @@
-import urllib2
+import socket
 import urlparse
 
 from checks import AgentCheck
+from checks.http_client import HTTPError, HttpLib2Error
 from util import json
 
 QUEUE_ATTRIBUTES = [
@@ -44,22 +45,17 @@ class RabbitMQ(AgentCheck):
         base_url = instance['rabbitmq_api_url']
         if not base_url.endswith('/'):
             base_url += '/'
-        username = instance.get('rabbitmq_user', 'guest')
-        password = instance.get('rabbitmq_pass', 'guest')
-
-        # setup urllib2 for Basic Auth
-        auth_handler = urllib2.HTTPBasicAuthHandler()
-        auth_handler.add_password(realm='RabbitMQ Management', uri=base_url, user=username, passwd=password)
-        opener = urllib2.build_opener(auth_handler)
-        urllib2.install_opener(opener)
 
         self.get_queue_stats(instance, base_url)
         self.get_node_stats(instance, base_url)
 
-    def _get_data(self, url):
+    def _get_data(self, url, instance):
+        username = instance.get('rabbitmq_user', 'guest')
+        password = instance.get('rabbitmq_pass', 'guest')
         try:
-            data = json.loads(urllib2.urlopen(url).read())
-        except urllib2.URLError, e:
+            _, response = self.http_get(url, username, password, instance.get('timeout'))
+            data = json.loads(response)
+        except (HTTPError, HttpLib2Error, socket.error), e:
             raise Exception('Cannot open RabbitMQ API url: %s %s' % (url, str(e)))
         except ValueError, e:
             raise Exception('Cannot parse JSON response from API url: %s %s' % (url, str(e)))
@@ -109,7 +105,7 @@ class RabbitMQ(AgentCheck):
 
     def get_queue_stats(self, instance, base_url):
         url = urlparse.urljoin(base_url, 'queues')
-        queues = self._get_data(url)
+        queues = self._get_data(url, instance)
 
         if len(queues) > 100 and not instance.get('queues', None):
             self.log.debug("Too many queues to fetch. You must choose the queues you are interested in by editing the rabbitmq.yaml configuration file")
@@ -139,7 +135,7 @@ class RabbitMQ(AgentCheck):
 
     def get_node_stats(self, instance, base_url):
         url = urlparse.urljoin(base_url, 'nodes')
-        nodes = self._get_data(url)
+        nodes = self._get_data(url, instance)
 
         if len(nodes) > 100 and not instance.get('nodes', None):
             self.log.debug("Too many queues to fetch. You must choose the queues you are interested in by editing the rabbitmq.yaml configuration file")
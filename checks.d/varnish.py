@@ -1,6 +1,5 @@
 import xml.parsers.expat # python 2.4 compatible
 import re
-import subprocess
 
 from checks import AgentCheck
 
@@ -84,19 +83,7 @@ class Varnish(AgentCheck):
         tags = instance.get('tags', [])
 
         # Get the varnish version from varnishstat
-        output, error = subprocess.Popen([instance.get("varnishstat"), "-V"],
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE).communicate()
-
-        # Assumptions regarding varnish's version
-        use_xml = True
-        arg = "-x" # varnishstat argument
-        version = 3
-
-        # Get the varnish version from varnishstat
-        output, error = subprocess.Popen([instance.get("varnishstat"), "-V"],
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE).communicate()
+        output, error = self.get_subprocess_output([instance.get("varnishstat"), "-V"])
 
         # Assumptions regarding varnish's version
         use_xml = True
@@ -122,9 +109,7 @@ class Varnish(AgentCheck):
             use_xml = False
             arg = "-1"
 
-        output, error = subprocess.Popen([instance.get("varnishstat"), arg],
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE).communicate()
+        output, error = self.get_subprocess_output([instance.get("varnishstat"), arg])
         if error and len(error) > 0:
             self.log.error(error)
         self._parse_varnishstat(output, use_xml, tags)
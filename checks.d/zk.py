@@ -39,33 +39,11 @@ class Zookeeper(AgentCheck):
         timeout = float(instance.get('timeout', 3.0))
         tags = instance.get('tags', [])
 
-        sock = socket.socket()
-        sock.settimeout(timeout)
-        buf = StringIO()
-        chunk_size = 1024
-        # try-finally and try-except to stay compatible with python 2.4
         try:
-            try:
-                # Connect to the zk client port and send the stat command
-                sock.connect((host, port))
-                sock.sendall('stat')
-
-                # Read the response into a StringIO buffer
-                chunk = sock.recv(chunk_size)
-                buf.write(chunk)
-                num_reads = 1
-                max_reads = 10000
-                while chunk:
-                    if num_reads > max_reads:
-                        # Safeguard against an infinite loop
-                        raise Exception("Read %s bytes before exceeding max reads of %s. " % (buf.tell(), max_reads))
-                    chunk = sock.recv(chunk_size)
-                    buf.write(chunk)
-                    num_reads += 1
-            except socket.timeout:
-                buf = None
-        finally:
-            sock.close()
+            # Connect to the zk client port and send the stat command
+            buf = StringIO(self.socket_request(host, port, 'stat', timeout))
+        except socket.timeout:
+            buf = None
 
         if buf is not None:
             # Parse the response
@@ -4,18 +4,25 @@ If you are writing your own checks you should subclass the AgentCheck class.
 The Check class is being deprecated so don't write new checks with it.
 """
 
+import gc
 import logging
 import re
 import socket
+import subprocess
 import time
 import types
 import os
 import sys
+import threading
 from pprint import pprint
 
-from util import LaconicFilter, get_os, get_hostname
-from config import get_confd_path
+from util import LaconicFilter, get_os, get_hostname, get_rss, get_thread_cpu_time, headers
+from config import get_confd_path, get_version, _is_affirmative
 from checks import check_status
+from checks.libs.thread_pool import Pool
+from checks.metric_filters import MetricFilter
+from checks.event_limits import EventLimiter
+from aggregator import get_tag_list
 
 log = logging.getLogger(__name__)
 
@@ -25,6 +32,46 @@ class Infinity(CheckException): pass
 class NaN(CheckException): pass
 class UnknownValue(CheckException): pass
 
+# Metric types of AgentCheck.submit_metrics, and their aggregator type
+METRIC_TYPES = {
+    'gauge': 'g',
+    'rate': '_dd-r',
+    'increment': 'c',
+    'histogram': 'h',
+    'set': 's',
+}
+
+DEFAULT_INSTANCE_TIMEOUT = 20 # seconds, see `instance_timeout`
+INSTANCE_WAIT_STEP = 0.5 # seconds
+
+# Substitutions turning a metric into a well-formed metric name
+METRIC_NAME_SUBS = [
+    (re.compile(r"[,\+\*\-/()\[\]{}]"), "_"),
+    # Eliminate multiple _
+    (re.compile(r"__+"), "_"),
+    # Don't start/end with _
+    (re.compile(r"^_"), ""),
+    (re.compile(r"_$"), ""),
+    # Drop ._ and _.
+    (re.compile(r"\._"), "."),
+    (re.compile(r"_\."), "."),
+]
+# Checks normalize the same names on every run, keep them in a cache
+NORMALIZED_NAMES_CACHE_SIZE = 10000
+_normalized_names = {}
+
+def normalize_metric_name(metric):
+    """ Turn a metric into a well-formed metric name, e.g. a.b_c """
+    name = _normalized_names.get(metric)
+    if name is None:
+        name = metric
+        for pattern, repl in METRIC_NAME_SUBS:
+            name = pattern.sub(repl, name)
+        if len(_normalized_names) >= NORMALIZED_NAMES_CACHE_SIZE:
+            # Names which aren't used anymore are dropped with the others
+            _normalized_names.clear()
+        _normalized_names[metric] = name
+    return name
 
 
 #==============================================================================
@@ -46,10 +93,13 @@ class Check(object):
 
     def __init__(self, logger):
         # where to store samples, indexed by metric_name
-        # metric_name: {("sorted", "tags"): [(ts, value), (ts, value)],
+        # metric_name: {(("sorted", "tags"), device_name): [previous, last],
         #                 tuple(tags) are stored as a key since lists are not hashable
-        #               None: [(ts, value), (ts, value)]}
+        #               (None, device_name): [previous, last]}
         #                 untagged values are indexed by None
+        # Samples are (ts, value, hostname, device_name). The two slots are
+        # updated in place, gauges only use the last one and counters the
+        # previous one to compute their rate.
         self._sample_store = {}
         self._counters = {} # metric_name: bool
         self.logger = logger
@@ -62,15 +112,7 @@ class Check(object):
         """Turn a metric into a well-formed metric name
         prefix.b.c
         """
-        name = re.sub(r"[,\+\*\-/()\[\]{}]", "_", metric)
-        # Eliminate multiple _
-        name = re.sub(r"__+", "_", name)
-        # Don't start/end with _
-        name = re.sub(r"^_", "", name)
-        name = re.sub(r"_$", "", name)
-        # Drop ._ and _.
-        name = re.sub(r"\._", ".", name)
-        name = re.sub(r"_\.", ".", name)
+        name = normalize_metric_name(metric)
 
         if prefix is not None:
             return prefix + "." + name
@@ -123,7 +165,8 @@ class Check(object):
 
         if timestamp is None:
             timestamp = time.time()
-        if metric not in self._sample_store:
+        series = self._sample_store.get(metric)
+        if series is None:
             raise CheckException("Saving a sample for an undefined metric: %s" % metric)
         try:
             value = cast_metric_val(value)
@@ -137,23 +180,16 @@ class Check(object):
             else:
                 tags = tuple(sorted(tags))
 
-        # Data eviction rules
-        key = (tags, device_name)
-        if self.is_gauge(metric):
-            self._sample_store[metric][key] = ((timestamp, value, hostname, device_name), )
-        elif self.is_counter(metric):
-            if self._sample_store[metric].get(key) is None:
-                self._sample_store[metric][key] = [(timestamp, value, hostname, device_name)]
-            else:
-                self._sample_store[metric][key] = self._sample_store[metric][key][-1:] + [(timestamp, value, hostname, device_name)]
+        # Data eviction rules: gauges keep their last sample, counters
+        # their last two samples
+        sample = (timestamp, value, hostname, device_name)
+        slots = series.get((tags, device_name))
+        if slots is None:
+            series[(tags, device_name)] = [None, sample]
         else:
-            raise CheckException("%s must be either gauge or counter, skipping sample at %s" % (metric, time.ctime(timestamp)))
-
-        if self.is_gauge(metric):
-            # store[metric][tags] = (ts, val) - only 1 value allowed
-            assert len(self._sample_store[metric][key]) == 1, self._sample_store[metric]
-        elif self.is_counter(metric):
-            assert len(self._sample_store[metric][key]) in (1, 2), self._sample_store[metric]
+            if metric in self._counters:
+                slots[0] = slots[1]
+            slots[1] = sample
 
     @classmethod
     def _rate(cls, sample1, sample2):
@@ -188,22 +224,21 @@ class Check(object):
         if metric not in self._sample_store:
             raise UnknownValue()
 
-        # Not enough value to compute rate
-        elif self.is_counter(metric) and len(self._sample_store[metric][key]) < 2:
-           raise UnknownValue()
+        return self._get_slots_sample(metric in self._counters, self._sample_store[metric][key], expire)
 
-        elif self.is_counter(metric) and len(self._sample_store[metric][key]) >= 2:
-            res = self._rate(self._sample_store[metric][key][-2], self._sample_store[metric][key][-1])
-            if expire:
-                del self._sample_store[metric][key][:-1]
-            return res
+    def _get_slots_sample(self, is_counter, slots, expire):
+        if not is_counter:
+            return slots[1]
 
-        elif self.is_gauge(metric) and len(self._sample_store[metric][key]) >= 1:
-            return self._sample_store[metric][key][-1]
-
-        else:
+        # Not enough value to compute rate
+        if slots[0] is None:
             raise UnknownValue()
 
+        res = self._rate(slots[0], slots[1])
+        if expire:
+            slots[0] = None
+        return res
+
     def get_sample(self, metric, tags=None, device_name=None, expire=True):
         "Return the last value for that metric"
         x = self.get_sample_with_timestamp(metric, tags, device_name, expire)
@@ -239,12 +274,12 @@ class Check(object):
         @rtype [(metric_name, timestamp, value, {"tags": ["tag1", "tag2"]}), ...]
         """
         metrics = []
-        for m in self._sample_store:
+        for m, series in self._sample_store.iteritems():
+            is_counter = m in self._counters
             try:
-                for key in self._sample_store[m]:
-                    tags, device_name = key
+                for (tags, device_name), slots in series.iteritems():
                     try:
-                        ts, val, hostname, device_name = self.get_sample_with_timestamp(m, tags, device_name, expire)
+                        ts, val, hostname, device_name = self._get_slots_sample(is_counter, slots, expire)
                     except UnknownValue:
                         continue
                     attributes = {}
@@ -270,7 +305,7 @@ class AgentCheck(object):
         :param agentConfig: The global configuration for the agent
         :param instances: A list of configuration objects for each instance.
         """
-        from aggregator import MetricsAggregator
+        from aggregator import MetricsAggregator, LockingMetricsAggregator
 
 
         self.name = name
@@ -278,14 +313,153 @@ class AgentCheck(object):
         self.agentConfig = agentConfig
         self.hostname = get_hostname(agentConfig)
         self.log = logging.getLogger('%s.%s' % (__name__, name))
-        self.aggregator = MetricsAggregator(self.hostname, formatter=agent_formatter)
+        if (init_config or {}).get('instance_concurrency'):
+            self.aggregator = LockingMetricsAggregator(self.hostname, formatter=agent_formatter)
+        else:
+            self.aggregator = MetricsAggregator(self.hostname, formatter=agent_formatter)
         self.events = []
         self.instances = instances or []
 
+        # Time of the next run of each instance, see `min_collection_interval`
+        self._next_instance_runs = {}
+        self._last_instance_statuses = {}
+
+        # Measure the memory growth of each instance run. Collecting the
+        # garbage and counting the objects is expensive, so it's opt-in.
+        self.memory_accounting = _is_affirmative(str((agentConfig or {}).get('check_memory_accounting', 'no')))
+
+        # Created on the first request, see `http_get`
+        self._http_client = None
+        # Instance run by the current thread
+        self._local = threading.local()
+
+        # Run the instances concurrently, see `instance_concurrency`
+        self.instance_concurrency = 1
+        self.instance_timeout = DEFAULT_INSTANCE_TIMEOUT
+        try:
+            self.instance_concurrency = max(int((init_config or {}).get('instance_concurrency', 1)), 1)
+            self.instance_timeout = float((init_config or {}).get('instance_timeout', DEFAULT_INSTANCE_TIMEOUT))
+        except (TypeError, ValueError):
+            self.log.warn("Invalid instance_concurrency or instance_timeout, running the instances one after the other")
+            self.instance_concurrency = 1
+        self._instance_pool = None
+        self._running_instances = {} # instance id: job of an instance which timed out
+
+        # Drop the metrics which aren't wanted, see checks.metric_filters
+        self.metric_filter = MetricFilter.from_config(init_config)
+
+        # Fold and cap the events of flapping services, see checks.event_limits
+        self.event_limiter = EventLimiter.from_config(init_config)
+
+        # Record or replay the responses of `http_get`, `get_subprocess_output`
+        # and `socket_request`, see checks.fixtures
+        self.fixtures = None
+
     def instance_count(self):
         """ Return the number of instances that are configured for this check. """
         return len(self.instances)
 
+    def get_min_collection_interval(self, instance):
+        """
+        Return the minimum number of seconds between two runs of an instance,
+        set with `min_collection_interval` in the instance or in init_config.
+        0 means the instance runs on every collector run.
+        """
+        interval = instance.get('min_collection_interval')
+        if interval is None:
+            interval = (self.init_config or {}).get('min_collection_interval', 0)
+        try:
+            return max(float(interval or 0), 0)
+        except (TypeError, ValueError):
+            self.log.warn("Invalid min_collection_interval: %s" % interval)
+            return 0
+
+    def is_instance_due(self, i, now=None):
+        """ Return whether the instance #i has to run now. """
+        if now is None:
+            now = time.time()
+        return now >= self._next_instance_runs.get(i, 0)
+
+    def is_due(self, now=None):
+        """ Return whether at least one instance has to run now. """
+        if now is None:
+            now = time.time()
+        for i in range(len(self.instances)):
+            if self.is_instance_due(i, now):
+                return True
+        return False
+
+    def get_http_client(self):
+        """ Return the HTTP client of the check, see `http_get`. """
+        if self._http_client is None:
+            from checks.http_client import HTTPClient, DEFAULT_TIMEOUT
+            agentConfig = {'version': get_version()}
+            agentConfig.update(self.agentConfig or {})
+            timeout = (self.init_config or {}).get('http_timeout', DEFAULT_TIMEOUT)
+            self._http_client = HTTPClient(headers(agentConfig), timeout)
+        return self._http_client
+
+    def http_get(self, url, username=None, password=None, timeout=None, headers=None,
+            disable_ssl_validation=None):
+        """
+        GET an URL, return the response (a dict of its lowercased headers
+        with a `status` attribute) and its content.
+
+        The connections are kept alive from one run to the next and the
+        responses are gzipped when the server supports it. `timeout`
+        defaults to `http_timeout` in init_config, or 20s. The certificates
+        of HTTPS servers are checked, unless `disable_ssl_validation` is set
+        here or in the instance being run.
+
+        Raise checks.http_client.HTTPError for 4xx and 5xx responses.
+        """
+        client = self.get_http_client()
+        if disable_ssl_validation is None:
+            instance = getattr(self._local, 'instance', None) or {}
+            disable_ssl_validation = _is_affirmative(str(instance.get('disable_ssl_validation', False)))
+        def get():
+            return client.get(url, username, password, timeout, headers, disable_ssl_validation)
+        if self.fixtures is not None:
+            return self.fixtures.http_get(url, get)
+        return get()
+
+    def get_subprocess_output(self, command):
+        """ Run a command (a list of arguments), return its stdout and stderr. """
+        def run():
+            return subprocess.Popen(command, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE).communicate()
+        if self.fixtures is not None:
+            return self.fixtures.get_subprocess_output(command, run)
+        return run()
+
+    def socket_request(self, host, port, data, timeout=None, max_reads=10000, chunk_size=1024):
+        """
+        Send data to a TCP server, return what it sends back until it closes
+        the connection. Raise socket.timeout if it takes more than `timeout`
+        seconds between two reads.
+        """
+        def request():
+            sock = socket.socket()
+            sock.settimeout(timeout)
+            chunks = []
+            try:
+                sock.connect((host, port))
+                sock.sendall(data)
+                chunk = sock.recv(chunk_size)
+                while chunk:
+                    chunks.append(chunk)
+                    if len(chunks) > max_reads:
+                        # Safeguard against an infinite loop
+                        raise CheckException("Read %s bytes before exceeding max reads of %s" %
+                            (sum([len(c) for c in chunks]), max_reads))
+                    chunk = sock.recv(chunk_size)
+            finally:
+                sock.close()
+            return ''.join(chunks)
+        if self.fixtures is not None:
+            return self.fixtures.socket_request(host, port, data, request)
+        return request()
+
     def gauge(self, metric, value, tags=None, hostname=None, device_name=None, timestamp=None):
         """
         Record the value of a gauge, with optional tags, hostname and device
@@ -298,6 +472,8 @@ class AgentCheck(object):
         :param device_name: (optional) The device name for this metric
         :param timestamp: (optional) The timestamp for this metric value
         """
+        if self.metric_filter is not None and not self.metric_filter.keep(metric, tags):
+            return
         self.aggregator.gauge(metric, value, tags, hostname, device_name, timestamp)
 
     def increment(self, metric, value=1, tags=None, hostname=None, device_name=None):
@@ -310,6 +486,8 @@ class AgentCheck(object):
         :param hostname: (optional) A hostname for this metric. Defaults to the current hostname.
         :param device_name: (optional) The device name for this metric
         """
+        if self.metric_filter is not None and not self.metric_filter.keep(metric, tags):
+            return
         self.aggregator.increment(metric, value, tags, hostname, device_name)
 
     def decrement(self, metric, value=-1, tags=None, hostname=None, device_name=None):
@@ -322,6 +500,8 @@ class AgentCheck(object):
         :param hostname: (optional) A hostname for this metric. Defaults to the current hostname.
         :param device_name: (optional) The device name for this metric
         """
+        if self.metric_filter is not None and not self.metric_filter.keep(metric, tags):
+            return
         self.aggregator.decrement(metric, value, tags, hostname, device_name)
 
     def rate(self, metric, value, tags=None, hostname=None, device_name=None):
@@ -336,6 +516,8 @@ class AgentCheck(object):
         :param hostname: (optional) A hostname for this metric. Defaults to the current hostname.
         :param device_name: (optional) The device name for this metric
         """
+        if self.metric_filter is not None and not self.metric_filter.keep(metric, tags):
+            return
         self.aggregator.rate(metric, value, tags, hostname, device_name)
 
     def histogram(self, metric, value, tags=None, hostname=None, device_name=None):
@@ -348,6 +530,8 @@ class AgentCheck(object):
         :param hostname: (optional) A hostname for this metric. Defaults to the current hostname.
         :param device_name: (optional) The device name for this metric
         """
+        if self.metric_filter is not None and not self.metric_filter.keep(metric, tags):
+            return
         self.aggregator.histogram(metric, value, tags, hostname, device_name)
 
     def set(self, metric, value, tags=None, hostname=None, device_name=None):
@@ -360,8 +544,35 @@ class AgentCheck(object):
         :param hostname: (optional) A hostname for this metric. Defaults to the current hostname.
         :param device_name: (optional) The device name for this metric
         """
+        if self.metric_filter is not None and not self.metric_filter.keep(metric, tags):
+            return
         self.aggregator.set(metric, value, tags, hostname, device_name)
 
+    def submit_metrics(self, metrics, tags=None, hostname=None, device_name=None):
+        """
+        Submit several metrics sharing the same tags, hostname and device
+        name. It's faster than calling `gauge`, `rate`... for each metric, as
+        the tags are normalized once for the whole batch.
+
+        :param metrics: An iterable of (name, value, type) rows, where type is
+        one of 'gauge', 'rate', 'increment', 'histogram' or 'set'
+        :param tags: (optional) A list of tags for these metrics
+        :param hostname: (optional) A hostname for these metrics. Defaults to the current hostname.
+        :param device_name: (optional) The device name for these metrics
+        """
+        self.aggregator.submit_metrics(self._get_metric_rows(metrics, tags), tags, hostname, device_name)
+
+    def _get_metric_rows(self, metrics, tags=None):
+        metric_filter = self.metric_filter
+        for name, value, metric_type in metrics:
+            try:
+                mtype = METRIC_TYPES[metric_type]
+            except KeyError:
+                raise CheckException("Unknown metric type %s for %s" % (metric_type, name))
+            if metric_filter is not None and not metric_filter.keep(name, tags):
+                continue
+            yield name, value, mtype
+
     def event(self, event):
         """
         Save an event.
@@ -380,9 +591,17 @@ class AgentCheck(object):
                 "source_type_name": (optional) string, the source type name,
                 "host": (optional) string, the name of the host,
                 "tags": (optional) list, a list of tags to associate with this event
+                "aggregation_key": (optional) string, the events with the same
+                    key are folded together if `event_aggregation_window` is set
             }
+
+        Events appended to `self.events` directly skip the limits set with
+        `event_aggregation_window` and `max_events_per_run`.
         """
-        self.events.append(event)
+        if self.event_limiter is not None:
+            self.event_limiter.add(event)
+        else:
+            self.events.append(event)
 
     def has_events(self):
         """
@@ -391,6 +610,8 @@ class AgentCheck(object):
         @return whether or not the check has saved any events
         @rtype boolean
         """
+        if self.event_limiter is not None and self.event_limiter.has_events():
+            return True
         return len(self.events) > 0
 
     def get_metrics(self):
@@ -404,29 +625,195 @@ class AgentCheck(object):
 
     def get_events(self):
         """
-        Return a list of the events saved by the check, if any
+        Return a list of the events saved by the check, if any. The events
+        appended to `self.events` directly aren't capped by `max_events_per_run`.
 
         @return the list of events saved by this check
         @rtype list of event dictionaries
         """
         events = self.events
         self.events = []
+        if self.event_limiter is not None:
+            events.extend(self.event_limiter.flush())
         return events
 
     def run(self):
-        """ Run all instances. """
-        instance_statuses = []
+        """
+        Run all instances which are due, see `min_collection_interval`.
+        Instances run concurrently if `instance_concurrency` is set in
+        init_config.
+        """
+        instance_statuses = {}
+        due_instances = []
         for i, instance in enumerate(self.instances):
-            try:
-                self.check(instance)
-                instance_status = check_status.InstanceStatus(i, check_status.STATUS_OK)
-            except Exception, e:
-                self.log.exception("Check '%s' instance #%s failed" % (self.name, i))
-                # Send the traceback (located at sys.exc_info()[2]) into the InstanceStatus otherwise a traceback won't be able to be printed
-                instance_status = check_status.InstanceStatus(i, check_status.STATUS_ERROR, e, sys.exc_info()[2])
-            instance_statuses.append(instance_status)
+            now = time.time()
+            if not self.is_instance_due(i, now):
+                # Not due yet, report the status of its last run
+                if i in self._last_instance_statuses:
+                    instance_statuses[i] = self._last_instance_statuses[i]
+                continue
+            self._next_instance_runs[i] = now + self.get_min_collection_interval(instance)
+            if self.instance_concurrency > 1:
+                due_instances.append((i, instance))
+            else:
+                instance_statuses[i] = self._run_instance(i, instance)
+
+        if due_instances:
+            instance_statuses.update(self._run_instances_concurrently(due_instances))
+
+        for i, instance_status in instance_statuses.items():
+            self._last_instance_statuses[i] = instance_status
+        return [instance_statuses[i] for i in sorted(instance_statuses)]
+
+    def _run_instance(self, i, instance, concurrent=False):
+        """
+        Run an instance, return its status. The memory growth of concurrent
+        instances can't be told apart, so it's only measured when the
+        instances run one after the other. The CPU time is the one of the
+        thread running the instance, where it can be measured.
+        """
+        now = time.time()
+        memory_accounting = self.memory_accounting and not concurrent
+        if memory_accounting:
+            # Collect the garbage first, so it isn't counted as growth
+            gc.collect()
+            rss = get_rss()
+            object_count = len(gc.get_objects())
+        http_stats = None
+        if self._http_client is not None:
+            http_stats = self._http_client.get_stats()
+        if self.metric_filter is not None:
+            dropped_count = self.metric_filter.get_dropped_count()
+        if self.event_limiter is not None:
+            folded_event_count = self.event_limiter.get_folded_count()
+            dropped_event_count = self.event_limiter.get_dropped_count()
+        cpu_start = get_thread_cpu_time()
+        self._local.instance = instance
+        try:
+            self.check(instance)
+            instance_status = check_status.InstanceStatus(i, check_status.STATUS_OK)
+        except Exception, e:
+            self.log.exception("Check '%s' instance #%s failed" % (self.name, i))
+            # Send the traceback (located at sys.exc_info()[2]) into the InstanceStatus otherwise a traceback won't be able to be printed
+            instance_status = check_status.InstanceStatus(i, check_status.STATUS_ERROR, e, sys.exc_info()[2])
+        self._local.instance = None
+        instance_status.wall_time = time.time() - now
+        if cpu_start is not None:
+            instance_status.cpu_time = get_thread_cpu_time() - cpu_start
+        if self._http_client is not None:
+            self._set_http_stats(instance_status, http_stats)
+        if self.metric_filter is not None:
+            instance_status.dropped_metrics = self.metric_filter.get_dropped_count() - dropped_count
+        if self.event_limiter is not None:
+            instance_status.folded_events = self.event_limiter.get_folded_count() - folded_event_count
+            instance_status.dropped_events = self.event_limiter.get_dropped_count() - dropped_event_count
+        if memory_accounting:
+            gc.collect()
+            if rss is not None:
+                instance_status.rss_delta = get_rss() - rss
+            instance_status.object_delta = len(gc.get_objects()) - object_count
+        return instance_status
+
+    def _run_instance_job(self, job, instance):
+        job['lock'].acquire()
+        try:
+            if job.get('cancelled'):
+                return None
+            job['start'] = time.time()
+        finally:
+            job['lock'].release()
+        return self._run_instance(job['instance_id'], instance, concurrent=True)
+
+    def _submit_instance(self, pool, i, instance):
+        job = {'instance_id': i, 'instance': instance, 'lock': threading.Lock()}
+        job['result'] = pool.apply_async(self._run_instance_job, (job, instance))
+        return job
+
+    def _cancel_instance(self, job):
+        """ Cancel a job which didn't start yet, return whether it was cancelled. """
+        job['lock'].acquire()
+        try:
+            if 'start' in job:
+                return False
+            job['cancelled'] = True
+            return True
+        finally:
+            job['lock'].release()
+
+    def _wait_instance(self, job, stuck_threads):
+        """
+        Wait for a job to finish or to time out. Return False if it was
+        cancelled because every thread of its pool is stuck.
+        """
+        result = job['result']
+        while not result.wait(INSTANCE_WAIT_STEP):
+            if 'start' in job:
+                if time.time() - job['start'] > self.instance_timeout:
+                    return True
+            elif stuck_threads >= self.instance_concurrency and self._cancel_instance(job):
+                return False
+        return True
+
+    def _run_instances_concurrently(self, instances):
+        """
+        Run (instance id, instance) pairs on a pool of `instance_concurrency`
+        threads, return their statuses by instance id. Instances running for
+        more than `instance_timeout` seconds get an error status and are left
+        running, in a pool of their own.
+        """
+        instance_statuses = {}
+        pending = []
+        for i, instance in instances:
+            running = self._running_instances.get(i)
+            if running is not None and not running['result'].ready():
+                instance_statuses[i] = check_status.InstanceStatus(i, check_status.STATUS_ERROR,
+                    "Still running after %.0fs" % (time.time() - running['start']))
+                continue
+            self._running_instances.pop(i, None)
+            pending.append((i, instance))
+
+        while pending:
+            pool = self._instance_pool
+            if pool is None:
+                pool = self._instance_pool = Pool(self.instance_concurrency,
+                    name='%s-instances' % self.name, daemon=True)
+            jobs = [self._submit_instance(pool, i, instance) for i, instance in pending]
+            pending = []
+            timed_out = 0
+            for job in jobs:
+                i = job['instance_id']
+                if not self._wait_instance(job, timed_out):
+                    # It can't start, run it in the next pool
+                    pending.append((i, job['instance']))
+                    continue
+                if job['result'].ready():
+                    instance_statuses[i] = job['result'].get()
+                    continue
+
+                self.log.error("Check '%s' instance #%s timed out after %ss" % (self.name, i, self.instance_timeout))
+                instance_statuses[i] = check_status.InstanceStatus(i, check_status.STATUS_ERROR,
+                    "Timed out after %ss" % self.instance_timeout)
+                instance_statuses[i].wall_time = time.time() - job['start']
+                self._running_instances[i] = job
+                timed_out += 1
+
+            if timed_out:
+                # The threads running the instances which timed out are
+                # stuck, leave them to this pool and use a new one
+                pool.terminate()
+                self._instance_pool = None
         return instance_statuses
 
+    def _set_http_stats(self, instance_status, previous_stats):
+        # The client may have been created by this run
+        previous_stats = previous_stats or {}
+        stats = self._http_client.get_stats()
+        requests = stats['requests'] - previous_stats.get('requests', 0)
+        if requests:
+            instance_status.http_requests = requests
+            instance_status.http_errors = stats['errors'] - previous_stats.get('errors', 0)
+            instance_status.http_latency = stats['latency'] - previous_stats.get('latency', 0)
+
     def check(self, instance):
         """
         Overriden by the check class. This will be called to run the check.
@@ -440,7 +827,9 @@ class AgentCheck(object):
         """
         To be executed when the agent is being stopped to clean ressources
         """
-        pass
+        if self._instance_pool is not None:
+            self._instance_pool.terminate()
+            self._instance_pool = None
 
     @classmethod
     def from_yaml(cls, path_to_yaml=None, agentConfig=None, yaml_text=None, check_name=None):
@@ -470,15 +859,7 @@ class AgentCheck(object):
         :param metric The metric name to normalize
         :param prefix A prefix to to add to the normalized name, default None
         """
-        name = re.sub(r"[,\+\*\-/()\[\]{}]", "_", metric)
-        # Eliminate multiple _
-        name = re.sub(r"__+", "_", name)
-        # Don't start/end with _
-        name = re.sub(r"^_", "", name)
-        name = re.sub(r"_$", "", name)
-        # Drop ._ and _.
-        name = re.sub(r"\._", ".", name)
-        name = re.sub(r"_\.", ".", name)
+        name = normalize_metric_name(metric)
 
         if prefix is not None:
             return prefix + "." + name
@@ -492,7 +873,7 @@ def agent_formatter(metric, value, timestamp, tags, hostname, device_name=None):
     """
     attributes = {}
     if tags:
-        attributes['tags'] = list(tags)
+        attributes['tags'] = get_tag_list(tags)
     if hostname:
         attributes['hostname'] = hostname
     if device_name:
@@ -502,7 +883,16 @@ def agent_formatter(metric, value, timestamp, tags, hostname, device_name=None):
     return (metric, int(timestamp), value)
 
 
-def run_check(name, path=None):
+def run_check(name, path=None, runs=None, fixtures=None, record=False):
+    """
+    Run a checks.d check with its conf.d config and print what it
+    collected. If `runs` is set, run it that many times and print its
+    benchmark instead, see `benchmark_check`.
+
+    If `fixtures` is a directory, the check gets the responses saved in
+    it instead of talking to the service it monitors. If `record` is set,
+    they're saved in it. See checks.fixtures.
+    """
     from tests.common import get_check
 
     # Read the config file
@@ -520,6 +910,13 @@ def run_check(name, path=None):
     check, instances = get_check(name, config_str)
     if not instances:
         raise Exception('YAML configuration returned no instances.')
+    if fixtures is not None:
+        from checks.fixtures import Fixtures
+        check.fixtures = Fixtures(fixtures, record)
+    if runs:
+        check.instances = instances
+        print_benchmark(benchmark_check(check, runs))
+        return
     for instance in instances:
         check.check(instance)
         if check.has_events():
@@ -527,3 +924,121 @@ def run_check(name, path=None):
             pprint(check.get_events(), indent=4)
         print "Metrics:\n"
         pprint(check.get_metrics(), indent=4)
+
+
+def _get_process_cpu_time():
+    """ CPU time of the whole process, the benchmarked check runs alone. """
+    user, system = os.times()[:2]
+    return user + system
+
+class _BenchmarkClock(object):
+    """
+    A time.time() for the benchmark runs: run i starts at a whole second,
+    `interval` * i seconds after the first one, then the clock goes on at the
+    real pace. The samples of the rates are apart by the same interval
+    whatever the duration of the runs, like in the collector.
+    """
+
+    def __init__(self, interval, real_time=time.time):
+        self.interval = interval
+        self.real_time = real_time
+        self.origin = int(real_time())
+        self.run_start = self.run_time = self.origin
+
+    def start_run(self, i):
+        self.run_start = self.real_time()
+        self.run_time = self.origin + self.interval * i
+
+    def __call__(self):
+        return self.run_time + self.real_time() - self.run_start
+
+def benchmark_check(check, runs=10):
+    """
+    Run all the instances of a check `runs` times, return the stats of each
+    run: wall and CPU times, objects allocated by the run (the ones still
+    there at its end, and the ones kept after a garbage collection), number
+    of metrics and events collected, and the raw and compressed sizes of
+    their payload.
+
+    The runs are spaced by the check frequency (or the longest
+    `min_collection_interval`) on a simulated clock, so the rates get the
+    same samples as in the collector and the stats can be reproduced.
+    Each run ignores the event aggregation windows opened by the
+    previous ones.
+    """
+    import aggregator
+    from config import DEFAULT_CHECK_FREQUENCY
+    from emitter import format_body
+
+    interval = (check.agentConfig or {}).get('check_freq') or DEFAULT_CHECK_FREQUENCY
+    for instance in check.instances:
+        interval = max(interval, check.get_min_collection_interval(instance))
+    real_time, aggregator_time = time.time, aggregator.time
+    clock = _BenchmarkClock(interval, real_time)
+    time.time = aggregator.time = clock
+
+    stats = []
+    try:
+        for i in range(runs):
+            check._next_instance_runs.clear()
+            if check.event_limiter is not None:
+                check.event_limiter.reset()
+            gc.collect()
+            object_count = len(gc.get_objects())
+            clock.start_run(i)
+            start = real_time()
+            cpu_start = _get_process_cpu_time()
+
+            check.run()
+            metrics = check.get_metrics()
+            events = check.get_events()
+
+            run_stats = {
+                'wall_time': real_time() - start,
+                'cpu_time': _get_process_cpu_time() - cpu_start,
+                'objects': len(gc.get_objects()) - object_count,
+                'metrics': len(metrics),
+                'events': len(events),
+            }
+            gc.collect()
+            run_stats['retained_objects'] = len(gc.get_objects()) - object_count
+
+            payload_stats = {}
+            format_body({'metrics': metrics, 'events': {check.name: events}}, payload_stats)
+            run_stats['payload_size'] = payload_stats['raw_size']
+            run_stats['compressed_size'] = payload_stats['compressed_size']
+            stats.append(run_stats)
+    finally:
+        time.time = real_time
+        aggregator.time = aggregator_time
+    return stats
+
+
+BENCHMARK_COLUMNS = [
+    # stat, header, format
+    ('wall_time', 'Wall (s)', '%.4f'),
+    ('cpu_time', 'CPU (s)', '%.4f'),
+    ('objects', 'Objects', '%d'),
+    ('retained_objects', 'Retained', '%d'),
+    ('metrics', 'Metrics', '%d'),
+    ('events', 'Events', '%d'),
+    ('payload_size', 'Payload (B)', '%d'),
+    ('compressed_size', 'Compressed (B)', '%d'),
+]
+
+def print_benchmark(stats):
+    """ Print the stats of `benchmark_check`, one line per run and a summary. """
+    row = "%-6s" + " %14s" * len(BENCHMARK_COLUMNS)
+    print row % tuple(['Run'] + [c[1] for c in BENCHMARK_COLUMNS])
+    for i, run_stats in enumerate(stats):
+        print row % tuple([i + 1] + [fmt % run_stats[k] for k, _, fmt in BENCHMARK_COLUMNS])
+
+    print
+    for name, aggregate in [('min', min), ('avg', lambda v: sum(v) / float(len(v))), ('max', max)]:
+        values = []
+        for k, _, fmt in BENCHMARK_COLUMNS:
+            value = aggregate([s[k] for s in stats])
+            if fmt == '%d' and name == 'avg':
+                fmt = '%.1f'
+            values.append(fmt % value)
+        print row % tuple([name] + values)
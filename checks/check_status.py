@@ -67,6 +67,29 @@ class Stylizer(object):
 def style(*args):
     return Stylizer.stylize(*args)
 
+def format_timing(wall_time, cpu_time=None):
+    """ Format the wall and CPU times of a run, e.g. "1.25s (CPU: 0.40s)" """
+    text = "%.2fs" % wall_time
+    if cpu_time is not None:
+        text += " (CPU: %.2fs)" % cpu_time
+    return text
+
+def format_http_stats(requests, errors, latency):
+    """ Format the HTTP requests of a run, e.g. "3 HTTP requests (1 failed), 12ms avg" """
+    text = "%s HTTP requests" % requests
+    if errors:
+        text += " (%s failed)" % errors
+    text += ", %dms avg" % (latency / requests * 1000)
+    return text
+
+def format_bytes(size):
+    """ Format a signed memory size, e.g. "+1.5MB" """
+    for unit in ['B', 'KB', 'MB']:
+        if abs(size) < 1024:
+            return "%+.1f%s" % (size, unit)
+        size /= 1024.0
+    return "%+.1f%s" % (size, 'GB')
+
 def logger_info():
     loggers = []
     root_logger = logging.getLogger()
@@ -206,10 +229,24 @@ class AgentStatus(object):
 
 class InstanceStatus(object):
 
-    def __init__(self, instance_id, status, error=None, tb=None):
+    def __init__(self, instance_id, status, error=None, tb=None, wall_time=None, cpu_time=None):
         self.instance_id = instance_id
         self.status = status
         self.error = repr(error)
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        # Memory growth during the run, see `check_memory_accounting`
+        self.rss_delta = None
+        self.object_delta = None
+        # Requests sent with AgentCheck.http_get during the run
+        self.http_requests = None
+        self.http_errors = None
+        self.http_latency = None
+        # Metrics dropped by the metric filters of the check
+        self.dropped_metrics = None
+        # Events folded and dropped by the event limits of the check
+        self.folded_events = None
+        self.dropped_events = None
 
         if (type(tb).__name__ == 'traceback'):
             self.traceback = traceback.format_tb(tb)
@@ -222,14 +259,35 @@ class InstanceStatus(object):
 
 class CheckStatus(object):
     
-    def __init__(self, check_name, instance_statuses, metric_count, event_count):
+    def __init__(self, check_name, instance_statuses, metric_count, event_count, timed_out=False,
+            wall_time=None, cpu_time=None):
         self.name = check_name
         self.instance_statuses = instance_statuses
         self.metric_count = metric_count
         self.event_count = event_count
+        self.timed_out = timed_out
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+
+    @property
+    def dropped_metric_count(self):
+        """ Number of metrics dropped by the metric filters of the check. """
+        return sum([getattr(s, 'dropped_metrics', None) or 0 for s in self.instance_statuses])
+
+    @property
+    def folded_event_count(self):
+        """ Number of events folded together by the event limits of the check. """
+        return sum([getattr(s, 'folded_events', None) or 0 for s in self.instance_statuses])
+
+    @property
+    def dropped_event_count(self):
+        """ Number of events dropped by the event limits of the check. """
+        return sum([getattr(s, 'dropped_events', None) or 0 for s in self.instance_statuses])
 
     @property
     def status(self):
+        if self.timed_out:
+            return STATUS_ERROR
         for instance_status in self.instance_statuses:
             if instance_status.status == STATUS_ERROR:
                 return STATUS_ERROR
@@ -237,11 +295,13 @@ class CheckStatus(object):
 
 class EmitterStatus(object):
 
-    def __init__(self, name, error=None):
+    def __init__(self, name, error=None, stats=None):
         self.name = name
         self.error = None
         if error:
             self.error = repr(error)
+        # Serialization stats of the payload returned by the emitter, if any
+        self.stats = stats or {}
 
     @property
     def status(self):
@@ -258,11 +318,18 @@ class CollectorStatus(AgentStatus):
 
     NAME = 'Collector'
 
-    def __init__(self, check_statuses=None, emitter_statuses=None, metadata=None):
+    def __init__(self, check_statuses=None, emitter_statuses=None, metadata=None,
+            emit_backlog=0, emit_dropped=0, scheduler_stats=None, memory_growers=None,
+            worker_stats=None):
         AgentStatus.__init__(self)
         self.check_statuses = check_statuses or []
         self.emitter_statuses = emitter_statuses or []
         self.metadata = metadata or []
+        self.emit_backlog = emit_backlog
+        self.emit_dropped = emit_dropped
+        self.scheduler_stats = scheduler_stats
+        self.memory_growers = memory_growers or []
+        self.worker_stats = worker_stats or []
 
     def body_lines(self):
         # Metadata whitelist
@@ -290,6 +357,22 @@ class CollectorStatus(AgentStatus):
 
         lines.append('')
 
+        # Schedule of the collection runs
+        if self.scheduler_stats and self.scheduler_stats.get('actual_period') is not None:
+            stats = self.scheduler_stats
+            c = 'green'
+            if stats['skipped_runs']:
+                c = 'red'
+            lines += [
+                'Schedule',
+                '========',
+                '',
+                "  Run every %ss, last period: %.2fs, lag: %.2fs" % (
+                    int(stats['period']), stats['actual_period'], stats['lag']),
+                "  Skipped runs: %s" % style(stats['skipped_runs'], c),
+                ''
+            ]
+
         # Checks.d Status
         lines += [
             'Checks',
@@ -304,12 +387,18 @@ class CollectorStatus(AgentStatus):
                     '  ' + cs.name,
                     '  ' + '-' * len(cs.name)
                 ]
+                if cs.timed_out:
+                    check_lines.append("    - %s: the check didn't finish in time, its data wasn't sent" % style('TIMEOUT', 'red'))
                 for s in cs.instance_statuses:
                     c = 'green'
                     if s.has_error():
                         c = 'red'
                     line =  "    - instance #%s [%s]" % (
                              s.instance_id, style(s.status, c))
+                    if s.wall_time is not None:
+                        line += " in %s" % format_timing(s.wall_time, s.cpu_time)
+                    if getattr(s, 'http_requests', None):
+                        line += ", %s" % format_http_stats(s.http_requests, s.http_errors, s.http_latency)
                     if s.has_error():
                         line += u": %s" % s.error
                     check_lines.append(line)
@@ -327,13 +416,55 @@ class CollectorStatus(AgentStatus):
                                     continue
                                 check_lines.append('    ' + line)
 
+                collected_line = "    - Collected %s metrics & %s events" % (cs.metric_count, cs.event_count)
+                if cs.dropped_metric_count:
+                    collected_line += " (%s metrics dropped by the filters)" % cs.dropped_metric_count
+                if cs.folded_event_count or cs.dropped_event_count:
+                    collected_line += " (%s events folded, %s dropped by the limits)" % (
+                        cs.folded_event_count, cs.dropped_event_count)
+                if cs.wall_time is not None:
+                    collected_line += " in %s" % format_timing(cs.wall_time, cs.cpu_time)
                 check_lines += [
-                    "    - Collected %s metrics & %s events" % (cs.metric_count, cs.event_count),
+                    collected_line,
                     ""
                 ]
 
                 lines += check_lines
 
+        # Worker processes running the checks, see `check_processes`
+        if self.worker_stats:
+            lines += [
+                "",
+                "Check workers",
+                "=============",
+                ""
+            ]
+            for ws in self.worker_stats:
+                c = 'green'
+                if ws['crashes']:
+                    c = 'red'
+                pid = ws['pid'] or 'not running'
+                rss = 'unknown'
+                if ws['rss'] is not None:
+                    rss = "%.1fMB" % (ws['rss'] / 1024.0 / 1024.0)
+                lines.append("  - worker #%s (pid: %s): %s runs, RSS: %s, %s restarts, %s" % (
+                    ws['id'], pid, ws['runs'], rss, ws['restarts'], style("%s crashes" % ws['crashes'], c)))
+
+        # Checks which grew the most, see `check_memory_accounting`
+        if self.memory_growers:
+            lines += [
+                "",
+                "Memory growth",
+                "=============",
+                ""
+            ]
+            for name, growth in self.memory_growers:
+                lines.append("  - %s: %s, %+d objects" % (name, format_bytes(growth['rss']), growth['objects']))
+                instances = growth['instances'].items()
+                instances.sort()
+                for instance_id, (rss, objects) in instances:
+                    lines.append("    - instance #%s: %s, %+d objects" % (instance_id, format_bytes(rss), objects))
+
         # Emitter status
         lines += [
             "",
@@ -352,6 +483,19 @@ class CollectorStatus(AgentStatus):
                 if es.status != STATUS_OK:
                     line += ": %s" % es.error
                 lines.append(line)
+                if es.stats.get('compressed_size') is not None:
+                    lines.append("    - Payload: %s bytes, %s compressed, serialized in %.3fs" % (
+                        es.stats['raw_size'], es.stats['compressed_size'], es.stats['serialization_time']))
+
+        if self.emit_backlog or self.emit_dropped:
+            c = 'green'
+            if self.emit_dropped:
+                c = 'red'
+            lines += [
+                "",
+                "  Backlog: %s payloads waiting, %s" % (self.emit_backlog,
+                    style("%s dropped" % self.emit_dropped, c)),
+            ]
 
         return lines
 
@@ -381,15 +525,35 @@ class ForwarderStatus(AgentStatus):
 
     NAME = 'Forwarder'
 
-    def __init__(self, queue_length=0, queue_size=0, flush_count=0):
+    def __init__(self, queue_length=0, queue_size=0, flush_count=0, endpoint_stats=None):
         AgentStatus.__init__(self)
         self.queue_length = queue_length
         self.queue_size = queue_size
         self.flush_count = flush_count
+        self.endpoint_stats = endpoint_stats or {}
 
     def body_lines(self):
-        return [
+        lines = [
             "Queue Size: %s" % self.queue_size,
             "Queue Length: %s" % self.queue_length,
             "Flush Count: %s" % self.flush_count,
         ]
+
+        if self.endpoint_stats:
+            lines += [
+                "",
+                "Endpoints",
+                "=========",
+                ""
+            ]
+            for name, stats in sorted(self.endpoint_stats.items()):
+                lines += [
+                    "  " + name,
+                    "  " + "-" * len(name),
+                    "    - Requests: %s (%s errors)" % (stats['request_count'], stats['error_count']),
+                    "    - Connections: %s new, %s reused" % (stats['new_connections'], stats['reused_connections']),
+                    "    - Circuit breaker: %s" % stats.get('circuit_breaker', 'closed'),
+                    "",
+                ]
+
+        return lines
@@ -4,14 +4,23 @@ import re
 import logging
 import subprocess
 import sys
+import threading
 import time
 import datetime
+import marshal
 import socket
+import tempfile
+from Queue import Queue, Full
+try:
+    import cProfile as profile
+except ImportError:
+    import profile
 
 import modules
 
-from util import get_os, get_uuid, md5, Timer, get_hostname, EC2
-from config import get_version
+from util import get_os, get_uuid, md5, Timer, get_hostname, get_fqdn, EC2, host_metadata_cache, \
+    get_thread_cpu_time
+from config import get_version, _is_affirmative
 
 import checks.system.unix as u
 import checks.system.win32 as w32
@@ -21,7 +30,9 @@ from checks.db.mcache import Memcache
 from checks.ganglia import Ganglia
 from checks.cassandra import Cassandra
 from checks.datadog import Dogstreams, DdForwarder
-from checks.check_status import CheckStatus, CollectorStatus, EmitterStatus
+from checks.check_status import CheckStatus, CollectorStatus, EmitterStatus, InstanceStatus, STATUS_ERROR
+from checks.libs.thread_pool import Pool
+from checks import process_pool
 from resources.processes import Processes as ResProcesses
 
 
@@ -29,6 +40,134 @@ log = logging.getLogger(__name__)
 FLUSH_LOGGING_PERIOD = 10
 FLUSH_LOGGING_INITIAL = 5
 
+# checks.d checks run on a pool of threads, each with a wall-clock budget
+DEFAULT_CHECK_WORKERS = 1
+DEFAULT_CHECK_TIMEOUT = 30 # seconds
+CHECK_WAIT_STEP = 0.5 # seconds
+
+# Checks with the biggest memory growth shown by info
+MEMORY_TOP_GROWERS = 5
+
+# Payloads waiting to be sent by the emitter thread
+DEFAULT_EMIT_QUEUE_SIZE = 2
+# Time given to the emitter thread to send them when the collector stops
+EMITTER_STOP_TIMEOUT = 5 # seconds
+
+def _run_check(check, job):
+    """ Run a checks.d check from a worker of the checks pool. """
+    job['lock'].acquire()
+    try:
+        # The job may have been moved to another pool
+        if job.get('cancelled'):
+            return None
+        job['start'] = time.time()
+    finally:
+        job['lock'].release()
+
+    if job.get('processes') is not None:
+        # Run it in a worker process
+        try:
+            instance_statuses, job['metrics'], job['events'], job['cpu_time'] = \
+                job['processes'].run_check(check, job['checks'])
+            return instance_statuses
+        finally:
+            job['wall_time'] = time.time() - job['start']
+
+    cpu_start = get_thread_cpu_time()
+    profiler = None
+    try:
+        if job.get('profile_threshold'):
+            profiler = profile.Profile()
+            return profiler.runcall(check.run)
+        return check.run()
+    finally:
+        # The instances run on the instance pool use the CPU of other
+        # threads, they only report their own CPU time
+        if cpu_start is not None and getattr(check, 'instance_concurrency', 1) <= 1:
+            job['cpu_time'] = get_thread_cpu_time() - cpu_start
+        job['wall_time'] = time.time() - job['start']
+        if profiler is not None and job['wall_time'] > job['profile_threshold']:
+            _dump_check_profile(check, profiler, job['wall_time'])
+
+def _dump_check_profile(check, profiler, wall_time):
+    try:
+        # A new file, so a link planted in the temporary directory isn't followed
+        fd, path = tempfile.mkstemp(prefix='dd-check-%s-' % check.name, suffix='.prof')
+        f = os.fdopen(fd, 'wb')
+        try:
+            # What Profile.dump_stats writes
+            profiler.create_stats()
+            marshal.dump(profiler.stats, f)
+        finally:
+            f.close()
+        log.info("Check %s ran for %.2fs, its profile was dumped to %s" % (check.name, wall_time, path))
+    except Exception:
+        log.exception("Unable to dump the profile of check %s" % check.name)
+
+class PayloadEmitterThread(threading.Thread):
+    """
+    Send the payloads built by the collector from a background thread, so the
+    next collection can start while the previous payload is being sent.
+    """
+
+    def __init__(self, collector, max_queue_size):
+        threading.Thread.__init__(self, name='emitter')
+        self.daemon = True
+        self.__collector = collector
+        self.__queue = Queue(max_queue_size)
+        self.__dropped = 0
+        self.__statuses = []
+        self.__emit_duration = None
+
+    def run(self):
+        while True:
+            payload = self.__queue.get()
+            if payload is None:
+                return
+            timer = Timer()
+            # Payloads collected before the collector was stopped are still sent
+            self.__statuses = self.__collector._emit(payload, draining=True)
+            self.__emit_duration = timer.step()
+
+    def enqueue(self, payload):
+        try:
+            self.__queue.put(payload, block=False)
+        except Full:
+            self.__dropped += 1
+            log.warn("Dropping payload due to backlog, the emitters can't keep up")
+
+    def stop(self, timeout=EMITTER_STOP_TIMEOUT):
+        """
+        Send the payloads left in the queue and stop, wait for up to `timeout`
+        seconds. The payloads which aren't sent by then are dropped.
+        """
+        deadline = time.time() + timeout
+        try:
+            self.__queue.put(None, timeout=timeout)
+        except Full:
+            pass
+        if threading.currentThread() is not self:
+            self.join(max(deadline - time.time(), 0))
+        if self.isAlive():
+            # It's a daemon thread, it won't prevent the agent from exiting
+            log.warn("Stopping without sending %s payloads, the emitters didn't finish in %ss"
+                % (self.get_backlog() + 1, timeout))
+
+    def get_backlog(self):
+        return self.__queue.qsize()
+
+    def get_dropped_count(self):
+        return self.__dropped
+
+    def get_statuses(self):
+        """ Return the statuses of the emitters for the last payload sent. """
+        return self.__statuses
+
+    def get_emit_duration(self):
+        """ Return how long it took to send the last payload, None if no payload was sent yet. """
+        return self.__emit_duration
+
+
 class Collector(object):
     """
     The collector is responsible for collecting data from each check and
@@ -51,6 +190,58 @@ class Collector(object):
         self.continue_running = True
         self.metadata_cache = None
         self.checks_d = []
+        self.emitter_statuses = [] # of the last payload sent
+
+        # Look up the host metadata in the background, so the first run
+        # doesn't wait for it
+        host_metadata_cache.warm('ec2', EC2.fetch_metadata)
+        host_metadata_cache.warm('fqdn', socket.getfqdn)
+
+        # checks.d pool
+        self.check_workers = int(agentConfig.get('check_workers', DEFAULT_CHECK_WORKERS))
+        self.check_timeout = agentConfig.get('check_timeout')
+        self._checks_pool = None
+
+        # Optionally, the checks.d checks run in worker processes. The pool
+        # of threads then dispatches the checks to the workers.
+        self.check_processes = int(agentConfig.get('check_processes', 0))
+        self._check_processes = None
+        if self.check_processes > 0:
+            if process_pool.is_supported():
+                self._check_processes = process_pool.CheckProcessPool(self.check_processes,
+                    max_runs=int(agentConfig.get('check_process_max_runs', process_pool.DEFAULT_MAX_RUNS)),
+                    max_memory=int(agentConfig.get('check_process_max_memory', process_pool.DEFAULT_MAX_MEMORY)))
+                self.check_workers = max(self.check_workers, self.check_processes)
+            else:
+                log.warn("Check worker processes aren't supported on this platform, running the checks in the collector")
+        # Checks run one after the other aren't timed out by default, like
+        # they were before the pool
+        if self.check_timeout is not None:
+            self.check_timeout = float(self.check_timeout)
+        elif self.check_workers > 1 or self._check_processes is not None:
+            self.check_timeout = DEFAULT_CHECK_TIMEOUT
+        self._running_checks = {} # check name: result of the run which timed out
+        self._last_check_statuses = {}
+
+        # Memory growth of the checks.d checks and instances since they were
+        # loaded: {check name: {'rss': bytes, 'objects': count,
+        # 'instances': {instance id: [bytes, count]}}}
+        self.memory_accounting = _is_affirmative(str(agentConfig.get('check_memory_accounting', 'no')))
+        self.check_reload_memory = int(agentConfig.get('check_reload_memory', 0)) * 1024 * 1024
+        if self.memory_accounting and self.check_workers > 1 and self._check_processes is None:
+            # The memory used by the checks running concurrently in the
+            # collector can't be told apart
+            log.warn("check_memory_accounting isn't supported with check_workers > 1, disabling it")
+            self.memory_accounting = False
+        self._memory_growth = {}
+        self._accounted_statuses = {} # check name: {instance id: last status accounted}
+
+        # Dump the profile of the checks running longer than this (in seconds)
+        self.check_profile_threshold = float(agentConfig.get('check_profile_threshold', 0))
+
+        # Payloads are sent from a background thread, unless emit_queue_size is 0
+        self.emit_queue_size = int(agentConfig.get('emit_queue_size', DEFAULT_EMIT_QUEUE_SIZE))
+        self._emitter_thread = None
         
         # Unix System Checks
         self._unix_system_checks = {
@@ -114,14 +305,22 @@ class Collector(object):
         # Most importantly, don't try to submit to the emitters
         # because the forwarder is quite possibly already killed
         # in which case we'll get a misleading error in the logs.
-        # Best to not even try.
+        # Best to not even try. The payloads already queued for the
+        # emitter thread are the exception, they're sent before stopping.
         self.continue_running = False
+        if self._checks_pool is not None:
+            self._checks_pool.terminate()
+        if self._check_processes is not None:
+            self._check_processes.stop()
+        if self._emitter_thread is not None:
+            self._emitter_thread.stop()
         for check in self.checks_d:
             check.stop()
     
-    def run(self, checksd=None, start_event=True):
+    def run(self, checksd=None, start_event=True, scheduler_stats=None):
         """
         Collect data from each check and submit their data.
+        `scheduler_stats` are the stats of the agent's RunScheduler.
         """
         timer = Timer()
         if self.os != 'windows':
@@ -249,38 +448,9 @@ class Collector(object):
                 metrics.extend(res)
 
         # checks.d checks
-        check_statuses = []
-        checksd = checksd or []
-        for check in checksd:
-            if not self.continue_running:
-                return
-            log.info("Running check %s" % check.name)
-            instance_statuses = [] 
-            metric_count = 0
-            event_count = 0
-            try:
-                # Run the check.
-                instance_statuses = check.run()
-
-                # Collect the metrics and events.
-                current_check_metrics = check.get_metrics()
-                current_check_events = check.get_events()
-
-                # Save them for the payload.
-                metrics.extend(current_check_metrics)
-                if current_check_events:
-                    if check.name not in events:
-                        events[check.name] = current_check_events
-                    else:
-                        events[check.name] += current_check_events
-
-                # Save the status of the check.
-                metric_count = len(current_check_metrics)
-                event_count = len(current_check_events)
-            except Exception, e:
-                log.exception("Error running check %s" % check.name)
-            check_status = CheckStatus(check.name, instance_statuses, metric_count, event_count)
-            check_statuses.append(check_status)
+        check_statuses = self._run_checks_d(checksd or [], metrics, events)
+        if not self.continue_running:
+            return
 
         # Store the metrics and events in the payload.
         payload['metrics'] = metrics
@@ -293,39 +463,330 @@ class Collector(object):
         else:
             payload['metrics'].extend(self._agent_metrics.check(payload, self.agentConfig, 
                 collect_duration, self.emit_duration))
-
-
-        emitter_statuses = self._emit(payload)
-        self.emit_duration = timer.step()
+        if scheduler_stats:
+            payload['metrics'].extend(self._get_scheduler_metrics(scheduler_stats))
+        payload['metrics'].extend(self._get_emitter_metrics(self.emitter_statuses))
+
+        emit_backlog = 0
+        emit_dropped = 0
+        if self.emit_queue_size > 0:
+            # The payload is sent in the background, report the emitters
+            # statuses and duration of the last payload sent
+            if self._emitter_thread is None:
+                self._emitter_thread = PayloadEmitterThread(self, self.emit_queue_size)
+                self._emitter_thread.start()
+            self._emitter_thread.enqueue(payload)
+            timer.step()
+            emitter_statuses = self._emitter_thread.get_statuses()
+            emit_duration = self._emitter_thread.get_emit_duration()
+            if emit_duration is not None:
+                self.emit_duration = emit_duration
+            emit_backlog = self._emitter_thread.get_backlog()
+            emit_dropped = self._emitter_thread.get_dropped_count()
+        else:
+            emitter_statuses = self._emit(payload)
+            self.emit_duration = timer.step()
+        self.emitter_statuses = emitter_statuses
 
         # Persist the status of the collection run.
         try:
-            CollectorStatus(check_statuses, emitter_statuses, self.metadata_cache).persist()
+            CollectorStatus(check_statuses, emitter_statuses, self.metadata_cache,
+                emit_backlog=emit_backlog, emit_dropped=emit_dropped,
+                scheduler_stats=scheduler_stats,
+                memory_growers=self._get_top_memory_growers(),
+                worker_stats=self._get_worker_stats()).persist()
         except Exception:
             log.exception("Error persisting collector status")
 
+        emit_time = round(self.emit_duration or 0, 2)
         if self.run_count <= FLUSH_LOGGING_INITIAL or self.run_count % FLUSH_LOGGING_PERIOD == 0:
             log.info("Finished run #%s. Collection time: %ss. Emit time: %ss" %
-                    (self.run_count, round(collect_duration, 2), round(self.emit_duration, 2)))
+                    (self.run_count, round(collect_duration, 2), emit_time))
             if self.run_count == FLUSH_LOGGING_INITIAL:
                 log.info("First flushes done, next flushes will be logged every %s flushes." % FLUSH_LOGGING_PERIOD)
 
         else:
             log.debug("Finished run #%s. Collection time: %ss. Emit time: %ss" %
-                    (self.run_count, round(collect_duration, 2), round(self.emit_duration, 2)))
+                    (self.run_count, round(collect_duration, 2), emit_time))
+
+
+    def _run_checks_d(self, checksd, metrics, events):
+        """
+        Run the checks.d checks concurrently on the checks pool, and add their
+        metrics and events to the payload. A check which doesn't finish within
+        `check_timeout` seconds is left behind: it's marked as timed out and
+        isn't run again until it finishes. Checks which aren't due yet (see
+        `min_collection_interval`) are skipped and report their last status.
+        """
+        # Forget about the timed out runs which eventually finished
+        for name, result in self._running_checks.items():
+            if result.ready():
+                del self._running_checks[name]
 
+        check_statuses = []
+        jobs = []
+        now = time.time()
+        for check in checksd:
+            job = {'check': check, 'checks': checksd}
+            if not check.is_due(now):
+                log.debug("Check %s isn't due yet, skipping it" % check.name)
+                job['status'] = self._last_check_statuses.get(check.name)
+            elif check.name in self._running_checks:
+                log.warn("Check %s is still running, skipping it" % check.name)
+                job['status'] = CheckStatus(check.name, [], 0, 0, timed_out=True)
+            else:
+                job['lock'] = threading.Lock()
+            jobs.append(job)
+        self._submit_checks([j for j in jobs if 'lock' in j])
+
+        for i, job in enumerate(jobs):
+            if not self.continue_running:
+                return check_statuses
+            check = job['check']
+            if 'lock' not in job:
+                # Skipped
+                if job['status'] is not None:
+                    check_statuses.append(job['status'])
+                continue
+            instance_statuses = []
+            metric_count = 0
+            event_count = 0
+            if not self._wait_for_check(job):
+                log.error("Check %s timed out after %ss, its data won't be sent" % (check.name, self.check_timeout))
+                self._running_checks[check.name] = job['result']
+                check_statuses.append(CheckStatus(check.name, [], 0, 0, timed_out=True))
+                if self._check_processes is not None:
+                    self._check_processes.kill_check(check)
+                # The worker running it is lost, move the checks which
+                # didn't start yet to a new pool
+                self._checks_pool.terminate()
+                self._checks_pool = None
+                resubmitted = []
+                for j, other_job in enumerate(jobs):
+                    if 'lock' in other_job:
+                        other_job = self._cancel_check(other_job)
+                        if other_job is not None:
+                            jobs[j] = other_job
+                            resubmitted.append(other_job)
+                self._submit_checks(resubmitted)
+                continue
+
+            log.info("Ran check %s" % check.name)
+            try:
+                # Get the result of the run.
+                instance_statuses = job['result'].get()
+
+                # Collect the metrics and events.
+                if 'metrics' in job:
+                    # Sent back by a worker process
+                    current_check_metrics = job['metrics']
+                    current_check_events = job['events']
+                else:
+                    current_check_metrics = check.get_metrics()
+                    current_check_events = check.get_events()
+
+                # Save them for the payload.
+                metrics.extend(current_check_metrics)
+                if current_check_events:
+                    if check.name not in events:
+                        events[check.name] = current_check_events
+                    else:
+                        events[check.name] += current_check_events
 
-    def _emit(self, payload):
-        """ Send the payload via the emitters. """
+                # Save the status of the check.
+                metric_count = len(current_check_metrics)
+                event_count = len(current_check_events)
+            except Exception, e:
+                log.exception("Error running check %s" % check.name)
+                if not instance_statuses:
+                    # e.g. its worker process died, report the error on its instances
+                    instance_statuses = [InstanceStatus(i, STATUS_ERROR, e)
+                        for i in range(check.instance_count())]
+            check_status = CheckStatus(check.name, instance_statuses, metric_count, event_count,
+                wall_time=job.get('wall_time'), cpu_time=job.get('cpu_time'))
+            metrics.extend(self._get_check_timing_metrics(check_status))
+            self._last_check_statuses[check.name] = check_status
+            check_statuses.append(check_status)
+
+            if self.memory_accounting:
+                growth = self._account_memory(check_status)
+                if self.check_reload_memory and growth['rss'] > self.check_reload_memory:
+                    checksd[i] = self._reload_check(check)
+
+        return check_statuses
+
+    def _account_memory(self, check_status):
+        """ Add the memory growth of a check run to the growth of the check. """
+        growth = self._memory_growth.setdefault(check_status.name,
+            {'rss': 0, 'objects': 0, 'instances': {}})
+        accounted = self._accounted_statuses.setdefault(check_status.name, {})
+        for s in check_status.instance_statuses:
+            if s.object_delta is None or accounted.get(s.instance_id) is s:
+                # Not measured, or skipped instance reporting its last status
+                continue
+            accounted[s.instance_id] = s
+            instance_growth = growth['instances'].setdefault(s.instance_id, [0, 0])
+            if s.rss_delta is not None:
+                growth['rss'] += s.rss_delta
+                instance_growth[0] += s.rss_delta
+            growth['objects'] += s.object_delta
+            instance_growth[1] += s.object_delta
+        return growth
+
+    def _get_top_memory_growers(self, count=MEMORY_TOP_GROWERS):
+        """ Return the checks which grew the most, as (name, growth) pairs. """
+        growers = [(name, growth) for name, growth in self._memory_growth.items()
+            if growth['rss'] > 0 or growth['objects'] > 0]
+        growers.sort(key=lambda g: (g[1]['rss'], g[1]['objects']), reverse=True)
+        return growers[:count]
+
+    def _reload_check(self, check):
+        """
+        Replace a check with a new instance of its class, to get rid of what
+        it leaked.
+        """
+        growth = self._memory_growth[check.name]
+        log.warn("Check %s grew by %s bytes and %s objects, reloading it" %
+            (check.name, growth['rss'], growth['objects']))
+        try:
+            new_check = check.__class__(check.name, check.init_config,
+                check.agentConfig, instances=check.instances)
+        except Exception:
+            log.exception("Unable to reload check %s" % check.name)
+            return check
+        try:
+            check.stop()
+        except Exception:
+            log.exception("Error stopping check %s" % check.name)
+        del self._memory_growth[check.name]
+        self._accounted_statuses.pop(check.name, None)
+        return new_check
+
+    def _get_worker_stats(self):
+        if self._check_processes is None:
+            return None
+        return self._check_processes.get_stats()
+
+    def _get_emitter_metrics(self, emitter_statuses):
+        """ Return the serialization metrics of the last payload sent. """
+        metrics = []
+        timestamp = int(time.time())
+        for es in emitter_statuses:
+            tags = ['emitter:%s' % es.name]
+            for name, key in [
+                ('datadog.agent.emitter.serialization.time', 'serialization_time'),
+                ('datadog.agent.emitter.payload.size', 'raw_size'),
+                ('datadog.agent.emitter.payload.compressed_size', 'compressed_size')]:
+                if es.stats.get(key) is not None:
+                    metrics.append((name, timestamp, es.stats[key], {'tags': tags}))
+        return metrics
+
+    def _get_scheduler_metrics(self, scheduler_stats):
+        """ Return the datadog.agent.collector.run.* metrics of the agent's schedule. """
+        metrics = []
+        timestamp = int(time.time())
+        for name, key in [
+            ('datadog.agent.collector.run.period', 'actual_period'),
+            ('datadog.agent.collector.run.lag', 'lag'),
+            ('datadog.agent.collector.run.skipped', 'last_skipped_runs')]:
+            value = scheduler_stats.get(key)
+            if value is not None:
+                metrics.append((name, timestamp, value))
+        return metrics
+
+    def _get_check_timing_metrics(self, check_status):
+        """ Return the datadog.agent.check.* metrics of a check run. """
+        metrics = []
+        timestamp = int(time.time())
+        check_tag = 'check:%s' % check_status.name
+        for name, value in [
+            ('datadog.agent.check.run_time', check_status.wall_time),
+            ('datadog.agent.check.cpu_time', check_status.cpu_time)]:
+            if value is not None:
+                metrics.append((name, timestamp, value, {'tags': [check_tag]}))
+        for s in check_status.instance_statuses:
+            tags = [check_tag, 'instance:%s' % s.instance_id]
+            for name, value in [
+                ('datadog.agent.check.instance.run_time', s.wall_time),
+                ('datadog.agent.check.instance.cpu_time', s.cpu_time)]:
+                if value is not None:
+                    metrics.append((name, timestamp, value, {'tags': tags}))
+
+        # Requests sent with AgentCheck.http_get
+        http_statuses = [s for s in check_status.instance_statuses if s.http_requests]
+        if http_statuses:
+            requests = sum([s.http_requests for s in http_statuses])
+            latency = sum([s.http_latency for s in http_statuses])
+            for name, value in [
+                ('datadog.agent.check.http.requests', requests),
+                ('datadog.agent.check.http.errors', sum([s.http_errors for s in http_statuses])),
+                ('datadog.agent.check.http.latency', latency / requests)]:
+                metrics.append((name, timestamp, value, {'tags': [check_tag]}))
+        return metrics
+
+    def _submit_checks(self, jobs):
+        if self._checks_pool is None:
+            self._checks_pool = Pool(self.check_workers, name='checks', daemon=True)
+        for job in jobs:
+            if not self.memory_accounting:
+                job['check'].memory_accounting = False
+            job['profile_threshold'] = self.check_profile_threshold
+            job['processes'] = self._check_processes
+            job['result'] = self._checks_pool.apply_async(_run_check, (job['check'], job))
+
+    def _cancel_check(self, job):
+        """
+        Cancel a job which didn't start yet, return a copy of it to submit
+        to another pool, or None if it started. The cancelled job is left
+        alone: a worker of the old pool may still pick it up.
+        """
+        job['lock'].acquire()
+        try:
+            if 'start' in job or job.get('cancelled'):
+                return None
+            job['cancelled'] = True
+        finally:
+            job['lock'].release()
+        copy = dict(job)
+        del copy['cancelled']
+        del copy['result']
+        copy['lock'] = threading.Lock()
+        return copy
+
+    def _wait_for_check(self, job):
+        """ Wait for a check to finish. Return False if it timed out. """
+        while self.continue_running:
+            result = job['result']
+            start = job.get('start')
+            if start is None:
+                # Still queued
+                timeout = CHECK_WAIT_STEP
+            elif self.check_timeout is None:
+                timeout = CHECK_WAIT_STEP
+            else:
+                timeout = min(start + self.check_timeout - time.time(), CHECK_WAIT_STEP)
+                if timeout <= 0:
+                    return result.ready()
+            if result.wait(timeout):
+                return True
+        return False
+
+    def _emit(self, payload, draining=False):
+        """
+        Send the payload via the emitters. If `draining` is set, it's sent
+        even if the collector is stopping.
+        """
         statuses = []
         for emitter in self.emitters:
             # Don't try to send to an emitter if we're stopping/
-            if not self.continue_running:
+            if not self.continue_running and not draining:
                 return statuses
             name = emitter.__name__
-            emitter_status = EmitterStatus(name)
             try:
-                emitter(payload, log, self.agentConfig)
+                stats = emitter(payload, log, self.agentConfig)
+                if not isinstance(stats, dict):
+                    stats = None
+                emitter_status = EmitterStatus(name, stats=stats)
             except Exception, e:
                 log.exception("Error running emitter: %s" % emitter.__name__)
                 emitter_status = EmitterStatus(name, e)
@@ -397,11 +858,13 @@ class Collector(object):
             except:
                 pass
         try:
-            metadata["socket-fqdn"] = socket.getfqdn()
+            fqdn = get_fqdn()
+            if fqdn:
+                metadata["socket-fqdn"] = fqdn
         except:
             pass
 
-        metadata["hostname"] = get_hostname()
+        metadata["hostname"] = get_hostname(self.agentConfig)
 
         return metadata
 
@@ -0,0 +1,149 @@
+"""
+Aggregate and cap the events of a check, so a flapping service doesn't
+flood the agent with events. The limits are set in the init_config of the
+check:
+
+    event_aggregation_window: the events with the same aggregation_key (or
+        event_object) are folded together for that many seconds. The first
+        one is sent right away, the next ones are sent as one event, the
+        last of them with their count, when the window is over.
+    max_events_per_run: the number of events sent by each run of the check,
+        the next ones are dropped.
+
+Invalid limits are logged and ignored. Only the events saved with
+AgentCheck.event are limited, not the ones appended to AgentCheck.events.
+"""
+
+# stdlib
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class EventLimiter(object):
+
+    def __init__(self, aggregation_window=0, max_events=None):
+        self.aggregation_window = aggregation_window
+        self.max_events = max_events
+        self._events = []
+        # aggregation key: [end of the window, last folded event, folded count]
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def from_config(cls, init_config):
+        """
+        Return the limiter set in the init_config of a check, or None if
+        there isn't any or if a limit is invalid.
+        """
+        init_config = init_config or {}
+        aggregation_window = init_config.get('event_aggregation_window') or 0
+        max_events = init_config.get('max_events_per_run')
+        try:
+            aggregation_window = float(aggregation_window)
+            if max_events is not None:
+                max_events = int(max_events)
+            if aggregation_window < 0 or (max_events is not None and max_events < 0):
+                raise ValueError("negative limit")
+        except (TypeError, ValueError):
+            log.error("Invalid event_aggregation_window (%r) or max_events_per_run (%r), not limiting the events"
+                % (init_config.get('event_aggregation_window'), max_events))
+            return None
+        if not aggregation_window and max_events is None:
+            return None
+        return cls(aggregation_window, max_events)
+
+    def _count(self, name):
+        setattr(self._local, name, getattr(self._local, name, 0) + 1)
+
+    def add(self, event, now=None):
+        """ Save an event, unless it's folded into another one or dropped. """
+        if now is None:
+            now = time.time()
+        key = None
+        if self.aggregation_window:
+            key = event.get('aggregation_key', event.get('event_object'))
+
+        self._lock.acquire()
+        try:
+            if key is not None:
+                window = self._windows.get(key)
+                # A folded event is kept until it's sent, even if its window is over
+                if window is not None and (now < window[0] or window[1] is not None):
+                    window[1] = event
+                    window[2] += 1
+                    self._count('folded')
+                    return
+                self._windows[key] = [now + self.aggregation_window, None, 0]
+
+            if self.max_events is not None and len(self._events) >= self.max_events:
+                self._count('dropped')
+                return
+            self._events.append(event)
+        finally:
+            self._lock.release()
+
+    def has_events(self, now=None):
+        """ Return whether the next flush returns any event. """
+        if self._events:
+            return True
+        if now is None:
+            now = time.time()
+        for end, event, count in self._windows.values():
+            if event is not None and now >= end:
+                return True
+        return False
+
+    def flush(self, now=None):
+        """
+        Return the saved events, and the folded events whose window is
+        over, within `max_events`. Folded events which don't fit are sent
+        by the next flush.
+        """
+        if now is None:
+            now = time.time()
+        self._lock.acquire()
+        try:
+            events = self._events
+            self._events = []
+            for key, (end, event, count) in self._windows.items():
+                if now < end:
+                    continue
+                if event is not None:
+                    if self.max_events is not None and len(events) >= self.max_events:
+                        continue
+                    events.append(self._folded_event(event, count))
+                del self._windows[key]
+            return events
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        """ Forget the saved events and the aggregation windows. """
+        self._lock.acquire()
+        try:
+            self._events = []
+            self._windows = {}
+        finally:
+            self._lock.release()
+
+    def _folded_event(self, event, count):
+        event = dict(event)
+        summary = "%s events with the same aggregation key in %ss, this is the last one." % (
+            count, int(self.aggregation_window))
+        if event.get('msg_text'):
+            event['msg_text'] = "%s\n\n%s" % (event['msg_text'], summary)
+        else:
+            event['msg_text'] = summary
+        return event
+
+    def get_folded_count(self):
+        """ Return the number of events folded by the current thread. """
+        return getattr(self._local, 'folded', 0)
+
+    def get_dropped_count(self):
+        """ Return the number of events dropped by the current thread. """
+        return getattr(self._local, 'dropped', 0)
@@ -0,0 +1,140 @@
+"""
+Record the responses a check gets through AgentCheck.http_get,
+get_subprocess_output and socket_request, and replay them, e.g. to
+benchmark the parsing of a check without the service it monitors:
+
+    check.fixtures = Fixtures('/tmp/haproxy', record=True)
+    check.run() # Talks to haproxy, saves its responses
+    ...
+    check.fixtures = Fixtures('/tmp/haproxy')
+    check.run() # Gets the saved responses
+
+Fixtures are a directory with a file per response and an index.json
+describing them. They can be generated with the add_* methods, e.g. to
+benchmark a check with more backends or queues than a test setup has.
+"""
+
+# stdlib
+import os
+import threading
+
+# project
+from checks.http_client import HTTPError
+from checks.libs.httplib2 import Response
+from util import json
+
+INDEX_FILE = 'index.json'
+
+
+class FixtureNotFound(Exception):
+    pass
+
+
+class Fixtures(object):
+
+    def __init__(self, path, record=False):
+        """
+        Replay the fixtures saved in the `path` directory, or record new
+        ones in it if `record` is set.
+        """
+        self.path = path
+        self.record = record
+        self._lock = threading.Lock()
+        self._index = {}
+        self._bodies = {} # key: body, read once
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            f = open(index_path)
+            try:
+                self._index = json.loads(f.read())
+            finally:
+                f.close()
+        elif record:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        else:
+            raise FixtureNotFound("No fixtures in %s" % path)
+
+    def _add(self, key, body, **attributes):
+        self._lock.acquire()
+        try:
+            entry = self._index.get(key)
+            if entry is None:
+                entry = {'file': '%04d' % len(self._index)}
+            entry.update(attributes)
+            self._index[key] = entry
+            self._bodies[key] = body
+
+            f = open(os.path.join(self.path, entry['file']), 'wb')
+            try:
+                f.write(body)
+            finally:
+                f.close()
+            f = open(os.path.join(self.path, INDEX_FILE), 'w')
+            try:
+                f.write(json.dumps(self._index))
+            finally:
+                f.close()
+        finally:
+            self._lock.release()
+
+    def _get(self, key):
+        """ Return the entry and the body of a fixture. """
+        entry = self._index.get(key)
+        if entry is None:
+            raise FixtureNotFound("No fixture for %s in %s" % (key, self.path))
+        body = self._bodies.get(key)
+        if body is None:
+            f = open(os.path.join(self.path, entry['file']), 'rb')
+            try:
+                body = self._bodies[key] = f.read()
+            finally:
+                f.close()
+        return entry, body
+
+    def add_http(self, url, content, status=200, headers=None, reason='OK'):
+        headers = dict(headers or {})
+        headers['status'] = str(status)
+        self._add('http %s' % url, content, headers=headers, reason=reason)
+
+    def add_subprocess(self, command, stdout, stderr=''):
+        self._add('subprocess %s' % ' '.join(command), stdout, stderr=stderr)
+
+    def add_socket(self, host, port, data, response):
+        self._add('socket %s:%s %s' % (host, port, data), response)
+
+    def http_get(self, url, fetch):
+        """
+        Replay the response to an URL, `fetch` gets it when recording. Raise
+        HTTPError for 4xx and 5xx responses, like HTTPClient.get.
+        """
+        if self.record:
+            try:
+                response, content = fetch()
+            except HTTPError, e:
+                self.add_http(url, '', e.status, reason=e.reason)
+                raise
+            self.add_http(url, content, response.status, response, response.reason)
+            return response, content
+        entry, content = self._get('http %s' % url)
+        status = int(entry['headers']['status'])
+        if status >= 400:
+            raise HTTPError(url, status, entry.get('reason', ''))
+        return Response(entry['headers']), content
+
+    def get_subprocess_output(self, command, fetch):
+        """ Replay the output of a command, `fetch` runs it when recording. """
+        if self.record:
+            stdout, stderr = fetch()
+            self.add_subprocess(command, stdout, stderr)
+            return stdout, stderr
+        entry, stdout = self._get('subprocess %s' % ' '.join(command))
+        return stdout, str(entry['stderr'])
+
+    def socket_request(self, host, port, data, fetch):
+        """ Replay the response to a request, `fetch` sends it when recording. """
+        if self.record:
+            response = fetch()
+            self.add_socket(host, port, data, response)
+            return response
+        return self._get('socket %s:%s %s' % (host, port, data))[1]
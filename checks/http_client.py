@@ -0,0 +1,110 @@
+"""
+HTTP client of the checks polling HTTP endpoints, see AgentCheck.http_get
+
+Connections are kept alive from one run to the next, with one connection per
+host (and per thread, httplib2 isn't thread safe). Responses are gzipped when
+the server supports it, httplib2 decompresses them.
+
+The certificates of HTTPS servers are checked against the CA certificates
+bundled with httplib2, unless `disable_ssl_validation` is set. Basic auth
+credentials are sent with the first request, including over plain HTTP.
+"""
+
+# stdlib
+import base64
+import threading
+import time
+
+# project
+from checks.libs.httplib2 import Http, HttpLib2Error
+
+DEFAULT_TIMEOUT = 20 # seconds
+
+
+class HTTPError(Exception):
+    """ A 4xx or 5xx response. """
+
+    def __init__(self, url, status, reason):
+        Exception.__init__(self, "HTTP Error %s: %s (%s)" % (status, reason, url))
+        self.url = url
+        self.status = status
+        self.reason = reason
+
+
+class HTTPClient(object):
+
+    def __init__(self, headers=None, timeout=DEFAULT_TIMEOUT):
+        """
+        `headers` are sent with every request, `timeout` is the default
+        timeout of the requests, in seconds.
+        """
+        self.headers = headers or {}
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _get_http(self, timeout, disable_ssl_validation=False):
+        # The timeout and the validation of the certificates are set on the
+        # connections, so keep a set of connections per timeout and validation
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        key = (timeout, bool(disable_ssl_validation))
+        if key not in connections:
+            connections[key] = Http(timeout=timeout,
+                disable_ssl_certificate_validation=bool(disable_ssl_validation))
+        return connections[key]
+
+    def _get_stats(self):
+        stats = getattr(self._local, 'stats', None)
+        if stats is None:
+            stats = self._local.stats = {'requests': 0, 'errors': 0, 'latency': 0.0}
+        return stats
+
+    def get_stats(self):
+        """
+        Return the number of requests sent by the current thread, how many
+        failed and their cumulated latency, in seconds.
+        """
+        return dict(self._get_stats())
+
+    def get(self, url, username=None, password=None, timeout=None, headers=None,
+            disable_ssl_validation=False):
+        """
+        GET an URL, with basic authentication if a username is given. Return
+        the response, a dict of the lowercased headers with a `status`
+        attribute, and its content. The certificate of an HTTPS server isn't
+        checked if `disable_ssl_validation` is set.
+
+        Raise HTTPError for 4xx and 5xx responses, HttpLib2Error or
+        socket.error if the request failed.
+        """
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+        if username is not None:
+            credentials = base64.b64encode("%s:%s" % (username, password or ''))
+            request_headers['Authorization'] = 'Basic %s' % credentials
+
+        http = self._get_http(float(timeout or self.timeout), disable_ssl_validation)
+        stats = self._get_stats()
+        stats['requests'] += 1
+        start = time.time()
+        try:
+            try:
+                response, content = http.request(url, 'GET', headers=request_headers)
+            except Exception:
+                stats['errors'] += 1
+                raise
+        finally:
+            stats['latency'] += time.time() - start
+
+        if response.status >= 400:
+            stats['errors'] += 1
+            raise HTTPError(url, response.status, response.reason)
+        return response, content
+
+    def close(self):
+        """ Close the connections of the current thread. """
+        for http in getattr(self._local, 'connections', {}).values():
+            for conn in http.connections.values():
+                conn.close()
+        self._local.connections = {}
@@ -345,6 +345,7 @@ class JmxCheck(AgentCheck):
 
     def stop(self):
         self.kill_jmx_connectors()
+        AgentCheck.stop(self)
 
 
     def kill_jmx_connectors(self):
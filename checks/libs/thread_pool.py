@@ -67,16 +67,19 @@ class Pool(object):
     few different ways
     """
 
-    def __init__(self, nworkers, name="Pool"):
+    def __init__(self, nworkers, name="Pool", daemon=False):
         """
         \param nworkers (integer) number of worker threads to start
         \param name (string) prefix for the worker threads' name
+        \param daemon (boolean) whether the worker threads should let
+        the process exit while they are still running
         """
         self._workq   = Queue.Queue()
         self._closed  = False
         self._workers = []
         for idx in xrange(nworkers):
             thr = PoolWorker(self._workq, name="Worker-%s-%d" % (name, idx))
+            thr.setDaemon(daemon)
             try:
                 thr.start()
             except:
@@ -0,0 +1,116 @@
+"""
+Filter the metrics of a check when they're submitted, so the ones which
+aren't wanted are never aggregated nor sent. The rules are set in the
+init_config of the check:
+
+    include_metrics: only keep the metrics whose name matches a pattern
+    exclude_metrics: drop the metrics whose name matches a pattern
+    include_tags: only keep the metrics with a tag matching a pattern
+    exclude_tags: drop the metrics with a tag matching a pattern
+
+Patterns are globs, e.g. "haproxy.backend.*" or "queue:amq.gen-*", or
+regular expressions when they're prefixed with "re:". Both have to match
+the whole name or tag. Invalid regular expressions are logged and skipped.
+"""
+
+# stdlib
+import fnmatch
+import logging
+import re
+import threading
+
+log = logging.getLogger(__name__)
+
+FILTER_OPTIONS = ['include_metrics', 'exclude_metrics', 'include_tags', 'exclude_tags']
+# Names and tags which were already matched
+CACHE_SIZE = 10000
+
+
+def compile_patterns(patterns):
+    """
+    Compile a list of globs and "re:" prefixed regular expressions, skip
+    the invalid ones.
+    """
+    if not patterns:
+        return []
+    if isinstance(patterns, basestring):
+        patterns = [patterns]
+    regexes = []
+    for pattern in patterns:
+        pattern = str(pattern)
+        if pattern.startswith('re:'):
+            try:
+                regexes.append(re.compile('(?:%s)\Z' % pattern[3:]))
+            except re.error, e:
+                log.error("Skipping the invalid metric filter %r: %s" % (pattern, e))
+        else:
+            regexes.append(re.compile(fnmatch.translate(pattern)))
+    return regexes
+
+
+def _matches(regexes, value):
+    for regex in regexes:
+        if regex.match(value):
+            return True
+    return False
+
+
+class MetricFilter(object):
+
+    def __init__(self, include_metrics=None, exclude_metrics=None, include_tags=None,
+            exclude_tags=None):
+        self.include_metrics = compile_patterns(include_metrics)
+        self.exclude_metrics = compile_patterns(exclude_metrics)
+        self.include_tags = compile_patterns(include_tags)
+        self.exclude_tags = compile_patterns(exclude_tags)
+        self._names = {} # name: whether it's kept
+        self._tags = {} # tag: (whether it's included, whether it's excluded)
+        self._local = threading.local()
+
+    @classmethod
+    def from_config(cls, init_config):
+        """
+        Return the filter set in the init_config of a check, or None if
+        there isn't any.
+        """
+        options = dict([(o, (init_config or {}).get(o)) for o in FILTER_OPTIONS])
+        if not [v for v in options.values() if v]:
+            return None
+        return cls(**options)
+
+    def keep(self, name, tags=None):
+        """ Return whether a metric is kept, count it as dropped if it isn't. """
+        keep = self._names.get(name)
+        if keep is None:
+            keep = self._keep_name(name)
+        if keep and (self.include_tags or self.exclude_tags):
+            keep = self._keep_tags(tags or [])
+        if not keep:
+            self._local.dropped = getattr(self._local, 'dropped', 0) + 1
+        return keep
+
+    def _keep_name(self, name):
+        keep = not self.include_metrics or _matches(self.include_metrics, name)
+        keep = keep and not _matches(self.exclude_metrics, name)
+        if len(self._names) >= CACHE_SIZE:
+            self._names.clear()
+        self._names[name] = keep
+        return keep
+
+    def _keep_tags(self, tags):
+        included = not self.include_tags
+        for tag in tags:
+            matches = self._tags.get(tag)
+            if matches is None:
+                if len(self._tags) >= CACHE_SIZE:
+                    self._tags.clear()
+                matches = self._tags[tag] = (_matches(self.include_tags, tag),
+                    _matches(self.exclude_tags, tag))
+            if matches[1]:
+                return False
+            included = included or matches[0]
+        return included
+
+    def get_dropped_count(self):
+        """ Return the number of metrics dropped by the current thread. """
+        return getattr(self._local, 'dropped', 0)
@@ -0,0 +1,307 @@
+"""
+Run the checks.d checks in worker processes instead of the collector's
+threads, see `check_processes` in datadog.conf.
+
+Workers are fresh interpreters, not forks of the collector: the collector
+runs threads, and a fork made while one of them holds a lock (e.g. of the
+logging module) can deadlock. A worker gets the class and the configuration
+of the checks assigned to it when it starts, and creates its own copies
+of them: a worker is restarted when a check is assigned to it or reloaded.
+
+A check always runs in the same worker, which keeps its state (e.g. the
+samples used to compute rates, the last statuses of its instances) from one
+run to the next. That state isn't sent back to the collector: it's lost when
+the worker is recycled or restarted, so the first run of the new worker
+doesn't report rates.
+"""
+
+# stdlib
+import cPickle as pickle
+import imp
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# project
+from util import get_os, get_rss
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_RUNS = 1000
+DEFAULT_MAX_MEMORY = 256 # MB
+WORKER_STOP_TIMEOUT = 1 # seconds
+
+# Directory of the agent, which the workers import their code from
+AGENT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKER_COMMAND = "import sys; sys.path.insert(0, %r); " \
+    "from checks.process_pool import _worker_main; _worker_main()" % AGENT_PATH
+
+
+class WorkerDied(Exception):
+    pass
+
+
+def is_supported():
+    """ Workers are stopped with signals. """
+    return get_os() != 'windows'
+
+
+def _get_check_spec(check):
+    """ Return what a worker needs to create a copy of a check. """
+    cls = check.__class__
+    path = getattr(sys.modules.get(cls.__module__), '__file__', None)
+    if path is not None and path[-4:] in ('.pyc', '.pyo'):
+        path = path[:-1]
+    return (cls.__module__, path, cls.__name__, check.name, check.init_config,
+        check.agentConfig, check.instances)
+
+
+def _load_check(spec):
+    module_name, path, class_name, name, init_config, agentConfig, instances = spec
+    if module_name == '__main__':
+        # The script run by the collector, e.g. a test
+        module = imp.load_source('dd_worker_main', path)
+    else:
+        try:
+            __import__(module_name)
+            module = sys.modules[module_name]
+        except ImportError:
+            # Not importable by name, e.g. the checks.d modules
+            module = imp.load_source(module_name, path)
+    check_class = getattr(module, class_name)
+    try:
+        return check_class(name, init_config=init_config, agentConfig=agentConfig, instances=instances)
+    except TypeError:
+        # Checks which don't support the instances argument
+        check = check_class(name, init_config=init_config, agentConfig=agentConfig)
+        check.instances = instances
+        return check
+
+
+def _worker_main():
+    """ Main loop of a worker process: run the checks the collector asks for. """
+    # The collector stops its workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The results are sent on stdout, what the checks print goes to stderr
+    requests = sys.stdin
+    results = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+
+    try:
+        sys_path, log_level, specs = pickle.load(requests)
+    except EOFError:
+        return
+    sys.path[:] = sys_path
+    logging.basicConfig(level=log_level,
+        format='%(asctime)s | %(levelname)s | check worker %(process)d | %(name)s | %(message)s')
+
+    checks = {}
+    for spec in specs:
+        try:
+            check = _load_check(spec)
+            checks[check.name] = check
+        except Exception:
+            log.exception("Unable to load check %s" % spec[3])
+
+    while True:
+        try:
+            name = pickle.load(requests)
+        except EOFError:
+            # The collector is gone
+            return
+        if name is None:
+            return
+
+        check = checks.get(name)
+        try:
+            if check is None:
+                raise Exception("Check %s couldn't be loaded in the worker" % name)
+            # The worker only runs this check, its CPU time is the process'
+            cpu_start = sum(os.times()[:2])
+            instance_statuses = check.run()
+            cpu_time = sum(os.times()[:2]) - cpu_start
+            response = (True, (instance_statuses, check.get_metrics(), check.get_events(),
+                check._next_instance_runs, cpu_time, get_rss()))
+        except Exception, e:
+            log.exception("Error running check %s" % name)
+            response = (False, repr(e))
+        pickle.dump(response, results, pickle.HIGHEST_PROTOCOL)
+        results.flush()
+
+
+def _get_check_ids(checks):
+    return dict([(c.name, id(c)) for c in checks])
+
+
+class CheckWorker(object):
+    """ A worker process, seen from the collector. """
+
+    def __init__(self, worker_id, max_runs, max_memory):
+        self.worker_id = worker_id
+        self.max_runs = max_runs
+        self.max_memory = max_memory
+        self.lock = threading.Lock()
+        self.process = None
+        self.check_ids = {} # check name: id of the check object it was started with
+
+        self.runs = 0 # since the worker was started
+        self.total_runs = 0
+        self.restarts = 0
+        self.crashes = 0
+        self.rss = None
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, checks):
+        process = subprocess.Popen([sys.executable, '-c', WORKER_COMMAND],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+        if self.process is not None:
+            self.restarts += 1
+        self.process = process
+        self.check_ids = _get_check_ids(checks)
+        self._send((sys.path, logging.getLogger().getEffectiveLevel(),
+            [_get_check_spec(c) for c in checks]))
+        self.runs = 0
+        self.rss = None
+        log.debug("Started check worker #%s, pid %s" % (self.worker_id, process.pid))
+
+    def _send(self, data):
+        pickle.dump(data, self.process.stdin, pickle.HIGHEST_PROTOCOL)
+        self.process.stdin.flush()
+
+    def stop(self):
+        """ Kill the worker process, it's restarted on its next run. """
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+        try:
+            process.terminate()
+            deadline = time.time() + WORKER_STOP_TIMEOUT
+            while process.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        except OSError:
+            log.exception("Unable to stop check worker #%s" % self.worker_id)
+
+    def run_check(self, check, checks):
+        """
+        Run a check in the worker, return its instance statuses, metrics,
+        events and CPU time. `checks` are the checks assigned to the worker,
+        it's restarted with them when they changed.
+        """
+        self.lock.acquire()
+        try:
+            try:
+                if not self.is_alive() or self.check_ids != _get_check_ids(checks):
+                    # Not started yet, recycled, or its checks changed
+                    self.stop()
+                    self.start(checks)
+                self._send(check.name)
+                ok, result = pickle.load(self.process.stdout)
+            except (EOFError, IOError, pickle.UnpicklingError), e:
+                self.crashes += 1
+                self.stop()
+                raise WorkerDied("Check worker #%s running %s died: %r" % (self.worker_id, check.name, e))
+
+            self.runs += 1
+            self.total_runs += 1
+            if not ok:
+                raise Exception(result)
+
+            instance_statuses, metrics, events, next_instance_runs, cpu_time, self.rss = result
+            # Keep the schedule of the instances in sync with the worker
+            check._next_instance_runs = next_instance_runs
+
+            if self.should_recycle():
+                log.info("Recycling check worker #%s after %s runs, RSS: %s bytes" %
+                    (self.worker_id, self.runs, self.rss))
+                self.stop()
+
+            return instance_statuses, metrics, events, cpu_time
+        finally:
+            self.lock.release()
+
+    def should_recycle(self):
+        if self.max_runs and self.runs >= self.max_runs:
+            return True
+        if self.max_memory and self.rss is not None and self.rss > self.max_memory:
+            return True
+        return False
+
+    def get_stats(self):
+        pid = None
+        if self.is_alive():
+            pid = self.process.pid
+        return {
+            'id': self.worker_id,
+            'pid': pid,
+            'runs': self.total_runs,
+            'restarts': self.restarts,
+            'crashes': self.crashes,
+            'rss': self.rss,
+        }
+
+
+class CheckProcessPool(object):
+    """
+    A pool of worker processes running checks.d checks. Each check is
+    assigned to a worker the first time it runs.
+    """
+
+    def __init__(self, size, max_runs=DEFAULT_MAX_RUNS, max_memory=DEFAULT_MAX_MEMORY):
+        """
+        Workers are recycled after `max_runs` check runs, or when their RSS
+        goes above `max_memory` MB.
+        """
+        self.workers = [CheckWorker(i, max_runs, max_memory * 1024 * 1024) for i in range(size)]
+        self._assignments = {} # check name: worker
+        self._lock = threading.Lock()
+
+    def _assign(self, checks):
+        """
+        Assign the new checks to the workers, return the checks assigned to
+        each worker: {worker: [checks]}.
+        """
+        self._lock.acquire()
+        try:
+            assigned = {}
+            for check in checks:
+                worker = self._assignments.get(check.name)
+                if worker is None:
+                    worker = self.workers[len(self._assignments) % len(self.workers)]
+                    self._assignments[check.name] = worker
+                assigned.setdefault(worker, []).append(check)
+            return assigned
+        finally:
+            self._lock.release()
+
+    def run_check(self, check, checks):
+        """
+        Run a check in its worker. `checks` are all the checks run by the
+        pool, each worker only loads the ones assigned to it.
+        """
+        if check not in checks:
+            checks = list(checks) + [check]
+        assigned = self._assign(checks)
+        worker = self._assignments[check.name]
+        return worker.run_check(check, assigned[worker])
+
+    def kill_check(self, check):
+        """ Kill the worker running a check, e.g. when it timed out. """
+        worker = self._assignments.get(check.name)
+        if worker is not None:
+            worker.stop()
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def get_stats(self):
+        return [w.get_stats() for w in self.workers]
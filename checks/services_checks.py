@@ -54,6 +54,7 @@ class ServicesCheck(AgentCheck):
 
     def stop(self):
         self.stop_pool()
+        AgentCheck.stop(self)
 
     def start_pool(self):
         # The pool size should be the minimum between the number of instances
@@ -158,7 +159,7 @@ class ServicesCheck(AgentCheck):
                     self.notified[name] = Status.UP
 
             if event is not None:
-                self.events.append(event)
+                self.event(event)
 
             # The job is finished here, this instance can be re processed
             del self.jobs_status[name]
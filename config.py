@@ -24,6 +24,24 @@ DEFAULT_STATSD_FREQUENCY = 10  # seconds
 PUP_STATSD_FREQUENCY = 2       # seconds
 LOGGING_MAX_BYTES = 5 * 1024 * 1024
 
+# Options of the Main section of datadog.conf copied as is to agentConfig
+PASSTHROUGH_OPTIONS = [
+    'reload_checks',
+    'check_workers',
+    'check_timeout',
+    'forwarder_max_clients',
+    'forwarder_connect_timeout',
+    'forwarder_request_timeout',
+    'forwarder_shutdown_timeout',
+    'emit_queue_size',
+    'check_profile_threshold',
+    'check_memory_accounting',
+    'check_reload_memory',
+    'check_processes',
+    'check_process_max_runs',
+    'check_process_max_memory',
+]
+
 log = logging.getLogger(__name__)
 
 
@@ -44,6 +62,12 @@ def get_parsed_args():
     parser.add_option('-v', '--verbose', action='store_true', default=False,
                         dest='verbose',
                       help='Print out stacktraces for errors in checks')
+    parser.add_option('-f', '--fixtures', action='store', default=None,
+                        dest='fixtures',
+                      help='Run the check against the responses saved in this directory')
+    parser.add_option('-r', '--record', action='store_true', default=False,
+                        dest='record',
+                      help='Save the responses the check gets in the --fixtures directory')
 
     try:
         options, args = parser.parse_args()
@@ -53,7 +77,9 @@ def get_parsed_args():
                                 'clean': False,
                                 'use_forwarder':False,
                                 'disable_dd':False,
-                                'use_forwarder': False}), []
+                                'use_forwarder': False,
+                                'fixtures': None,
+                                'record': False}), []
     return options, args
 
 
@@ -290,6 +316,11 @@ def get_config(parse_args=True, cfg_path=None, options=None):
             # translate yes into True, the rest into False
             agentConfig['use_ec2_instance_id'] = (use_ec2_instance_id.lower() == 'yes')
 
+        # Options passed as is, they're parsed where they're used
+        for key in PASSTHROUGH_OPTIONS:
+            if config.has_option('Main', key):
+                agentConfig[key] = config.get('Main', key)
+
         if config.has_option('Main', 'check_freq'):
             try:
                 agentConfig['check_freq'] = int(config.get('Main', 'check_freq'))
@@ -552,18 +583,128 @@ def get_ssl_certificate(osname, filename):
     return None
 
 
-def load_check_directory(agentConfig):
-    ''' Return the checks from checks.d. Only checks that have a configuration
-    file in conf.d will be returned. '''
+def get_check_paths(agentConfig):
+    """ Return the checks.d modules, as a list of (check name, path) pairs. """
+    osname = get_os()
+    checks_paths = (glob.glob(os.path.join(path, '*.py')) for path
+                    in [agentConfig['additional_checksd'], get_checksd_path(osname)])
+    paths = []
+    names = set()
+    for check in itertools.chain(*checks_paths):
+        check_name = os.path.basename(check).split('.')[0]
+        if check_name in names:
+            log.debug('Skipping check %s because it has already been loaded from another location', check)
+            continue
+        names.add(check_name)
+        paths.append((check_name, check))
+    return paths
+
+
+def load_check(agentConfig, check_name, check_path, confd_path):
+    """ Load a checks.d check, return None if it isn't configured or fails to load. """
     from util import yaml, yLoader
     from checks import AgentCheck
 
-    checks = {}
+    try:
+        check_module = imp.load_source('checksd_%s' % check_name, check_path)
+    except:
+        log.exception('Unable to import check module %s.py from checks.d' % check_name)
+        return None
+
+    check_class = None
+    classes = inspect.getmembers(check_module, inspect.isclass)
+    for name, clsmember in classes:
+        if clsmember == AgentCheck:
+            continue
+        if issubclass(clsmember, AgentCheck):
+            check_class = clsmember
+            if AgentCheck in clsmember.__bases__:
+                continue
+            else:
+                break
 
-    osname = get_os()
-    checks_paths = (glob.glob(os.path.join(path, '*.py')) for path
-                    in [agentConfig['additional_checksd'], get_checksd_path(osname)])
-    confd_path = get_confd_path(osname)
+    if not check_class:
+        log.error('No check class (inheriting from AgentCheck) found in %s.py' % check_name)
+        return None
+
+    # Check if the config exists OR we match the old-style config
+    conf_path = os.path.join(confd_path, '%s.yaml' % check_name)
+    if os.path.exists(conf_path):
+        f = open(conf_path)
+        try:
+            check_config = yaml.load(f.read(), Loader=yLoader)
+            assert check_config is not None
+            f.close()
+        except:
+            f.close()
+            log.exception("Unable to parse yaml config in %s" % conf_path)
+            return None
+    elif hasattr(check_class, 'parse_agent_config'):
+        # FIXME: Remove this check once all old-style checks are gone
+        try:
+            check_config = check_class.parse_agent_config(agentConfig)
+        except Exception, e:
+            return None
+        if not check_config:
+            return None
+        d = [
+            "Configuring %s in datadog.conf is deprecated." % (check_name),
+            "Please use conf.d. In a future release, support for the",
+            "old style of configuration will be dropped.",
+        ]
+        log.warn(" ".join(d))
+
+    else:
+        log.debug('No conf.d/%s.yaml found for checks.d/%s.py' % (check_name, check_name))
+        return None
+
+    # Look for the per-check config, which *must* exist
+    if not check_config.get('instances'):
+        log.error("Config %s is missing 'instances'" % conf_path)
+        return None
+
+    # Accept instances as a list, as a single dict, or as non-existant
+    instances = check_config.get('instances', {})
+    if type(instances) != type([]):
+        instances = [instances]
+
+    # Init all of the check's classes with
+    init_config = check_config.get('init_config', {})
+    # init_config: in the configuration triggers init_config to be defined
+    # to None.
+    if init_config is None:
+        init_config = {}
+
+    instances = check_config['instances']
+    try:
+        c = check_class(check_name, init_config=init_config,
+                        agentConfig=agentConfig, instances=instances)
+    except TypeError, e:
+        # Backwards compatibility for checks which don't support the
+        # instances argument in the constructor.
+        c = check_class(check_name, init_config=init_config,
+                        agentConfig=agentConfig)
+        c.instances = instances
+
+    # Add custom pythonpath(s) if available
+    if 'pythonpath' in check_config:
+        pythonpath = check_config['pythonpath']
+        if not isinstance(pythonpath, list):
+            pythonpath = [pythonpath]
+        # Each reload of the check loads its config again
+        for path in pythonpath:
+            if path not in sys.path:
+                sys.path.append(path)
+
+    log.debug('Loaded check.d/%s.py' % check_name)
+    return c
+
+
+def load_check_directory(agentConfig):
+    ''' Return the checks from checks.d. Only checks that have a configuration
+    file in conf.d will be returned. '''
+    checks = []
+    confd_path = get_confd_path(get_os())
 
     # For backwards-compatability with old style checks, we have to load every
     # checks.d module and check for a corresponding config OR check if the old
@@ -571,105 +712,99 @@ def load_check_directory(agentConfig):
     #
     # Once old-style checks aren't supported, we'll just read the configs and
     # import the corresponding check module
-    for check in itertools.chain(*checks_paths):
-        check_name = os.path.basename(check).split('.')[0]
-        if check_name in checks:
-            log.debug('Skipping check %s because it has already been loaded from another location', check)
-            continue
-        try:
-            check_module = imp.load_source('checksd_%s' % check_name, check)
-        except:
-            log.exception('Unable to import check module %s.py from checks.d' % check_name)
-            continue
+    for check_name, check_path in get_check_paths(agentConfig):
+        c = load_check(agentConfig, check_name, check_path, confd_path)
+        if c is not None:
+            checks.append(c)
 
-        check_class = None
-        classes = inspect.getmembers(check_module, inspect.isclass)
-        for name, clsmember in classes:
-            if clsmember == AgentCheck:
-                continue
-            if issubclass(clsmember, AgentCheck):
-                check_class = clsmember
-                if AgentCheck in clsmember.__bases__:
-                    continue
-                else:
-                    break
+    log.info('checks.d checks: %s' % [c.name for c in checks])
+    return checks
 
-        if not check_class:
-            log.error('No check class (inheriting from AgentCheck) found in %s.py' % check_name)
-            continue
 
-        # Check if the config exists OR we match the old-style config
-        conf_path = os.path.join(confd_path, '%s.yaml' % check_name)
-        if os.path.exists(conf_path):
-            f = open(conf_path)
-            try:
-                check_config = yaml.load(f.read(), Loader=yLoader)
-                assert check_config is not None
-                f.close()
-            except:
-                f.close()
-                log.exception("Unable to parse yaml config in %s" % conf_path)
-                continue
-        elif hasattr(check_class, 'parse_agent_config'):
-            # FIXME: Remove this check once all old-style checks are gone
-            try:
-                check_config = check_class.parse_agent_config(agentConfig)
-            except Exception, e:
+class CheckDirectoryWatcher(object):
+    """
+    Poll the modification times of the checks.d and conf.d files, and reload
+    the checks whose files changed. The other checks are left alone, so they
+    keep their state and connections.
+    """
+
+    def __init__(self, agentConfig, confd_path=None):
+        self.agentConfig = agentConfig
+        self.confd_path = confd_path or get_confd_path(get_os())
+        self._mtimes = self._get_mtimes()
+
+    def _get_mtimes(self):
+        """ Return [(check name, check path, mtimes of the module and its config)] """
+        mtimes = []
+        for check_name, check_path in get_check_paths(self.agentConfig):
+            conf_path = os.path.join(self.confd_path, '%s.yaml' % check_name)
+            mtimes.append((check_name, check_path, (_get_mtime(check_path), _get_mtime(conf_path))))
+        return mtimes
+
+    def reload(self, checks):
+        """
+        Return the new list of checks: the checks whose files changed are
+        rebuilt, the new ones are loaded and the deleted ones are stopped.
+        `checks` is returned as is if nothing changed.
+        """
+        mtimes = self._get_mtimes()
+        if mtimes == self._mtimes:
+            return checks
+
+        previous = dict([(name, (path, m)) for name, path, m in self._mtimes])
+        self._mtimes = mtimes
+        current = dict([(c.name, c) for c in checks])
+        new_checks = []
+        for check_name, check_path, check_mtimes in mtimes:
+            check = current.pop(check_name, None)
+            if previous.get(check_name) == (check_path, check_mtimes):
+                if check is not None:
+                    new_checks.append(check)
                 continue
-            if not check_config:
+
+            new_check = load_check(self.agentConfig, check_name, check_path, self.confd_path)
+            if new_check is None:
+                if check is not None:
+                    previous_conf_mtime = previous.get(check_name, (None, (None, None)))[1][1]
+                    if previous_conf_mtime is not None and check_mtimes[1] is None:
+                        # Its conf.d config was deleted
+                        log.info("Removing check %s" % check_name)
+                        _stop_check(check)
+                    else:
+                        # e.g. an invalid module or configuration, maybe being
+                        # edited, or a check configured in datadog.conf
+                        log.error("Unable to reload check %s, keeping the running one" % check_name)
+                        new_checks.append(check)
                 continue
-            d = [
-                "Configuring %s in datadog.conf is deprecated." % (check_name),
-                "Please use conf.d. In a future release, support for the",
-                "old style of configuration will be dropped.",
-            ]
-            log.warn(" ".join(d))
 
-        else:
-            log.debug('No conf.d/%s.yaml found for checks.d/%s.py' % (check_name, check_name))
-            continue
+            if check is not None:
+                log.info("Reloading check %s" % check_name)
+                _stop_check(check)
+            else:
+                log.info("Loading new check %s" % check_name)
+            new_checks.append(new_check)
 
-        # Look for the per-check config, which *must* exist
-        if not check_config.get('instances'):
-            log.error("Config %s is missing 'instances'" % conf_path)
-            continue
+        # The checks.d modules which were deleted
+        for check in current.values():
+            log.info("Removing check %s" % check.name)
+            _stop_check(check)
 
-        # Accept instances as a list, as a single dict, or as non-existant
-        instances = check_config.get('instances', {})
-        if type(instances) != type([]):
-            instances = [instances]
+        log.info('checks.d checks: %s' % [c.name for c in new_checks])
+        return new_checks
 
-        # Init all of the check's classes with
-        init_config = check_config.get('init_config', {})
-        # init_config: in the configuration triggers init_config to be defined
-        # to None.
-        if init_config is None:
-            init_config = {}
 
-        instances = check_config['instances']
-        try:
-            c = check_class(check_name, init_config=init_config,
-                            agentConfig=agentConfig, instances=instances)
-        except TypeError, e:
-            # Backwards compatibility for checks which don't support the
-            # instances argument in the constructor.
-            c = check_class(check_name, init_config=init_config,
-                            agentConfig=agentConfig)
-            c.instances = instances
-
-        checks[check_name] = c
-
-        # Add custom pythonpath(s) if available
-        if 'pythonpath' in check_config:
-            pythonpath = check_config['pythonpath']
-            if not isinstance(pythonpath, list):
-                pythonpath = [pythonpath]
-            sys.path.extend(pythonpath)
-
-        log.debug('Loaded check.d/%s.py' % check_name)
-
-    log.info('checks.d checks: %s' % checks.keys())
-    return checks.values()
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _stop_check(check):
+    try:
+        check.stop()
+    except Exception:
+        log.exception("Error stopping check %s" % check.name)
 
 
 #
@@ -17,10 +17,13 @@ from config import get_logging_config
 import os; os.umask(022)
 
 # Standard imports
+import base64
 import logging
 import os
+import stat
 import sys
 import threading
+import time
 import zlib
 from Queue import Queue, Full
 from subprocess import Popen
@@ -29,6 +32,7 @@ from datetime import datetime, timedelta
 from socket import gaierror
 
 # Tornado
+import tornado.httpclient
 import tornado.httpserver
 import tornado.ioloop
 import tornado.web
@@ -36,17 +40,20 @@ from tornado.escape import json_decode
 from tornado.options import define, parse_command_line, options
 
 # agent import
-from util import Watchdog, get_uuid, get_hostname, json
+from aggregator import MetricsAggregator
+from util import Watchdog, PidFile, get_uuid, get_hostname, json
 from emitter import http_emitter, format_body
 from config import get_config
 from checks.check_status import ForwarderStatus
-from transaction import Transaction, TransactionManager
+from transaction import Transaction, TransactionManager, plural
 import modules
 
 log = logging.getLogger('forwarder')
 log.setLevel(get_logging_config()['log_level'] or logging.INFO)
 
 TRANSACTION_FLUSH_INTERVAL = 5000 # Every 5 seconds
+FORWARDER_METRICS_INTERVAL = 15000 # Every 15 seconds
+SIGNAL_POLL_INTERVAL = 500 # Every 0.5 second
 WATCHDOG_INTERVAL_MULTIPLIER = 10 # 10x flush interval
 
 # Maximum delay before replaying a transaction
@@ -57,6 +64,31 @@ MAX_QUEUE_SIZE = 30 * 1024 * 1024 # 30MB
 
 THROTTLING_DELAY = timedelta(microseconds=1000000/2) # 2 msg/second
 
+# Time given to the queue to drain when the forwarder stops
+DEFAULT_SHUTDOWN_TIMEOUT = 5 # seconds
+
+# Where the transactions which couldn't be drained are saved for the next start
+QUEUE_PERSISTENCE_PATH = os.path.join(PidFile.PID_DIR, 'dd-forwarder-queue.json')
+
+# Settings of the HTTP client shared by every transaction
+DEFAULT_MAX_CLIENTS = 10 # concurrent requests
+DEFAULT_CONNECT_TIMEOUT = 10 # seconds
+DEFAULT_REQUEST_TIMEOUT = 20 # seconds
+
+def curl_available():
+    if os.environ.get('USE_SIMPLE_HTTPCLIENT'):
+        return False
+    try:
+        import pycurl
+        return True
+    except ImportError:
+        return False
+
+def decode_payload(data, headers=None):
+    if headers and headers.get('Content-Encoding') == 'deflate':
+        data = zlib.decompress(data)
+    return json_decode(data)
+
 class EmitterThread(threading.Thread):
 
     def __init__(self, *args, **kwargs):
@@ -66,6 +98,7 @@ class EmitterThread(threading.Thread):
         self.__config = kwargs.pop('config')
         self.__max_queue_size = kwargs.pop('max_queue_size', 100)
         self.__queue = Queue(self.__max_queue_size)
+        self.__dropped = 0
         threading.Thread.__init__(self, *args, **kwargs)
         self.daemon = True
 
@@ -82,14 +115,60 @@ class EmitterThread(threading.Thread):
         try:
             self.__queue.put((data, headers), block=False)
         except Full:
+            self.__dropped += 1
             self.__logger.warn('Dropping packet for %r due to backlog', self.__name)
 
+    def get_backlog(self):
+        return self.__queue.qsize()
+
+    def get_dropped_count(self):
+        return self.__dropped
+
+class EmitterDecoderThread(threading.Thread):
+    """Decode the raw payloads once, outside of the IO loop, and hand them
+    over to every emitter thread"""
+
+    def __init__(self, *args, **kwargs):
+        self.__emitter_threads = kwargs.pop('emitter_threads')
+        self.__logger = kwargs.pop('logger')
+        self.__max_queue_size = kwargs.pop('max_queue_size', 100)
+        self.__queue = Queue(self.__max_queue_size)
+        self.__dropped = 0
+        threading.Thread.__init__(self, *args, **kwargs)
+        self.daemon = True
+
+    def run(self):
+        while True:
+            (data, headers) = self.__queue.get()
+            try:
+                data = decode_payload(data, headers)
+            except Exception:
+                self.__logger.error('Unable to decode packet for the custom emitters', exc_info=True)
+                continue
+            for emitterThread in self.__emitter_threads:
+                self.__logger.debug('Queueing for emitter %r', emitterThread.name)
+                emitterThread.enqueue(data, headers)
+
+    def enqueue(self, data, headers):
+        try:
+            self.__queue.put((data, headers), block=False)
+        except Full:
+            self.__dropped += 1
+            self.__logger.warn('Dropping packet for the custom emitters due to backlog')
+
+    def get_backlog(self):
+        return self.__queue.qsize()
+
+    def get_dropped_count(self):
+        return self.__dropped
+
 class EmitterManager(object):
     """Track custom emitters"""
 
     def __init__(self, config):
         self.agentConfig = config
         self.emitterThreads = []
+        self.decoderThread = None
         for emitter_spec in [s.strip() for s in self.agentConfig.get('custom_emitters', '').split(',')]:
             if len(emitter_spec) == 0: continue
             logging.info('Setting up custom emitter %r', emitter_spec)
@@ -104,17 +183,35 @@ class EmitterManager(object):
                 self.emitterThreads.append(thread)
             except Exception, e:
                 logging.error('Unable to start thread for emitter: %r', emitter_spec, exc_info=True)
+        if self.emitterThreads:
+            self.decoderThread = EmitterDecoderThread(
+                name='emitter-decoder',
+                emitter_threads=self.emitterThreads,
+                logger=logging,
+            )
+            self.decoderThread.start()
         logging.info('Done with custom emitters')
 
     def send(self, data, headers=None):
         if not self.emitterThreads:
             return # bypass decompression/decoding
-        if headers and headers.get('Content-Encoding') == 'deflate':
-            data = zlib.decompress(data)
-        data = json_decode(data)
+        # Decoding happens in the decoder thread, don't block the IO loop
+        self.decoderThread.enqueue(data, headers)
+
+    def get_stats(self):
+        """Backlog and dropped packets of the custom emitters"""
+        stats = {}
+        if self.decoderThread is not None:
+            stats[self.decoderThread.name] = {
+                'backlog': self.decoderThread.get_backlog(),
+                'dropped': self.decoderThread.get_dropped_count(),
+            }
         for emitterThread in self.emitterThreads:
-            logging.info('Queueing for emitter %r', emitterThread.name)
-            emitterThread.enqueue(data, headers)
+            stats[emitterThread.name] = {
+                'backlog': emitterThread.get_backlog(),
+                'dropped': emitterThread.get_dropped_count(),
+            }
+        return stats
 
 class MetricTransaction(Transaction):
 
@@ -122,6 +219,8 @@ class MetricTransaction(Transaction):
     _trManager = None
     _endpoints = []
     _emitter_manager = None
+    _http_client = None
+    _request_options = {}
 
     @classmethod
     def set_application(cls, app):
@@ -156,10 +255,50 @@ class MetricTransaction(Transaction):
         except:
             log.info("Not a Datadog user")
 
+    @classmethod
+    def set_http_client(cls):
+        """Build the HTTP client shared by all the transactions. This is done
+        once at startup so connections to the endpoints can be kept alive."""
+        agentConfig = cls._application._agentConfig
+        proxy_settings = agentConfig['proxy_settings']
+        max_clients = int(agentConfig.get('forwarder_max_clients', DEFAULT_MAX_CLIENTS))
+
+        use_proxy = proxy_settings['host'] is not None and proxy_settings['port'] is not None
+        if use_proxy:
+            log.debug("Configuring tornado to use proxy settings: %s:****@%s:%s" % (proxy_settings['user'],
+                proxy_settings['host'], proxy_settings['port']))
+
+        # Only the curl client keeps its connections alive (and supports proxies)
+        if use_proxy or curl_available():
+            log.debug("Using Tornado curl HTTP Client")
+            tornado.httpclient.AsyncHTTPClient.configure("tornado.curl_httpclient.CurlAsyncHTTPClient",
+                max_clients=max_clients)
+        else:
+            log.debug("Using Tornado simple HTTP Client")
+            tornado.httpclient.AsyncHTTPClient.configure(None, max_clients=max_clients)
+        cls._http_client = tornado.httpclient.AsyncHTTPClient()
+
+        cls._request_options = dict(
+            connect_timeout=float(agentConfig.get('forwarder_connect_timeout', DEFAULT_CONNECT_TIMEOUT)),
+            request_timeout=float(agentConfig.get('forwarder_request_timeout', DEFAULT_REQUEST_TIMEOUT)),
+            # The settings below will just be used if we use the CurlAsyncHttpClient of tornado
+            # i.e. in case of connection using a proxy
+            proxy_host=proxy_settings['host'],
+            proxy_port=proxy_settings['port'],
+            proxy_username=proxy_settings['user'],
+            proxy_password=proxy_settings['password'],
+            ca_certs=agentConfig.get('ssl_certificate', None),
+        )
+
     def __init__(self, data, headers):
         self._data = data
         self._headers = headers
 
+        # Each endpoint is delivered independently, only the ones which
+        # didn't acknowledge the data yet are retried
+        self._pending_endpoints = list(self._endpoints)
+        self._in_flight = 0
+
         # Call after data has been set (size is computed in Transaction's init)
         Transaction.__init__(self)
 
@@ -181,48 +320,82 @@ class MetricTransaction(Transaction):
             return self._application._agentConfig[endpoint] + '/intake?api_key=%s' % api_key
         return self._application._agentConfig[endpoint] + '/intake'
 
+    def get_headers(self):
+        headers = dict(self._headers)
+        # Incoming requests may ask for their connection to be closed, this
+        # shouldn't apply to the connections we hold to the endpoints
+        headers['Connection'] = 'keep-alive'
+        return headers
+
+    def is_in_flight(self):
+        return self._in_flight > 0
+
+    def is_required(self, endpoint):
+        # The success of this metric transaction should only depend on
+        # whether or not it's successfully sent to datadoghq. If it fails
+        # getting sent to pup, it's not a big deal.
+        return len(self._endpoints) <= 1 or endpoint == 'dd_url'
+
     def flush(self):
-        for endpoint in self._endpoints:
+        to_send = []
+        for endpoint in list(self._pending_endpoints):
+            if self._trManager.get_circuit_breaker(endpoint).allow_request():
+                to_send.append(endpoint)
+            elif not self.is_required(endpoint):
+                self._pending_endpoints.remove(endpoint)
+
+        if not to_send:
+            if self._pending_endpoints:
+                # Every endpoint left is paused, wait for the first one to be probed
+                retry_date = min([self._trManager.get_circuit_breaker(e).get_retry_date()
+                    for e in self._pending_endpoints])
+                log.debug("Endpoints paused for transaction %d" % self.get_id())
+                self._trManager.tr_deferred(self, retry_date)
+            else:
+                self._trManager.tr_success(self)
+            self._trManager.flush_next()
+            return
+
+        headers = self.get_headers()
+        self._in_flight = len(to_send)
+        for endpoint in to_send:
             url = self.get_url(endpoint)
             log.debug("Sending metrics to endpoint %s at %s" % (endpoint, url))
 
-            # Getting proxy settings
-            proxy_settings = self._application._agentConfig.get('proxy_settings', None)
-            ssl_certificate = self._application._agentConfig.get('ssl_certificate', None)
-
             req = tornado.httpclient.HTTPRequest(url, method="POST",
-                body=self._data, 
-                headers=self._headers, 
-                # The settings below will just be used if we use the CurlAsyncHttpClient of tornado
-                # i.e. in case of connection using a proxy
-                proxy_host=proxy_settings['host'], 
-                proxy_port=proxy_settings['port'],
-                proxy_username=proxy_settings['user'],
-                proxy_password=proxy_settings['password'],
-                ca_certs=ssl_certificate
+                body=self._data,
+                headers=headers,
+                **self._request_options
                 )
 
-            if proxy_settings['host'] is not None and proxy_settings['port'] is not None:
-                log.debug("Configuring tornado to use proxy settings: %s:****@%s:%s" % (proxy_settings['user'],
-                    proxy_settings['host'], proxy_settings['port']))
-                tornado.httpclient.AsyncHTTPClient().configure("tornado.curl_httpclient.CurlAsyncHTTPClient")
-            else:
-                log.debug("Using Tornado simple HTTP Client")
-            http = tornado.httpclient.AsyncHTTPClient()
-            
-
-            # The success of this metric transaction should only depend on
-            # whether or not it's successfully sent to datadoghq. If it fails
-            # getting sent to pup, it's not a big deal.
-            callback = lambda(x): None
-            if len(self._endpoints) <= 1 or endpoint == 'dd_url':
-                callback = self.on_response
+            self._trManager.get_endpoint_stats(endpoint).record_request(len(self._data))
+            callback = lambda response, endpoint=endpoint: self.on_response(endpoint, response)
+            try:
+                self._http_client.fetch(req, callback=callback)
+            except Exception, e:
+                # Handled like a request which got no response, so it's
+                # not counted as in flight anymore
+                log.exception("Unable to send transaction %d to %s" % (self.get_id(), endpoint))
+                self.on_response(endpoint, tornado.httpclient.HTTPResponse(req, 599, error=e))
+
+    def on_response(self, endpoint, response):
+        self._trManager.get_endpoint_stats(endpoint).record_response(response)
+        breaker = self._trManager.get_circuit_breaker(endpoint)
+        if response.error:
+            log.error("Response from %s: %s" % (endpoint, response))
+            breaker.record_failure()
+            if not self.is_required(endpoint):
+                self._pending_endpoints.remove(endpoint)
+        else:
+            breaker.record_success()
+            self._pending_endpoints.remove(endpoint)
 
-            http.fetch(req, callback=callback)
+        # Wait for every endpoint to answer
+        self._in_flight -= 1
+        if self._in_flight > 0:
+            return
 
-    def on_response(self, response):
-        if response.error:
-            log.error("Response: %s" % response)
+        if self._pending_endpoints:
             self._trManager.tr_error(self)
         else:
             self._trManager.tr_success(self)
@@ -230,6 +403,60 @@ class MetricTransaction(Transaction):
         self._trManager.flush_next()
 
 
+def persist_transactions(transactions, path=QUEUE_PERSISTENCE_PATH):
+    """Save the given transactions so that the next forwarder replays them.
+    The file is only readable by the agent user."""
+    # The payloads are usually compressed
+    saved = [(tr.__class__.__name__, base64.b64encode(tr._data), dict(tr._headers))
+        for tr in transactions]
+    try:
+        # Don't follow a link or reuse the permissions of an existing file
+        if os.path.lexists(path):
+            os.remove(path)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+        f = os.fdopen(fd, 'w')
+        try:
+            f.write(json.dumps(saved))
+        finally:
+            f.close()
+        log.info("Saved %s transaction%s to %s" % (len(saved), plural(len(saved)), path))
+    except Exception:
+        log.exception("Unable to save the transactions left in the queue")
+
+def _is_safe_to_load(path):
+    """Whether a file is a regular file of the agent user that no one else
+    can write to"""
+    st = os.lstat(path)
+    if not stat.S_ISREG(st.st_mode):
+        return False
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        return False
+    return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def load_persisted_transactions(path=QUEUE_PERSISTENCE_PATH):
+    """Return the (class name, data, headers) of the transactions saved by
+    the previous forwarder, and forget about them"""
+    if not os.path.lexists(path):
+        return []
+    saved = []
+    try:
+        if not _is_safe_to_load(path):
+            log.error("Not loading the transactions saved in %s, it isn't a file only the agent user can write to" % path)
+        else:
+            f = open(path)
+            try:
+                saved = [(str(class_name), base64.b64decode(data), dict([(str(k), str(v)) for k, v in headers.items()]))
+                    for class_name, data, headers in json.loads(f.read())]
+            finally:
+                f.close()
+    except Exception:
+        log.exception("Unable to load the transactions saved in %s" % path)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return saved
+
 class APIMetricTransaction(MetricTransaction):
 
     def get_url(self, endpoint):
@@ -258,10 +485,37 @@ class StatusHandler(tornado.web.RequestHandler):
                 (tr.get_id(), tr.get_size(), tr.get_error_count(), tr.get_next_flush()))
         self.write("</table>")
 
+        emitter_manager = MetricTransaction._emitter_manager
+        if emitter_manager is not None and emitter_manager.emitterThreads:
+            self.write("<table><tr><td>Emitter</td><td>Backlog</td><td>Dropped</td></tr>")
+            for name, stats in sorted(emitter_manager.get_stats().items()):
+                self.write("<tr><td>%s</td><td>%s</td><td>%s</td></tr>" %
+                    (name, stats['backlog'], stats['dropped']))
+            self.write("</table>")
+
         if threshold >= 0:
             if len(transactions) > threshold:
                 self.set_status(503)
 
+class JSONStatusHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        threshold = int(self.get_argument('threshold', -1))
+
+        m = MetricTransaction.get_tr_manager()
+        stats = m.get_stats()
+
+        emitter_manager = MetricTransaction._emitter_manager
+        if emitter_manager is not None:
+            stats['emitters'] = emitter_manager.get_stats()
+
+        if threshold >= 0:
+            if stats['queue_length'] > threshold:
+                self.set_status(503)
+
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps(stats))
+
 class AgentInputHandler(tornado.web.RequestHandler):
 
     def post(self):
@@ -301,8 +555,15 @@ class Application(tornado.web.Application):
         self._port = int(port)
         self._agentConfig = agentConfig
         self._metrics = {}
+        self._forwarder_aggregator = None
+        self._shutdown_timeout = float(agentConfig.get('forwarder_shutdown_timeout', DEFAULT_SHUTDOWN_TIMEOUT))
+        self._shutting_down = False
+        self._stopped = False
+        # Set by the SIGTERM handler, read by the main loop
+        self._sigterm_count = 0
         MetricTransaction.set_application(self)
         MetricTransaction.set_endpoints()
+        MetricTransaction.set_http_client()
         self._tr_manager = TransactionManager(MAX_WAIT_FOR_REPLAY,
             MAX_QUEUE_SIZE, THROTTLING_DELAY)
         MetricTransaction.set_tr_manager(self._tr_manager)
@@ -339,6 +600,35 @@ class Application(tornado.web.Application):
         else:
             metrics[name] = [[host, device, ts, value]]
 
+    def _submit_forwarder_metrics(self):
+        """Submit the forwarder's own statistics as datadog.forwarder.* metrics"""
+        if self._forwarder_aggregator is None:
+            self._forwarder_aggregator = MetricsAggregator(get_hostname(self._agentConfig),
+                interval=FORWARDER_METRICS_INTERVAL / 1000)
+        aggregator = self._forwarder_aggregator
+        stats = self._tr_manager.get_stats()
+
+        aggregator.gauge('datadog.forwarder.queue.length', stats['queue_length'])
+        aggregator.gauge('datadog.forwarder.queue.size', stats['queue_size'])
+        aggregator.gauge('datadog.forwarder.in_flight', stats['in_flight'])
+        aggregator.rate('datadog.forwarder.bytes_in', stats['bytes_in'])
+        aggregator.rate('datadog.forwarder.bytes_out', stats['bytes_out'])
+        if stats['flush_duration'] is not None:
+            aggregator.gauge('datadog.forwarder.flush.duration', stats['flush_duration'])
+        for name, value in stats['latency'].items():
+            if value is not None:
+                aggregator.gauge('datadog.forwarder.latency.%s' % name, value)
+        for endpoint, endpoint_stats in stats['endpoints'].items():
+            tags = ['endpoint:%s' % endpoint]
+            successes = endpoint_stats['request_count'] - endpoint_stats['error_count']
+            aggregator.rate('datadog.forwarder.requests.success', successes, tags=tags)
+            aggregator.rate('datadog.forwarder.requests.error', endpoint_stats['error_count'], tags=tags)
+
+        metrics = aggregator.flush()
+        if metrics:
+            APIMetricTransaction(json.dumps({'series': metrics}),
+                headers={'Content-Type': 'application/json'})
+
     def _postMetrics(self):
 
         if len(self._metrics) > 0:
@@ -349,11 +639,24 @@ class Application(tornado.web.Application):
                 headers={'Content-Type': 'application/json'})
             self._metrics = {}
 
+    def _replay_persisted_transactions(self):
+        transaction_classes = {
+            'MetricTransaction': MetricTransaction,
+            'APIMetricTransaction': APIMetricTransaction,
+        }
+        saved = load_persisted_transactions()
+        if saved:
+            log.info("Replaying %s transaction%s saved at the last shutdown" % (len(saved), plural(len(saved))))
+        for class_name, data, headers in saved:
+            if class_name in transaction_classes:
+                transaction_classes[class_name](data, headers)
+
     def run(self):
         handlers = [
             (r"/intake/?", AgentInputHandler),
             (r"/api/v1/series/?", ApiInputHandler),
             (r"/status/?", StatusHandler),
+            (r"/status/json/?", JSONStatusHandler),
         ]
 
         settings = dict(
@@ -367,6 +670,7 @@ class Application(tornado.web.Application):
 
         tornado.web.Application.__init__(self, handlers, **settings)
         http_server = tornado.httpserver.HTTPServer(self)
+        self._http_server = http_server
 
         # non_local_traffic must be == True to match, not just some non-false value
         if non_local_traffic is True:
@@ -395,6 +699,10 @@ class Application(tornado.web.Application):
         tr_sched = tornado.ioloop.PeriodicCallback(flush_trs,TRANSACTION_FLUSH_INTERVAL,
             io_loop = self.mloop)
 
+        metrics_sched = tornado.ioloop.PeriodicCallback(self._submit_forwarder_metrics,
+            FORWARDER_METRICS_INTERVAL, io_loop = self.mloop)
+        self._schedulers = [tr_sched, metrics_sched]
+
         # Register optional Graphite listener
         gport = self._agentConfig.get("graphite_listen_port", None)
         if gport is not None:
@@ -410,6 +718,16 @@ class Application(tornado.web.Application):
         if self._watchdog:
             self._watchdog.reset()
         tr_sched.start()
+        metrics_sched.start()
+
+        # Handle the signals received by the process in the main loop, the
+        # loop can't be called from a signal handler
+        signal_sched = tornado.ioloop.PeriodicCallback(self._handle_sigterm,
+            SIGNAL_POLL_INTERVAL, io_loop = self.mloop)
+        signal_sched.start()
+
+        # Send what the previous forwarder couldn't
+        self.mloop.add_callback(self._replay_persisted_transactions)
 
         self.mloop.start()
         log.info("Stopped")
@@ -417,6 +735,46 @@ class Application(tornado.web.Application):
     def stop(self):
         self.mloop.stop()
 
+    def _handle_sigterm(self):
+        if not self._sigterm_count:
+            return
+        if self._sigterm_count > 1:
+            log.info("caught sigterm again. stopping")
+            self.stop()
+        elif not self._shutting_down:
+            log.info("caught sigterm. draining the queue before stopping")
+            self.shutdown()
+
+    def shutdown(self):
+        """Stop accepting data, and drain the queue until the shutdown timeout.
+        The transactions left are saved to be replayed at the next start."""
+        if self._shutting_down:
+            return
+        self._shutting_down = True
+        log.info("Draining the queue for %ss before stopping" % self._shutdown_timeout)
+
+        self._http_server.stop()
+        for scheduler in self._schedulers:
+            scheduler.stop()
+        if self._watchdog:
+            # Leave room for the drain
+            self._watchdog.reset()
+
+        self._postMetrics()
+        self.mloop.add_timeout(time.time() + self._shutdown_timeout, self._stop_after_drain)
+        self._tr_manager.drain(self._stop_after_drain)
+
+    def _stop_after_drain(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        transactions = self._tr_manager.get_transactions()
+        if transactions:
+            persist_transactions(transactions)
+        else:
+            log.info("Queue drained")
+        self.stop()
+
 def init():
     agentConfig = get_config(parse_args = False)
 
@@ -429,8 +787,10 @@ def init():
     app = Application(port, agentConfig)
 
     def sigterm_handler(signum, frame):
-        log.info("caught sigterm. stopping")
-        app.stop()
+        # Only set a flag: the main loop may hold its locks when the signal
+        # arrives. It drains the queue at the first signal, and stops at the
+        # second one, see Application._handle_sigterm.
+        app._sigterm_count += 1
 
     import signal
     signal.signal(signal.SIGTERM, sigterm_handler)
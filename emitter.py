@@ -1,3 +1,4 @@
+import time
 import zlib
 import sys
 from pprint import pformat as pp
@@ -20,9 +21,102 @@ def get_http_library(proxy_settings, use_forwarder):
         import urllib2proxy as urllib2
     return urllib2 
 
-def format_body(message):
-    payload = json.dumps(message)
-    return zlib.compress(payload)
+# Serialized chunks are buffered up to this size before being compressed
+CHUNK_SIZE = 64 * 1024
+CONTAINER_TYPES = (dict, list, tuple)
+
+def _json_key(key):
+    """ Convert a dict key to a string, the way json.dumps does. """
+    if isinstance(key, basestring):
+        return key
+    if key is True:
+        return 'true'
+    if key is False:
+        return 'false'
+    if key is None:
+        return 'null'
+    if isinstance(key, (int, long, float)):
+        return json.dumps(key)
+    raise TypeError("key %r is not a string" % (key,))
+
+def iter_json(obj):
+    """
+    Serialize obj to JSON piece by piece, so that big payloads never have to
+    be held as a single string. Dicts and lists holding other dicts or lists
+    are streamed element by element, whatever their depth, e.g. each row of
+    the process list is a chunk. The others are serialized in one go.
+    """
+    if isinstance(obj, dict):
+        values = obj.itervalues()
+    elif isinstance(obj, (list, tuple)):
+        values = obj
+    else:
+        values = ()
+    for value in values:
+        if isinstance(value, CONTAINER_TYPES):
+            break
+    else:
+        yield json.dumps(obj)
+        return
+
+    if isinstance(obj, dict):
+        yield '{'
+        first = True
+        for key, value in obj.iteritems():
+            if first:
+                first = False
+            else:
+                yield ','
+            yield json.dumps(_json_key(key))
+            yield ':'
+            for chunk in iter_json(value):
+                yield chunk
+        yield '}'
+    else:
+        yield '['
+        first = True
+        for value in obj:
+            if first:
+                first = False
+            else:
+                yield ','
+            for chunk in iter_json(value):
+                yield chunk
+        yield ']'
+
+def format_body(message, stats=None):
+    """
+    Return the deflate-compressed JSON serialization of message. It's
+    serialized and compressed incrementally, which bounds the memory needed
+    on top of the compressed body.
+
+    If `stats` is a dict, it's filled with the serialization time, and the
+    raw and compressed sizes of the body.
+    """
+    start = time.time()
+    compressor = zlib.compressobj()
+    compressed = []
+    buf = []
+    buf_size = 0
+    raw_size = 0
+    for chunk in iter_json(message):
+        buf.append(chunk)
+        buf_size += len(chunk)
+        if buf_size >= CHUNK_SIZE:
+            compressed.append(compressor.compress(''.join(buf)))
+            raw_size += buf_size
+            buf = []
+            buf_size = 0
+    compressed.append(compressor.compress(''.join(buf)))
+    raw_size += buf_size
+    compressed.append(compressor.flush())
+    body = ''.join(compressed)
+
+    if stats is not None:
+        stats['serialization_time'] = time.time() - start
+        stats['raw_size'] = raw_size
+        stats['compressed_size'] = len(body)
+    return body
 
 def post_headers(agentConfig, payload):
     return {
@@ -34,10 +128,16 @@ def post_headers(agentConfig, payload):
     }
 
 def http_emitter(message, logger, agentConfig):
+    """
+    Post the payload to the intake, return the stats of its serialization.
+    """
     logger.debug('http_emitter: start')
 
     # Post back the data
-    postBackData = format_body(message)
+    stats = {}
+    postBackData = format_body(message, stats)
+    logger.debug('http_emitter: serialized the payload in %.3fs, %s bytes compressed to %s' %
+        (stats['serialization_time'], stats['raw_size'], stats['compressed_size']))
 
     logger.debug('http_emitter: attempting postback to ' + agentConfig['dd_url'])
 
@@ -69,6 +169,8 @@ def http_emitter(message, logger, agentConfig):
         else:
             raise
 
+    return stats
+
 def get_opener(logger, proxy_settings, use_forwarder, urllib2):
     if use_forwarder:
         # We are using the forwarder, so it's local trafic. We don't use the proxy
@@ -1,9 +1,13 @@
 """
-Performance tests for the agent/dogstatsd metrics aggregator.
+Performance tests for the agent/dogstatsd metrics aggregator, and the
+sample store of the legacy checks.
 """
 
+import logging
+import time
 
 from aggregator import MetricsAggregator
+from checks import Check
 
 
 
@@ -13,6 +17,8 @@ class TestAggregatorPerf(object):
     FLUSH_COUNT = 10
     LOOPS_PER_FLUSH = 2000
     METRIC_COUNT = 5
+    COUNTER_COUNT = 200
+    COUNTER_FLUSH_COUNT = 500
 
     def test_dogstatsd_aggregation_perf(self):
         ma = MetricsAggregator('my.host')
@@ -54,8 +60,23 @@ class TestAggregatorPerf(object):
                     ma.set('set.%s' % j, float(i))
             ma.flush()
 
+    def test_legacy_check_samples_perf(self):
+        """ Save and flush tagged counters, print the time per sample. """
+        check = Check(logging.getLogger(__name__))
+        for j in xrange(self.COUNTER_COUNT):
+            check.counter('counter.%s' % j)
+
+        start = time.time()
+        for i in xrange(self.COUNTER_FLUSH_COUNT):
+            for j in xrange(self.COUNTER_COUNT):
+                check.save_sample('counter.%s' % j, i, timestamp=i, tags=['tag1', 'tag2'])
+            check.get_metrics()
+        duration = time.time() - start
+        print "%.2fus per sample" % (duration * 1e6 / (self.COUNTER_FLUSH_COUNT * self.COUNTER_COUNT))
+
 
 if __name__ == '__main__':
     t = TestAggregatorPerf()
     t.test_dogstatsd_aggregation_perf()
     #t.test_checksd_aggregation_perf()
+    #t.test_legacy_check_samples_perf()
@@ -0,0 +1,49 @@
+"""
+Performance tests for the metric submission of checks.d checks: one call
+per metric vs. AgentCheck.submit_metrics.
+"""
+import time
+
+from checks import AgentCheck
+
+
+class TestCheckSubmissionPerf(object):
+
+    FLUSH_COUNT = 10
+    LOOPS_PER_FLUSH = 200
+    METRIC_COUNT = 50
+    TAGS = ['instance:my_instance', 'backend:web', 'service:frontend', 'env:prod']
+
+    def get_check(self):
+        return AgentCheck('bench', {}, {'hostname': 'my.host'}, [{}])
+
+    def report(self, name, elapsed):
+        count = self.FLUSH_COUNT * self.LOOPS_PER_FLUSH * self.METRIC_COUNT
+        print "%s: %.2fus per metric" % (name, elapsed / count * 1000000)
+
+    def test_single_submission_perf(self):
+        check = self.get_check()
+        names = ['metric.%s' % j for j in xrange(self.METRIC_COUNT)]
+        start = time.time()
+        for _ in xrange(self.FLUSH_COUNT):
+            for i in xrange(self.LOOPS_PER_FLUSH):
+                for name in names:
+                    check.gauge(name, i, tags=self.TAGS)
+            check.get_metrics()
+        self.report("One call per metric", time.time() - start)
+
+    def test_bulk_submission_perf(self):
+        check = self.get_check()
+        names = ['metric.%s' % j for j in xrange(self.METRIC_COUNT)]
+        start = time.time()
+        for _ in xrange(self.FLUSH_COUNT):
+            for i in xrange(self.LOOPS_PER_FLUSH):
+                check.submit_metrics([(name, i, 'gauge') for name in names], tags=self.TAGS)
+            check.get_metrics()
+        self.report("submit_metrics", time.time() - start)
+
+
+if __name__ == '__main__':
+    t = TestCheckSubmissionPerf()
+    t.test_single_submission_perf()
+    t.test_bulk_submission_perf()
@@ -0,0 +1,104 @@
+"""
+Performance tests of checks.d checks against large generated fixtures
+(see checks/fixtures.py): haproxy with thousands of backends, rabbitmq with
+thousands of queues and varnish with thousands of stats. The responses are
+replayed, so only the parsing and the submission of the metrics are measured.
+
+The rabbitmq check only collects the first 100 queues and nodes (the
+limit isn't configurable), so its run mostly measures the parsing of the
+large responses: it submits about a hundred metrics, whatever the number
+of queues.
+"""
+import shutil
+import tempfile
+
+from checks import benchmark_check, print_benchmark
+from checks.fixtures import Fixtures
+from tests.common import load_check
+from util import json
+
+AGENT_CONFIG = {'hostname': 'my.host', 'version': '0.1'}
+
+HAPROXY_FIELDS = ['pxname', 'svname', 'qcur', 'qmax', 'scur', 'smax', 'slim', 'stot', 'bin',
+    'bout', 'dreq', 'dresp', 'ereq', 'econ', 'eresp', 'wretr', 'wredis', 'status', 'weight',
+    'act', 'bck', 'chkfail', 'chkdown', 'lastchg', 'downtime', 'qlimit', 'pid', 'iid', 'sid',
+    'throttle', 'lbtot', 'tracked', 'type', 'rate', 'rate_lim', 'rate_max']
+
+
+class TestChecksPerf(object):
+
+    RUNS = 5
+    HAPROXY_BACKENDS = 2000
+    HAPROXY_SERVERS = 4 # per backend
+    RABBITMQ_QUEUES = 50000
+    RABBITMQ_NODES = 100
+    VARNISH_BACKENDS = 2000
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def run_check(self, name, instance):
+        check = load_check(name, {'init_config': {}, 'instances': [instance]}, AGENT_CONFIG)
+        check.fixtures = Fixtures(self.path)
+        print "%s:" % name
+        print_benchmark(benchmark_check(check, self.RUNS))
+        print
+
+    def _haproxy_row(self, pxname, svname, i):
+        values = dict([(f, str(i)) for f in HAPROXY_FIELDS])
+        values.update({'pxname': pxname, 'svname': svname, 'status': 'UP'})
+        return ','.join([values[f] for f in HAPROXY_FIELDS]) + ','
+
+    def test_haproxy_perf(self):
+        lines = ['# %s,' % ','.join(HAPROXY_FIELDS)]
+        lines.append(self._haproxy_row('frontend', 'FRONTEND', 0))
+        for i in xrange(self.HAPROXY_BACKENDS):
+            for j in xrange(self.HAPROXY_SERVERS):
+                lines.append(self._haproxy_row('backend_%s' % i, 'server_%s' % j, i + j))
+            lines.append(self._haproxy_row('backend_%s' % i, 'BACKEND', i))
+
+        url = 'http://localhost/admin?stats'
+        Fixtures(self.path, record=True).add_http(url + ';csv;norefresh', '\n'.join(lines))
+        self.run_check('haproxy', {'url': url})
+
+    def test_rabbitmq_perf(self):
+        url = 'http://localhost:55672/api/'
+        queues = [{'name': 'queue_%s' % i, 'vhost': '/', 'active_consumers': 1, 'consumers': 2,
+            'memory': 1024 * i, 'messages': i, 'messages_ready': i, 'messages_unacknowledged': 0}
+            for i in xrange(self.RABBITMQ_QUEUES)]
+        nodes = [{'name': 'rabbit@node_%s' % i, 'disk_free': 1000000, 'fd_used': i, 'mem_used': i,
+            'proc_used': i, 'run_queue': 0, 'sockets_used': i} for i in xrange(self.RABBITMQ_NODES)]
+
+        fixtures = Fixtures(self.path, record=True)
+        fixtures.add_http(url + 'queues', json.dumps(queues))
+        fixtures.add_http(url + 'nodes', json.dumps(nodes))
+        # Only the first 100 queues and nodes are collected
+        self.run_check('rabbitmq', {'rabbitmq_api_url': url})
+
+    def test_varnish_perf(self):
+        stats = ['<varnishstat>']
+        for i in xrange(self.VARNISH_BACKENDS):
+            for name, flag in (('vcls', 'i'), ('happy', 'i'), ('bereq_hdrbytes', 'a'),
+                    ('bereq_bodybytes', 'a'), ('conn', 'a')):
+                stats.append('<stat><type>VBE</type><ident>backend_%s(127.0.0.1,,%s)</ident>'
+                    '<name>%s</name><value>%s</value><flag>%s</flag><description>%s</description>'
+                    '</stat>' % (i, 8000 + i, name, i, flag, name))
+        stats.append('</varnishstat>')
+
+        fixtures = Fixtures(self.path, record=True)
+        fixtures.add_subprocess(['varnishstat', '-V'], 'varnishstat (varnish-3.0.3 revision 9e6a70f)\n')
+        fixtures.add_subprocess(['varnishstat', '-x'], '\n'.join(stats))
+        self.run_check('varnish', {'varnishstat': 'varnishstat'})
+
+
+if __name__ == '__main__':
+    t = TestChecksPerf()
+    for test in (t.test_haproxy_perf, t.test_rabbitmq_perf, t.test_varnish_perf):
+        t.setUp()
+        try:
+            test()
+        finally:
+            t.tearDown()
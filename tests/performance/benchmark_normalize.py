@@ -0,0 +1,50 @@
+"""
+Performance tests for the metric name normalization of the checks, e.g.
+the varnish check normalizes every stat on every run.
+"""
+import re
+import time
+
+import checks
+from checks import normalize_metric_name
+
+
+def normalize_uncached(metric):
+    # The normalization without precompiled patterns nor cache
+    name = re.sub(r"[,\+\*\-/()\[\]{}]", "_", metric)
+    name = re.sub(r"__+", "_", name)
+    name = re.sub(r"^_", "", name)
+    name = re.sub(r"_$", "", name)
+    name = re.sub(r"\._", ".", name)
+    name = re.sub(r"_\.", ".", name)
+    return name
+
+
+class TestNormalizePerf(object):
+
+    RUN_COUNT = 100
+    NAMES = ['VBE.default(127.0.0.%s,,8080).happy' % i for i in xrange(300)]
+
+    def report(self, name, elapsed):
+        count = self.RUN_COUNT * len(self.NAMES)
+        print "%s: %.2fus per name" % (name, elapsed / count * 1000000)
+
+    def run(self, normalize):
+        start = time.time()
+        for _ in xrange(self.RUN_COUNT):
+            for name in self.NAMES:
+                normalize(name)
+        return time.time() - start
+
+    def test_uncached_perf(self):
+        self.report("Uncompiled patterns", self.run(normalize_uncached))
+
+    def test_cached_perf(self):
+        checks._normalized_names.clear()
+        self.report("Cached", self.run(normalize_metric_name))
+
+
+if __name__ == '__main__':
+    t = TestNormalizePerf()
+    t.test_uncached_perf()
+    t.test_cached_perf()
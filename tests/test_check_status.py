@@ -1,5 +1,6 @@
 
 from checks import AgentCheck
+from util import get_thread_cpu_time
 from checks.check_status import STATUS_OK, STATUS_ERROR, InstanceStatus, CheckStatus, CollectorStatus
 import nose.tools as nt
 
@@ -53,6 +54,20 @@ def test_persistence():
     assert chk2.metric_count == 1
     assert chk2.event_count == 2
 
+def test_timing():
+    check = DummyAgentCheck('dummy_agent_check', {}, {}, [{'pass': True}])
+    instance_status = check.run()[0]
+    assert instance_status.wall_time >= 0
+    assert (instance_status.cpu_time is not None) == (get_thread_cpu_time() is not None)
+
+    chk = CheckStatus("dummy", [InstanceStatus(0, STATUS_OK, wall_time=1.5, cpu_time=0.25)],
+        1, 0, wall_time=1.5, cpu_time=0.25)
+    status = CollectorStatus([chk])
+    status.verbose = False
+    lines = status.body_lines()
+    assert [l for l in lines if "instance #0" in l and "1.50s (CPU: 0.25s)" in l]
+    assert [l for l in lines if "Collected 1 metrics" in l and "1.50s (CPU: 0.25s)" in l]
+
 def test_persistence_fail():
 
     # Assert remove doesn't crap out if a file doesn't exist.
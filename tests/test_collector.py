@@ -0,0 +1,408 @@
+import glob
+import os
+import pstats
+import tempfile
+import threading
+import time
+import unittest
+
+from checks import AgentCheck
+from checks.collector import Collector, PayloadEmitterThread
+from util import get_thread_cpu_time
+
+
+class DummyCheck(AgentCheck):
+
+    def check(self, instance):
+        if instance.get('sleep'):
+            time.sleep(instance['sleep'])
+        if instance.get('fail'):
+            raise Exception("failure")
+        self.gauge('dummy.metric', 1, tags=['check:%s' % self.name])
+
+
+class CountingCheck(AgentCheck):
+
+    def check(self, instance):
+        time.sleep(instance.get('sleep', 0))
+        for i in xrange(1000):
+            self.increment('counting.metric')
+
+
+class BlockingCheck(AgentCheck):
+    """ A check which doesn't finish before being released. """
+
+    def __init__(self, *args, **kwargs):
+        AgentCheck.__init__(self, *args, **kwargs)
+        self.release = threading.Event()
+        self.run_count = 0
+
+    def check(self, instance):
+        self.run_count += 1
+        self.release.wait(5)
+        self.gauge('blocking.metric', 1)
+
+
+class LeakyCheck(AgentCheck):
+    """ A check which keeps what it allocates """
+
+    def __init__(self, *args, **kwargs):
+        AgentCheck.__init__(self, *args, **kwargs)
+        self.leak = []
+
+    def check(self, instance):
+        self.leak.append('x' * 4 * 1024 * 1024)
+        self.leak.extend([[i] for i in xrange(1000)])
+
+
+class PidCheck(AgentCheck):
+    """ Report the pid of the process running it, or crash it """
+
+    def check(self, instance):
+        if instance.get('crash'):
+            os._exit(1)
+        if instance.get('sleep'):
+            time.sleep(instance['sleep'])
+        self.gauge('test.pid', os.getpid())
+
+
+def check_metrics(metrics):
+    """ Filter out the timing metrics of the checks """
+    return [m for m in metrics if not m[0].startswith('datadog.agent.check.')]
+
+
+def get_check(name, cls=DummyCheck, init_config=None, agentConfig=None, **instance):
+    return cls(name, init_config or {}, agentConfig or {}, [instance])
+
+
+class TestCollector(unittest.TestCase):
+
+    def get_collector(self, **config):
+        agentConfig = {
+            'api_key': 'toto',
+            'version': '0.1',
+            'tags': None,
+        }
+        agentConfig.update(config)
+        return Collector(agentConfig, [], {})
+
+    def test_checks_d(self):
+        c = self.get_collector(check_workers=3)
+        checksd = [get_check('a'), get_check('b', fail=True), get_check('c')]
+        metrics, events = [], {}
+        statuses = c._run_checks_d(checksd, metrics, events)
+
+        # Statuses keep the order of the checks
+        self.assertEqual([s.name for s in statuses], ['a', 'b', 'c'])
+        self.assertEqual([s.status for s in statuses], ['OK', 'ERROR', 'OK'])
+        self.assertEqual(len(check_metrics(metrics)), 2)
+
+        # Timing of the checks
+        for s in statuses:
+            self.assertTrue(s.wall_time >= 0)
+            self.assertEqual(s.cpu_time is not None, get_thread_cpu_time() is not None)
+        run_times = [m for m in metrics if m[0] == 'datadog.agent.check.run_time']
+        self.assertEqual(sorted([m[3]['tags'] for m in run_times]),
+            [['check:a'], ['check:b'], ['check:c']])
+        instance_run_times = [m for m in metrics if m[0] == 'datadog.agent.check.instance.run_time']
+        self.assertEqual(instance_run_times[0][3]['tags'], ['check:a', 'instance:0'])
+
+    def test_profile(self):
+        c = self.get_collector(check_profile_threshold=0.1)
+        pattern = os.path.join(tempfile.gettempdir(), 'dd-check-%s-*.prof')
+        old_profiles = set(glob.glob(pattern % '*'))
+        c._run_checks_d([get_check('fast_check'), get_check('slow_check', sleep=0.2)], [], {})
+        profiles = set(glob.glob(pattern % '*')) - old_profiles
+        self.assertEqual(len(profiles), 1)
+        path = profiles.pop()
+        self.assertTrue(path in glob.glob(pattern % 'slow_check'))
+        try:
+            self.assertEqual(os.stat(path).st_mode & 0777, 0600)
+            pstats.Stats(path)
+        finally:
+            os.remove(path)
+
+    def test_concurrency(self):
+        c = self.get_collector(check_workers=4)
+        checksd = [get_check(str(i), sleep=0.5) for i in xrange(4)]
+        start = time.time()
+        statuses = c._run_checks_d(checksd, [], {})
+        self.assertTrue(time.time() - start < 1.5)
+        for s in statuses:
+            self.assertEqual(s.status, 'OK')
+
+    def test_default_timeout(self):
+        self.assertEqual(self.get_collector().check_timeout, None)
+        self.assertEqual(self.get_collector(check_workers=2).check_timeout, 30)
+
+    def test_cancel_check(self):
+        c = self.get_collector()
+        job = {'check': get_check('fast'), 'lock': threading.Lock(), 'result': None}
+        copy = c._cancel_check(job)
+        # The cancelled job stays cancelled, a copy is resubmitted
+        self.assertTrue(job['cancelled'])
+        self.assertFalse('cancelled' in copy)
+        self.assertTrue(copy['lock'] is not job['lock'])
+        self.assertEqual(c._cancel_check(job), None)
+
+    def test_timeout(self):
+        c = self.get_collector(check_workers=1, check_timeout=0.5)
+        blocking = get_check('blocking', cls=BlockingCheck)
+        checksd = [blocking, get_check('fast')]
+        metrics = []
+
+        # The blocking check times out, the other one still runs
+        statuses = c._run_checks_d(checksd, metrics, {})
+        self.assertTrue(statuses[0].timed_out)
+        self.assertEqual(statuses[0].status, 'ERROR')
+        self.assertFalse(statuses[1].timed_out)
+        self.assertEqual([m[0] for m in check_metrics(metrics)], ['dummy.metric'])
+
+        # It isn't run again while it's still running
+        statuses = c._run_checks_d(checksd, [], {})
+        self.assertTrue(statuses[0].timed_out)
+        self.assertEqual(blocking.run_count, 1)
+
+        # Once it finished, it's scheduled again
+        blocking.release.set()
+        time.sleep(0.2)
+        metrics = []
+        statuses = c._run_checks_d(checksd, metrics, {})
+        self.assertFalse(statuses[0].timed_out)
+        self.assertEqual(blocking.run_count, 2)
+        self.assertEqual(sorted([m[0] for m in check_metrics(metrics)]), ['blocking.metric', 'dummy.metric'])
+
+    def test_min_collection_interval(self):
+        c = self.get_collector()
+        slow = get_check('slow', init_config={'min_collection_interval': 60})
+        checksd = [get_check('fast'), slow]
+
+        metrics = []
+        statuses = c._run_checks_d(checksd, metrics, {})
+        self.assertEqual(len(check_metrics(metrics)), 2)
+
+        # The slow check isn't due, it reports its last status
+        metrics = []
+        statuses2 = c._run_checks_d(checksd, metrics, {})
+        self.assertEqual(len(check_metrics(metrics)), 1)
+        self.assertEqual(statuses2[1], statuses[1])
+        self.assertTrue(slow.is_due(time.time() + 60))
+
+    def test_instance_interval(self):
+        check = DummyCheck('dummy', {'min_collection_interval': 60}, {},
+            [{}, {'min_collection_interval': 0}])
+        self.assertEqual(len(check.run()), 2)
+        self.assertEqual(len(check.get_metrics()), 1) # same context
+
+        # Only the second instance runs, the first one reports its last status
+        self.assertTrue(check.is_due())
+        self.assertFalse(check.is_instance_due(0))
+        self.assertEqual(len(check.run()), 2)
+
+    def test_instance_concurrency(self):
+        check = CountingCheck('counting', {'instance_concurrency': 4}, {}, [{'sleep': 0.5}] * 4)
+        start = time.time()
+        statuses = check.run()
+        self.assertTrue(time.time() - start < 1.5)
+        self.assertEqual([s.instance_id for s in statuses], [0, 1, 2, 3])
+        for s in statuses:
+            self.assertFalse(s.has_error())
+            self.assertTrue(s.wall_time >= 0.5)
+            # Only the CPU time of the thread running the instance
+            if get_thread_cpu_time() is not None:
+                self.assertTrue(s.cpu_time < 0.4, s.cpu_time)
+        # No increment is lost
+        self.assertEqual(check.get_metrics()[0][2], 4000)
+
+    def test_instance_timeout(self):
+        check = DummyCheck('dummy', {'instance_concurrency': 2, 'instance_timeout': 0.5}, {},
+            [{'sleep': 3}, {}, {'sleep': 0.2}, {}])
+        start = time.time()
+        statuses = check.run()
+        self.assertTrue(time.time() - start < 2)
+        self.assertTrue(statuses[0].has_error())
+        self.assertTrue('Timed out' in statuses[0].error)
+        for s in statuses[1:]:
+            self.assertFalse(s.has_error())
+
+        # The instance which timed out isn't run again while it's running
+        statuses = check.run()
+        self.assertTrue('Still running' in statuses[0].error)
+        self.assertFalse(statuses[1].has_error())
+        check.stop()
+
+    def test_instance_timeouts(self):
+        # Every thread of the pool times out, the other instances run in a new one
+        check = DummyCheck('dummy', {'instance_concurrency': 2, 'instance_timeout': 0.5}, {},
+            [{'sleep': 3}, {'sleep': 3}, {}])
+        start = time.time()
+        statuses = check.run()
+        self.assertTrue(time.time() - start < 2.5)
+        self.assertTrue('Timed out' in statuses[0].error)
+        self.assertTrue('Timed out' in statuses[1].error)
+        self.assertFalse(statuses[2].has_error())
+        check.stop()
+        self.assertEquals(check._instance_pool, None)
+
+    def test_emitter_thread(self):
+        emitted = []
+        release = threading.Event()
+        def slow_emitter(payload, log, config):
+            release.wait(5)
+            emitted.append(payload)
+        c = self.get_collector()
+        c.emitters = [slow_emitter]
+
+        thread = PayloadEmitterThread(c, 2)
+        thread.start()
+        start = time.time()
+        for i in xrange(4):
+            thread.enqueue({'id': i})
+            time.sleep(0.05)
+        # Enqueuing doesn't wait for the payloads to be sent
+        self.assertTrue(time.time() - start < 1)
+        # The first payload is being sent, 2 are waiting, the last one is dropped
+        self.assertEqual(thread.get_backlog(), 2)
+        self.assertEqual(thread.get_dropped_count(), 1)
+        self.assertEqual(thread.get_statuses(), [])
+
+        release.set()
+        while thread.get_backlog():
+            time.sleep(0.05)
+        thread.stop()
+        thread.join(5)
+        self.assertEqual([p['id'] for p in emitted], [0, 1, 2])
+        self.assertEqual([s.name for s in thread.get_statuses()], ['slow_emitter'])
+        self.assertTrue(thread.get_emit_duration() is not None)
+
+    def test_emitter_thread_drained_on_stop(self):
+        emitted = []
+        def slow_emitter(payload, log, config):
+            time.sleep(0.2)
+            emitted.append(payload)
+        c = self.get_collector()
+        c.emitters = [slow_emitter]
+        c._emitter_thread = PayloadEmitterThread(c, 3)
+        c._emitter_thread.start()
+        for i in xrange(3):
+            c._emitter_thread.enqueue({'id': i})
+
+        # The queued payloads are sent before stop returns
+        c.stop()
+        self.assertFalse(c._emitter_thread.isAlive())
+        self.assertEqual([p['id'] for p in emitted], [0, 1, 2])
+
+    def test_memory_accounting(self):
+        config = {'check_memory_accounting': 'yes'}
+        c = self.get_collector(**config)
+        checksd = [get_check('fine', agentConfig=config),
+            get_check('leaky', cls=LeakyCheck, agentConfig=config)]
+        for i in xrange(3):
+            statuses = c._run_checks_d(checksd, [], {})
+        self.assertTrue(statuses[1].instance_statuses[0].object_delta >= 1000)
+
+        growers = c._get_top_memory_growers()
+        self.assertEqual(growers[0][0], 'leaky')
+        growth = growers[0][1]
+        self.assertTrue(growth['objects'] >= 3000)
+        self.assertTrue(growth['rss'] >= 8 * 1024 * 1024)
+        self.assertEqual(growth['instances'][0][1], growth['objects'])
+
+    def test_memory_accounting_concurrency(self):
+        # The checks running concurrently can't be told apart
+        config = {'check_memory_accounting': 'yes', 'check_reload_memory': 2, 'check_workers': 2}
+        c = self.get_collector(**config)
+        self.assertFalse(c.memory_accounting)
+        leaky = get_check('leaky', cls=LeakyCheck, agentConfig=config)
+        checksd = [get_check('fine', agentConfig=config), leaky]
+        statuses = c._run_checks_d(checksd, [], {})
+        self.assertEqual(statuses[1].instance_statuses[0].object_delta, None)
+        self.assertTrue(checksd[1] is leaky)
+        self.assertEqual(c._get_top_memory_growers(), [])
+
+    def test_memory_reload(self):
+        config = {'check_memory_accounting': 'yes', 'check_reload_memory': 2}
+        c = self.get_collector(**config)
+        leaky = get_check('leaky', cls=LeakyCheck, agentConfig=config)
+        checksd = [leaky]
+        c._run_checks_d(checksd, [], {})
+
+        # The check was replaced by a new instance
+        self.assertTrue(checksd[0] is not leaky)
+        self.assertTrue(isinstance(checksd[0], LeakyCheck))
+        self.assertEqual(checksd[0].leak, [])
+        self.assertEqual(c._get_top_memory_growers(), [])
+
+    def test_processes(self):
+        c = self.get_collector(check_processes=2)
+        checksd = [get_check('a', cls=PidCheck), get_check('b', cls=PidCheck),
+            get_check('c', cls=PidCheck)]
+        try:
+            for i in xrange(2):
+                metrics = []
+                statuses = c._run_checks_d(checksd, metrics, {})
+                self.assertEqual([s.status for s in statuses], ['OK', 'OK', 'OK'])
+                pids = [m[2] for m in metrics if m[0] == 'test.pid']
+                self.assertEqual(len(pids), 3)
+                self.assertTrue(os.getpid() not in pids)
+                # 'a' and 'c' run in the same worker
+                self.assertEqual(pids[0], pids[2])
+                self.assertNotEqual(pids[0], pids[1])
+
+            stats = c._get_worker_stats()
+            self.assertEqual([ws['runs'] for ws in stats], [4, 2])
+            self.assertEqual([ws['restarts'] for ws in stats], [0, 0])
+            # Each worker only loaded the checks assigned to it
+            self.assertEqual([sorted(w.check_ids) for w in c._check_processes.workers],
+                [['a', 'c'], ['b']])
+
+            # A new check restarts the worker it's assigned to
+            checksd.append(get_check('d', cls=PidCheck))
+            c._run_checks_d(checksd, [], {})
+            self.assertEqual([ws['restarts'] for ws in c._get_worker_stats()], [0, 1])
+            self.assertEqual(sorted(c._check_processes.workers[1].check_ids), ['b', 'd'])
+        finally:
+            c.stop()
+
+    def test_process_crash(self):
+        c = self.get_collector(check_processes=1)
+        checksd = [get_check('crash', cls=PidCheck, crash=True), get_check('fine', cls=PidCheck)]
+        try:
+            metrics = []
+            statuses = c._run_checks_d(checksd, metrics, {})
+            self.assertEqual([s.status for s in statuses], ['ERROR', 'OK'])
+            self.assertEqual(len([m for m in metrics if m[0] == 'test.pid']), 1)
+            self.assertEqual(c._get_worker_stats()[0]['crashes'], 1)
+        finally:
+            c.stop()
+
+    def test_process_recycling(self):
+        c = self.get_collector(check_processes=1, check_process_max_runs=2)
+        checksd = [get_check('a', cls=PidCheck)]
+        try:
+            pids = []
+            for i in xrange(3):
+                metrics = []
+                c._run_checks_d(checksd, metrics, {})
+                pids.append([m[2] for m in metrics if m[0] == 'test.pid'][0])
+            self.assertEqual(pids[0], pids[1])
+            self.assertNotEqual(pids[1], pids[2])
+            self.assertEqual(c._get_worker_stats()[0]['restarts'], 1)
+        finally:
+            c.stop()
+
+    def test_process_timeout(self):
+        c = self.get_collector(check_processes=1, check_timeout=0.5)
+        checksd = [get_check('slow', cls=PidCheck, sleep=10), get_check('fast', cls=PidCheck)]
+        try:
+            start = time.time()
+            statuses = c._run_checks_d(checksd, [], {})
+            self.assertTrue(statuses[0].timed_out)
+            self.assertEqual(statuses[1].status, 'OK')
+            self.assertTrue(time.time() - start < 5)
+        finally:
+            c.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
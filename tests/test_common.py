@@ -1,8 +1,11 @@
+import sys
 import time
 import unittest
 import logging
+from cStringIO import StringIO
 logger = logging.getLogger()
-from checks import Check, CheckException, UnknownValue, CheckException, Infinity
+from checks import Check, AgentCheck, CheckException, UnknownValue, CheckException, Infinity, \
+    benchmark_check, print_benchmark
 from checks.collector import Collector
 from aggregator import MetricsAggregator
 
@@ -89,6 +92,20 @@ class TestCore(unittest.TestCase):
         self.assertEquals(self.c.normalize("abc.metric(a+b+c{}/5)", "prefix"), "prefix.abc.metric_a_b_c_5")
         self.assertEquals(self.c.normalize("VBE.default(127.0.0.1,,8080).happy", "varnish"), "varnish.VBE.default_127.0.0.1_8080.happy")
 
+    def test_name_cache(self):
+        import checks
+        checks._normalized_names.clear()
+        # Cached names are normalized the same way
+        for i in range(2):
+            self.assertEquals(self.c.normalize("__abc.metric(a+b)__"), "abc.metric_a_b")
+            self.assertEquals(AgentCheck("test", {}, {}).normalize("__abc.metric(a+b)__", "prefix"), "prefix.abc.metric_a_b")
+        self.assertEquals(checks._normalized_names, {"__abc.metric(a+b)__": "abc.metric_a_b"})
+
+        # The cache is bounded
+        for i in range(checks.NORMALIZED_NAMES_CACHE_SIZE + 10):
+            self.c.normalize("metric-%s" % i)
+        self.assertTrue(len(checks._normalized_names) <= checks.NORMALIZED_NAMES_CACHE_SIZE)
+
     def test_metadata(self):
         c = Collector({}, None, {})
         assert "hostname" in c._get_metadata()
@@ -106,5 +123,102 @@ class TestAggregator(unittest.TestCase):
         metric = self.aggr.metrics.values()[0]
         self.assertEquals(metric.value, 2)
 
+    def test_submit_metrics(self):
+        self.aggr.submit_metrics([('test-gauge', 3, 'g'), ('test-counter', 1, 'c')],
+            tags=['b', 'a', 'b'], device_name='sda')
+        self.aggr.increment('test-counter', 1, tags=['a', 'b'], device_name='sda')
+        self.assertEquals(len(self.aggr.metrics), 2, self.aggr.metrics)
+        metrics = dict([(m['metric'], m) for m in self.aggr.flush()])
+        self.assertEquals(metrics['test-gauge']['points'][0][1], 3)
+        self.assertEquals(metrics['test-counter']['points'][0][1], 2)
+
+    def test_interning(self):
+        # The same series in two aggregators share their name and tags
+        other = MetricsAggregator('test-aggr')
+        name, tag = ''.join(['test', '.gauge']), ''.join(['instance', ':foo'])
+        self.aggr.gauge('test.gauge', 1, tags=['instance:foo'])
+        other.gauge(name, 2, tags=[tag])
+        m1, m2 = self.aggr.metrics.values()[0], other.metrics.values()[0]
+        self.assertTrue(m1.name is m2.name)
+        self.assertTrue(m1.tags is m2.tags)
+        self.assertTrue(m1.tags[0] is m2.tags[0])
+        self.assertEquals(m1.tags, ('instance:foo',))
+
+        # And their tags in the payloads
+        check = AgentCheck('test', {}, {'hostname': 'myhost'})
+        check.gauge('test.gauge', 1, tags=['b', 'a'])
+        check.gauge('test.other', 1, tags=['a', 'b', 'a'])
+        metrics = check.get_metrics()
+        self.assertEquals(metrics[0][3]['tags'], ['a', 'b'])
+        self.assertTrue(metrics[0][3]['tags'] is metrics[1][3]['tags'])
+
+        # And in the dogstatsd series, from one flush to the next
+        flushed = []
+        for i in xrange(2):
+            self.aggr.gauge('test.gauge', i, tags=['instance:foo'])
+            flushed.append(self.aggr.flush()[0])
+        self.assertTrue(flushed[0]['metric'] is flushed[1]['metric'])
+        self.assertEquals(flushed[0]['tags'], ['instance:foo'])
+        self.assertTrue(flushed[0]['tags'] is flushed[1]['tags'])
+
+class TestAgentCheck(unittest.TestCase):
+    def test_submit_metrics(self):
+        check = AgentCheck('test', {}, {'hostname': 'myhost'})
+        check.submit_metrics([('test.gauge', 3, 'gauge'), ('test.rate', 1, 'rate'),
+            ('test.count', 2, 'increment')], tags=['a:b'], device_name='sda')
+        check.gauge('test.single', 4, tags=['a:b'], device_name='sda')
+        metrics = dict([(m[0], m) for m in check.get_metrics()])
+        # Rates need 2 points
+        self.assertEquals(sorted(metrics.keys()), ['test.count', 'test.gauge', 'test.single'])
+        self.assertEquals(metrics['test.gauge'][2], 3)
+        self.assertEquals(metrics['test.gauge'][3], metrics['test.single'][3])
+
+        self.assertRaises(CheckException, check.submit_metrics, [('test.gauge', 3, 'nope')])
+
+    def test_benchmark(self):
+        class GaugeCheck(AgentCheck):
+            def check(self, instance):
+                self.gauge('test.gauge', 1, tags=['instance:%s' % instance['name']])
+        check = GaugeCheck('test', {}, {'hostname': 'myhost'}, [{'name': 'a'}, {'name': 'b'}])
+        stats = benchmark_check(check, 3)
+        self.assertEquals(len(stats), 3)
+        self.assertEquals([s['metrics'] for s in stats], [2, 2, 2])
+        self.assertTrue(stats[0]['payload_size'] > stats[0]['compressed_size'] > 0)
+        for s in stats:
+            self.assertTrue(s['wall_time'] >= 0)
+            self.assertTrue(s['cpu_time'] >= 0)
+
+        out = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            print_benchmark(stats)
+            lines = sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = out
+        self.assertEquals(len(lines), 8)
+        self.assertTrue(lines[-2].startswith('avg'))
+
+        # Every run collects, whatever the collection interval and the event aggregation
+        class EventCheck(GaugeCheck):
+            def check(self, instance):
+                GaugeCheck.check(self, instance)
+                self.event({'msg_title': 'flapping', 'event_object': instance['name']})
+        check = EventCheck('test', {'min_collection_interval': 60, 'event_aggregation_window': 60},
+            {'hostname': 'myhost'}, [{'name': 'a'}, {'name': 'b'}])
+        stats = benchmark_check(check, 3)
+        self.assertEquals([s['metrics'] for s in stats], [2, 2, 2])
+        self.assertEquals([s['events'] for s in stats], [2, 2, 2])
+
+        # The runs are spaced by the check frequency, so the rates get two samples
+        class RateCheck(AgentCheck):
+            def check(self, instance):
+                self.rate('test.rate', time.time())
+        real_time = time.time
+        check = RateCheck('test', {}, {'hostname': 'myhost', 'check_freq': 20}, [{}])
+        stats = benchmark_check(check, 3)
+        self.assertEquals([s['metrics'] for s in stats], [0, 1, 1])
+        self.assertEquals(check.get_metrics(), [])
+        self.assertTrue(time.time is real_time)
+
 if __name__ == '__main__':
     unittest.main()
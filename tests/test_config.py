@@ -1,8 +1,11 @@
 import unittest
+import os
 import os.path
+import shutil
+import sys
 import tempfile
 
-from config import get_config
+from config import get_config, CheckDirectoryWatcher, PASSTHROUGH_OPTIONS
 
 from util import PidFile
 
@@ -16,6 +19,21 @@ class TestConfig(unittest.TestCase):
         self.assertEquals(agentConfig["nagios_log"], "/var/log/nagios3/nagios.log")
         self.assertEquals(agentConfig["graphite_listen_port"], 17126)
 
+    def testPassthroughOptions(self):
+        """The options used as is by the agent are read from datadog.conf"""
+        path = tempfile.mkstemp(suffix='.conf')[1]
+        try:
+            f = open(path, 'w')
+            f.write("[Main]\ndd_url: https://app.datadoghq.com\napi_key: 1234\n")
+            for key in PASSTHROUGH_OPTIONS:
+                f.write("%s: %s_value\n" % (key, key))
+            f.close()
+            agentConfig = get_config(parse_args=False, cfg_path=path)
+        finally:
+            os.remove(path)
+        for key in PASSTHROUGH_OPTIONS:
+            self.assertEquals(agentConfig[key], '%s_value' % key)
+
     def testGoodPidFie(self):
         """Verify that the pid file succeeds and fails appropriately"""
 
@@ -51,6 +69,102 @@ class TestConfig(unittest.TestCase):
         self.assertEquals(p.clean(), True)
         self.assertEquals(os.path.exists(path), False)
 
+CHECK_MODULE = """
+from checks import AgentCheck
+
+class MyCheck(AgentCheck):
+    def check(self, instance):
+        pass
+"""
+
+DATADOG_CONF_CHECK_MODULE = CHECK_MODULE + """
+    @staticmethod
+    def parse_agent_config(agentConfig):
+        return {'init_config': {}, 'instances': [{'host': agentConfig['my_host']}]}
+"""
+
+class TestCheckDirectoryWatcher(unittest.TestCase):
+    def setUp(self):
+        self.checksd = tempfile.mkdtemp()
+        self.confd = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.checksd)
+        shutil.rmtree(self.confd)
+
+    def write(self, path, content, mtime=None):
+        f = open(path, 'w')
+        f.write(content)
+        f.close()
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def add_check(self, name, mtime=1000):
+        self.write(os.path.join(self.checksd, '%s.py' % name), CHECK_MODULE, mtime)
+        self.write(os.path.join(self.confd, '%s.yaml' % name), "init_config:\n\ninstances:\n    - host: a\n", mtime)
+
+    def testReload(self):
+        watcher = CheckDirectoryWatcher({'additional_checksd': self.checksd}, confd_path=self.confd)
+        self.assertEquals(watcher.reload([]), [])
+
+        # New checks
+        self.add_check('check_a')
+        self.add_check('check_b')
+        checks = watcher.reload([])
+        self.assertEquals(sorted([c.name for c in checks]), ['check_a', 'check_b'])
+        self.assertTrue(watcher.reload(checks) is checks)
+        a = [c for c in checks if c.name == 'check_a'][0]
+        b = [c for c in checks if c.name == 'check_b'][0]
+
+        # Only the check whose config changed is rebuilt
+        self.write(os.path.join(self.confd, 'check_a.yaml'), "init_config:\n\ninstances:\n    - host: b\n", 2000)
+        checks = watcher.reload(checks)
+        new_a = [c for c in checks if c.name == 'check_a'][0]
+        self.assertTrue(new_a is not a)
+        self.assertEquals(new_a.instances, [{'host': 'b'}])
+        self.assertTrue([c for c in checks if c.name == 'check_b'][0] is b)
+
+        # An invalid config keeps the running check
+        self.write(os.path.join(self.confd, 'check_a.yaml'), "instances: [", 3000)
+        checks = watcher.reload(checks)
+        self.assertTrue([c for c in checks if c.name == 'check_a'][0] is new_a)
+
+        # Removed config
+        os.remove(os.path.join(self.confd, 'check_b.yaml'))
+        checks = watcher.reload(checks)
+        self.assertEquals([c.name for c in checks], ['check_a'])
+
+    def testReloadPythonPath(self):
+        path = os.path.join(self.confd, 'lib')
+        watcher = CheckDirectoryWatcher({'additional_checksd': self.checksd}, confd_path=self.confd)
+        self.add_check('check_a')
+        self.write(os.path.join(self.confd, 'check_a.yaml'),
+            "init_config:\n\ninstances:\n    - host: a\n\npythonpath: %s\n" % path, 1000)
+        try:
+            checks = watcher.reload([])
+            for mtime in (2000, 3000):
+                self.write(os.path.join(self.confd, 'check_a.yaml'),
+                    "init_config:\n\ninstances:\n    - host: b\n\npythonpath: %s\n" % path, mtime)
+                checks = watcher.reload(checks)
+            self.assertEquals(checks[0].instances, [{'host': 'b'}])
+            self.assertEquals(sys.path.count(path), 1)
+        finally:
+            while path in sys.path:
+                sys.path.remove(path)
+
+    def testReloadDatadogConfCheck(self):
+        # A check configured in datadog.conf, with no conf.d config
+        agentConfig = {'additional_checksd': self.checksd, 'my_host': 'a'}
+        watcher = CheckDirectoryWatcher(agentConfig, confd_path=self.confd)
+        self.write(os.path.join(self.checksd, 'check_a.py'), DATADOG_CONF_CHECK_MODULE, 1000)
+        checks = watcher.reload([])
+        self.assertEquals([c.name for c in checks], ['check_a'])
+
+        # A module which fails to load keeps the running check
+        self.write(os.path.join(self.checksd, 'check_a.py'), "import nope\n", 2000)
+        self.assertTrue(watcher.reload(checks)[0] is checks[0])
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,53 @@
+import unittest
+import zlib
+
+from emitter import format_body, iter_json
+from util import json
+
+
+class TestEmitter(unittest.TestCase):
+
+    def get_payload(self):
+        return {
+            'apiKey': 'toto',
+            'metrics': [
+                ('system.load.1', 1000, 0.5, {'tags': ['a:b', u'unic\xf6de']}),
+                ('system.load.5', 1000, 0.25),
+            ],
+            'events': {'System': [{'msg_text': 'Version 1', 'host': 'myhost'}]},
+            'processes': {'processes': [['root', '1', 'init'] for i in xrange(5000)]},
+            'resources': {},
+            'empty': [],
+            'meta': None,
+        }
+
+    def test_iter_json(self):
+        payload = self.get_payload()
+        self.assertEquals(json.loads(''.join(iter_json(payload))), json.loads(json.dumps(payload)))
+        self.assertEquals(''.join(iter_json([])), '[]')
+        self.assertEquals(''.join(iter_json({})), '{}')
+
+    def test_iter_json_chunks(self):
+        # Each row of the process list is serialized on its own
+        chunks = list(iter_json(self.get_payload()))
+        self.assertTrue(max([len(c) for c in chunks]) < 100, max([len(c) for c in chunks]))
+
+    def test_iter_json_keys(self):
+        # Keys are converted to strings like json.dumps does
+        for obj in [{'a': {1: 2, None: 3}}, {'a': [{1.5: [], True: [1], False: {}}]}, {1L: {'b': [[]]}}]:
+            self.assertEquals(json.loads(''.join(iter_json(obj))), json.loads(json.dumps(obj)))
+        self.assertRaises(TypeError, lambda: ''.join(iter_json({(1, 2): []})))
+
+    def test_format_body(self):
+        payload = self.get_payload()
+        stats = {}
+        body = format_body(payload, stats)
+        raw = zlib.decompress(body)
+        self.assertEquals(json.loads(raw), json.loads(json.dumps(payload)))
+        self.assertEquals(stats['raw_size'], len(raw))
+        self.assertEquals(stats['compressed_size'], len(body))
+        self.assertTrue(stats['serialization_time'] >= 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
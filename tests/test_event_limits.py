@@ -0,0 +1,82 @@
+import unittest
+
+from checks import AgentCheck
+from checks.check_status import CheckStatus, CollectorStatus
+from checks.event_limits import EventLimiter
+
+
+def make_event(key, text='status changed'):
+    return {'msg_title': 'web is flapping', 'msg_text': text, 'event_object': key}
+
+
+class FlappingCheck(AgentCheck):
+
+    def check(self, instance):
+        for i in range(100):
+            self.event(make_event('web', 'status %s' % i))
+        self.event(make_event('db'))
+        self.event({'msg_title': 'no key'})
+        self.event({'msg_title': 'no key'})
+
+
+class TestEventLimiter(unittest.TestCase):
+
+    def testNoLimits(self):
+        self.assertEquals(EventLimiter.from_config({}), None)
+        self.assertEquals(EventLimiter.from_config(None), None)
+        # Invalid limits are ignored, the check still loads
+        self.assertEquals(EventLimiter.from_config({'max_events_per_run': -1}), None)
+        self.assertEquals(EventLimiter.from_config({'event_aggregation_window': '5m'}), None)
+        check = AgentCheck('x', {'event_aggregation_window': '5m'}, {}, [{}])
+        self.assertEquals(check.event_limiter, None)
+
+    def testAggregation(self):
+        limiter = EventLimiter(aggregation_window=60)
+        for i in range(10):
+            limiter.add(make_event('web', 'status %s' % i), now=1000 + i)
+        limiter.add(make_event('db'), now=1000)
+        # The first events are sent right away
+        self.assertEquals([e['msg_text'] for e in limiter.flush(now=1010)], ['status 0', 'status changed'])
+        self.assertEquals(limiter.get_folded_count(), 9)
+        self.assertFalse(limiter.has_events(now=1010))
+
+        # The others when the window is over, folded in the last one
+        self.assertTrue(limiter.has_events(now=1060))
+        events = limiter.flush(now=1060)
+        self.assertEquals(len(events), 1)
+        self.assertTrue(events[0]['msg_text'].startswith('status 9\n\n9 events'))
+
+        # New window
+        limiter.add(make_event('web', 'status 10'), now=1061)
+        self.assertEquals([e['msg_text'] for e in limiter.flush(now=1062)], ['status 10'])
+
+    def testMaxEvents(self):
+        limiter = EventLimiter(aggregation_window=60, max_events=2)
+        for key in ('a', 'b', 'c', 'a', 'b'):
+            limiter.add(make_event(key), now=1000)
+        self.assertEquals([e['event_object'] for e in limiter.flush(now=1000)], ['a', 'b'])
+        self.assertEquals(limiter.get_dropped_count(), 1)
+
+        # Folded events which don't fit are sent by the next flush
+        limiter.add(make_event('d'), now=1060)
+        limiter.add(make_event('e'), now=1060)
+        self.assertEquals(len(limiter.flush(now=1060)), 2)
+        self.assertEquals(len(limiter.flush(now=1061)), 2)
+        self.assertEquals(limiter.flush(now=1061), [])
+
+    def testCheck(self):
+        check = FlappingCheck('haproxy', {'event_aggregation_window': 60, 'max_events_per_run': 3}, {}, [{}])
+        statuses = check.run()
+        self.assertTrue(check.has_events())
+        self.assertEquals([e['msg_title'] for e in check.get_events()],
+            ['web is flapping', 'web is flapping', 'no key'])
+        self.assertEquals(statuses[0].folded_events, 99)
+        self.assertEquals(statuses[0].dropped_events, 1)
+
+        status = CollectorStatus([CheckStatus('haproxy', statuses, 0, 3)])
+        status.verbose = False
+        self.assertTrue([l for l in status.body_lines() if '99 events folded, 1 dropped' in l])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+from checks import AgentCheck
+from checks.fixtures import Fixtures, FixtureNotFound
+from checks.http_client import HTTPError
+from tests.test_http_client import Server, Handler, BODY
+
+
+class FixtureCheck(AgentCheck):
+
+    def check(self, instance):
+        response, content = self.http_get(instance['url'])
+        self.gauge('fixture.http.size', len(content), tags=['server:%s' % response['server']])
+        stdout, stderr = self.get_subprocess_output([sys.executable, '-c', 'print 42'])
+        self.gauge('fixture.subprocess', int(stdout))
+        self.gauge('fixture.socket.size', len(self.socket_request('127.0.0.1', instance['port'], 'stat', 5)))
+
+
+class EchoServer(threading.Thread):
+    """ Sends back what it receives, 3 times. """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+
+    def run(self):
+        conn = self.sock.accept()[0]
+        conn.sendall(conn.recv(1024) * 3)
+        conn.close()
+        self.sock.close()
+
+
+class TestFixtures(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testRecordReplay(self):
+        server = Server(('127.0.0.1', 0), Handler)
+        server.connections, server.requests, server.gzipped = set(), [], 0
+        threading.Thread(target=server.serve_forever).start()
+        echo = EchoServer()
+        echo.start()
+        instance = {'url': 'http://127.0.0.1:%s/status' % server.server_address[1], 'port': echo.port}
+
+        try:
+            check = FixtureCheck('fixture', {}, {}, [instance])
+            check.fixtures = Fixtures(self.path, record=True)
+            check.run()
+            recorded = sorted(check.get_metrics())
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEquals([m[2] for m in recorded], [len(BODY), 12, 42])
+
+        # Replayed without the servers
+        check = FixtureCheck('fixture', {}, {}, [instance])
+        check.fixtures = Fixtures(self.path)
+        statuses = check.run()
+        self.assertFalse(statuses[0].has_error(), statuses[0].error)
+        self.assertEquals([(m[0], m[2], m[3]) for m in sorted(check.get_metrics())],
+            [(m[0], m[2], m[3]) for m in recorded])
+
+    def testGeneratedFixtures(self):
+        fixtures = Fixtures(self.path, record=True)
+        fixtures.add_http('http://localhost/status', 'data', headers={'server': 'lighttpd/1.4.28'})
+        fixtures.add_subprocess([sys.executable, '-c', 'print 42'], '43\n')
+        fixtures.add_socket('127.0.0.1', 2181, 'stat', 'abc')
+
+        check = FixtureCheck('fixture', {}, {}, [{'url': 'http://localhost/status', 'port': 2181}])
+        check.fixtures = Fixtures(self.path)
+        check.run()
+        self.assertEquals([m[2] for m in sorted(check.get_metrics())], [4, 3, 43])
+
+        check.instances = [{'url': 'http://localhost/other', 'port': 2181}]
+        self.assertTrue('FixtureNotFound' in check.run()[0].error)
+
+    def testHTTPErrors(self):
+        server = Server(('127.0.0.1', 0), Handler)
+        server.connections, server.requests, server.gzipped = set(), [], 0
+        threading.Thread(target=server.serve_forever).start()
+        url = 'http://127.0.0.1:%s/nope' % server.server_address[1]
+        check = AgentCheck('fixture', {}, {}, [{}])
+        try:
+            check.fixtures = Fixtures(self.path, record=True)
+            self.assertRaises(HTTPError, check.http_get, url)
+        finally:
+            server.shutdown()
+            server.server_close()
+        check.fixtures = Fixtures(self.path, record=True)
+        check.fixtures.add_http('http://localhost/down', 'Service Unavailable', status=503,
+            reason='Service Unavailable')
+
+        # Replayed as HTTPClient.get raises them
+        check.fixtures = Fixtures(self.path)
+        try:
+            check.http_get(url)
+            self.fail("No HTTPError")
+        except HTTPError, e:
+            self.assertEquals((e.url, e.status, e.reason), (url, 404, 'Not Found'))
+        try:
+            check.http_get('http://localhost/down')
+            self.fail("No HTTPError")
+        except HTTPError, e:
+            self.assertEquals((e.status, e.reason), (503, 'Service Unavailable'))
+
+    def testNoFixtures(self):
+        self.assertRaises(FixtureNotFound, Fixtures, os.path.join(self.path, 'nope'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""
+Offline tests of the checks polling HTTP endpoints with AgentCheck.http_get,
+against generated fixtures (see checks/fixtures.py).
+"""
+import shutil
+import tempfile
+import unittest
+
+from checks.fixtures import Fixtures
+from tests.common import load_check
+from util import json
+
+AGENT_CONFIG = {'version': '0.1', 'api_key': 'toto', 'hostname': 'my.host'}
+
+APACHE_STATUS = """Total Accesses: 4422
+Total kBytes: 2876
+CPULoad: .0219
+Uptime: 6315
+ReqPerSec: .700238
+BytesPerSec: 466.362
+BytesPerReq: 666.003
+BusyWorkers: 1
+IdleWorkers: 7
+Scoreboard: W_______........................................
+"""
+
+NGINX_STATUS = """Active connections: 8
+server accepts handled requests
+ 1156958 1156958 4491319
+Reading: 0 Writing: 2 Waiting: 6
+"""
+
+LIGHTTPD_STATUS = """Total Accesses: 3
+Total kBytes: 1
+Uptime: 41
+BusyServers: 1
+IdleServers: 127
+Scoreboard: h_______________
+"""
+
+KYOTOTYCOON_REPORT = """cnt_get\t12
+cnt_get_misses\t3
+cnt_set\t5
+cnt_set_misses\t0
+cnt_remove\t1
+cnt_remove_misses\t0
+db_0\tcount=42 size=1048576 path=casket.kch
+repl_delay\t0.5
+serv_conn_count\t2
+serv_thread_count\t8
+"""
+
+HAPROXY_FIELDS = ['pxname', 'svname', 'qcur', 'qmax', 'scur', 'smax', 'slim', 'stot', 'bin',
+    'bout', 'dreq', 'dresp', 'ereq', 'econ', 'eresp', 'wretr', 'wredis', 'status', 'weight',
+    'act', 'bck', 'chkfail', 'chkdown', 'lastchg', 'downtime', 'qlimit', 'pid', 'iid', 'sid',
+    'throttle', 'lbtot', 'tracked', 'type', 'rate', 'rate_lim', 'rate_max']
+
+
+def haproxy_csv(rows):
+    lines = ['# %s,' % ','.join(HAPROXY_FIELDS)]
+    for pxname, svname, status in rows:
+        values = dict([(f, '1') for f in HAPROXY_FIELDS])
+        values.update({'pxname': pxname, 'svname': svname, 'status': status})
+        lines.append(','.join([values[f] for f in HAPROXY_FIELDS]) + ',')
+    return '\n'.join(lines)
+
+
+class TestHTTPChecks(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.fixtures = Fixtures(self.path, record=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def run_check(self, name, instance, init_config=None):
+        """ Run a check against the fixtures, return it and the names of its metrics. """
+        check = load_check(name, {'init_config': init_config or {}, 'instances': [instance]}, AGENT_CONFIG)
+        check.fixtures = Fixtures(self.path)
+        statuses = check.run()
+        self.assertFalse(statuses[0].has_error(), statuses[0].error)
+        return check, set([m[0] for m in check.get_metrics()])
+
+    def testApache(self):
+        self.fixtures.add_http('http://localhost/server-status?auto', APACHE_STATUS)
+        check, metrics = self.run_check('apache',
+            {'apache_status_url': 'http://localhost/server-status?auto'})
+        for metric in ('apache.performance.busy_workers', 'apache.performance.idle_workers',
+                'apache.performance.cpu_load', 'apache.net.hits'):
+            self.assertTrue(metric in metrics, metrics)
+
+    def testNginx(self):
+        self.fixtures.add_http('http://localhost/nginx_status/', NGINX_STATUS)
+        check, metrics = self.run_check('nginx', {'nginx_status_url': 'http://localhost/nginx_status/'})
+        self.assertEquals(metrics, set(['nginx.net.connections', 'nginx.net.reading',
+            'nginx.net.writing', 'nginx.net.waiting']))
+
+    def testLighttpd(self):
+        self.fixtures.add_http('http://localhost/server-status?auto', LIGHTTPD_STATUS,
+            headers={'server': 'lighttpd/1.4.28'})
+        check, metrics = self.run_check('lighttpd',
+            {'lighttpd_status_url': 'http://localhost/server-status?auto'})
+        for metric in ('lighttpd.performance.busy_servers', 'lighttpd.performance.idle_server',
+                'lighttpd.performance.uptime', 'lighttpd.net.hits'):
+            self.assertTrue(metric in metrics, metrics)
+
+    def testKyotoTycoon(self):
+        self.fixtures.add_http('http://localhost:1978/rpc/report', KYOTOTYCOON_REPORT)
+        check, metrics = self.run_check('kyototycoon',
+            {'name': 'kt', 'report_url': 'http://localhost:1978/rpc/report'})
+        for metric in ('kyototycoon.threads', 'kyototycoon.replication.delay',
+                'kyototycoon.records', 'kyototycoon.size'):
+            self.assertTrue(metric in metrics, metrics)
+
+    def testCouch(self):
+        server = 'http://localhost:5984'
+        self.fixtures.add_http(server + '/_stats/', json.dumps({'couchdb': {
+            'open_databases': {'current': 2}, 'request_time': {'current': None}}}))
+        self.fixtures.add_http(server + '/_all_dbs/', json.dumps(['db1', 'db2']))
+        for db in ('db1', 'db2'):
+            self.fixtures.add_http('%s/%s/' % (server, db), json.dumps({'doc_count': 10, 'disk_size': 4096}))
+        check, metrics = self.run_check('couch', {'server': server})
+        self.assertEquals(metrics, set(['couchdb.couchdb.open_databases', 'couchdb.by_db.doc_count',
+            'couchdb.by_db.disk_size']))
+
+    def testElastic(self):
+        url = 'http://localhost:9200'
+        self.fixtures.add_http(url + '/_cluster/nodes/stats?all=true', json.dumps({'nodes': {
+            'node1': {'hostname': 'my.host', 'indices': {'docs': {'count': 42, 'deleted': 1}},
+                'jvm': {'threads': {'count': 30, 'peak_count': 35}}},
+            'node2': {'hostname': 'other.host', 'indices': {'docs': {'count': 12}}}}}))
+        self.fixtures.add_http(url + '/_cluster/health?pretty=true', json.dumps({'status': 'green'}))
+        check, metrics = self.run_check('elastic', {'url': url})
+        self.assertEquals(metrics, set(['elasticsearch.docs.count', 'elasticsearch.docs.deleted',
+            'jvm.threads.count', 'jvm.threads.peak_count']))
+
+        # A change of the cluster status is an event
+        self.fixtures.add_http(url + '/_cluster/health?pretty=true', json.dumps({'status': 'red'}))
+        check.fixtures = Fixtures(self.path)
+        check.run()
+        events = check.get_events()
+        self.assertEquals(len(events), 1)
+        self.assertEquals(events[0]['alert_type'], 'error')
+
+    def testHAProxy(self):
+        url = 'http://localhost/admin?stats'
+        self.fixtures.add_http(url + ';csv;norefresh', haproxy_csv([('public', 'FRONTEND', 'OPEN'),
+            ('app', 'i-1', 'UP'), ('app', 'i-2', 'UP'), ('app', 'BACKEND', 'UP')]))
+        check, metrics = self.run_check('haproxy', {'url': url, 'status_check': True})
+        self.assertTrue('haproxy.frontend.session.current' in metrics, metrics)
+        self.assertTrue('haproxy.backend.session.current' in metrics, metrics)
+
+        # A host going down is an event
+        self.fixtures.add_http(url + ';csv;norefresh', haproxy_csv([('public', 'FRONTEND', 'OPEN'),
+            ('app', 'i-1', 'DOWN'), ('app', 'i-2', 'UP'), ('app', 'BACKEND', 'UP')]))
+        check.fixtures = Fixtures(self.path)
+        check.run()
+        events = check.get_events()
+        self.assertEquals(len(events), 1)
+        self.assertEquals(events[0]['alert_type'], 'error')
+
+    def testRabbitMQ(self):
+        url = 'http://localhost:15672/api/'
+        self.fixtures.add_http(url + 'queues', json.dumps([
+            {'name': 'queue1', 'vhost': '/', 'node': 'rabbit@localhost', 'consumers': 2, 'messages': 10}]))
+        self.fixtures.add_http(url + 'nodes', json.dumps([
+            {'name': 'rabbit@localhost', 'fd_used': 30, 'mem_used': 4096}]))
+        check, metrics = self.run_check('rabbitmq', {'rabbitmq_api_url': url})
+        self.assertEquals(metrics, set(['rabbitmq.queue.consumers', 'rabbitmq.queue.messages',
+            'rabbitmq.node.fd_used', 'rabbitmq.node.mem_used']))
+
+
+if __name__ == '__main__':
+    unittest.main()
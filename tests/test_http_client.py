@@ -0,0 +1,132 @@
+import base64
+import gzip
+import threading
+import unittest
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from cStringIO import StringIO
+from SocketServer import ThreadingMixIn
+
+from checks import AgentCheck
+from checks.http_client import HTTPClient, HTTPError
+from checks.check_status import CollectorStatus, CheckStatus
+
+BODY = "Total Accesses: 42\n" * 100
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        self.server.requests.append(self.headers)
+        if self.path == '/private':
+            expected = 'Basic %s' % base64.b64encode('user:pass')
+            if self.headers.get('Authorization') != expected:
+                return self.reply(401, 'Unauthorized')
+        elif self.path != '/status':
+            return self.reply(404, 'Not found')
+
+        body = BODY
+        headers = {'Server': 'lighttpd/1.4.28'}
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = StringIO()
+            f = gzip.GzipFile(fileobj=buf, mode='wb')
+            f.write(body)
+            f.close()
+            body = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+            self.server.gzipped += 1
+        self.reply(200, body, headers)
+
+    def reply(self, code, body, headers=None):
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class HTTPCheck(AgentCheck):
+
+    def check(self, instance):
+        self.http_get(instance['url'])
+
+
+class TestHTTPClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.connections = set()
+        self.server.requests = []
+        self.server.gzipped = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testKeepAlive(self):
+        client = HTTPClient({'User-Agent': 'Datadog Agent/test'}, timeout=5)
+        for i in range(3):
+            response, content = client.get(self.url + '/status')
+            self.assertEquals(response.status, 200)
+            self.assertEquals(content, BODY)
+        # Same connection, gzipped responses
+        self.assertEquals(len(self.server.connections), 1)
+        self.assertEquals(self.server.gzipped, 3)
+        self.assertEquals(self.server.requests[0].get('User-Agent'), 'Datadog Agent/test')
+
+        stats = client.get_stats()
+        self.assertEquals(stats['requests'], 3)
+        self.assertEquals(stats['errors'], 0)
+        self.assertTrue(stats['latency'] > 0)
+
+    def testAuth(self):
+        client = HTTPClient(timeout=5)
+        self.assertRaises(HTTPError, client.get, self.url + '/private')
+        response, content = client.get(self.url + '/private', 'user', 'pass')
+        self.assertEquals(response.status, 200)
+        try:
+            client.get(self.url + '/missing')
+            self.fail("404 should raise")
+        except HTTPError, e:
+            self.assertEquals(e.status, 404)
+        self.assertEquals(client.get_stats()['errors'], 2)
+
+    def testSSLValidation(self):
+        client = HTTPClient(timeout=5)
+        self.assertFalse(client._get_http(5.0).disable_ssl_certificate_validation)
+        self.assertTrue(client._get_http(5.0, True).disable_ssl_certificate_validation)
+
+        # Set per instance
+        check = HTTPCheck('http', {}, {}, [{'url': self.url + '/status', 'disable_ssl_validation': True}])
+        check.run()
+        connections = check.get_http_client()._local.connections
+        self.assertEquals([k[1] for k in connections.keys()], [True])
+
+    def testCheckStats(self):
+        check = HTTPCheck('http', {}, {}, [{'url': self.url + '/status'}, {'url': self.url + '/missing'}])
+        statuses = check.run()
+        self.assertEquals(statuses[0].http_requests, 1)
+        self.assertEquals(statuses[0].http_errors, 0)
+        self.assertEquals(statuses[1].http_errors, 1)
+        self.assertTrue(statuses[0].http_latency > 0)
+
+        status = CollectorStatus([CheckStatus('http', statuses, 0, 0)])
+        status.verbose = False
+        self.assertTrue([l for l in status.body_lines() if '1 HTTP requests (1 failed)' in l])
+
+
+if __name__ == '__main__':
+    unittest.main()
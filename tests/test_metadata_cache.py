@@ -0,0 +1,99 @@
+import threading
+import time
+import unittest
+
+from util import MetadataCache, get_hostname, host_metadata_cache
+
+
+class Fetcher(object):
+
+    def __init__(self, values, delay=0):
+        self.values = list(values)
+        self.delay = delay
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        if self.delay:
+            time.sleep(self.delay)
+        value = self.values.pop(0)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def wait_for_refresh(self, cache, key):
+        for i in xrange(50):
+            if key not in cache._refreshing:
+                return
+            time.sleep(0.02)
+
+    def testCache(self):
+        cache = MetadataCache(ttl=60)
+        fetch = Fetcher(['a', 'b'])
+        self.assertEquals(cache.get('key', fetch), 'a')
+        self.assertEquals(cache.get('key', fetch), 'a')
+        self.assertEquals(fetch.count, 1)
+
+    def testBackgroundRefresh(self):
+        cache = MetadataCache(ttl=0.1)
+        fetch = Fetcher(['a', 'b'], delay=0.2)
+        self.assertEquals(cache.get('key', fetch), 'a')
+        time.sleep(0.15)
+
+        # The expired value is returned while it's being refreshed
+        start = time.time()
+        self.assertEquals(cache.get('key', fetch), 'a')
+        self.assertTrue(time.time() - start < 0.1)
+        self.wait_for_refresh(cache, 'key')
+        self.assertEquals(cache.get('key', fetch), 'b')
+        self.assertEquals(fetch.count, 2)
+
+    def testFailedRefresh(self):
+        cache = MetadataCache(ttl=0)
+        fetch = Fetcher(['a', Exception("no network")])
+        self.assertEquals(cache.get('key', fetch), 'a')
+        self.assertEquals(cache.get('key', fetch), 'a')
+        self.wait_for_refresh(cache, 'key')
+        # The previous value is kept
+        self.assertEquals(cache.get('key', Fetcher(['c'], delay=0.5)), 'a')
+
+    def testWarm(self):
+        cache = MetadataCache(ttl=60)
+        fetch = Fetcher(['a'], delay=0.2)
+        cache.warm('key', fetch)
+        # Waits for the value being fetched instead of fetching it again
+        self.assertEquals(cache.get('key', fetch), 'a')
+        self.assertEquals(fetch.count, 1)
+
+    def testFetchTimeout(self):
+        cache = MetadataCache(ttl=60)
+        fetch = Fetcher(['a'], delay=0.5)
+        cache.warm('key', fetch)
+        # A slow lookup doesn't block for more than the timeout
+        start = time.time()
+        self.assertEquals(cache.get('key', fetch, {}, timeout=0.1), {})
+        self.assertTrue(time.time() - start < 0.4)
+        self.wait_for_refresh(cache, 'key')
+        self.assertEquals(cache.get('key', fetch, {}, timeout=0.1), 'a')
+        self.assertEquals(fetch.count, 1)
+
+        # Not warmed: fetched in the background too
+        fetch = Fetcher(['b'], delay=0.5)
+        self.assertEquals(cache.get('other', fetch, timeout=0.1), None)
+        self.wait_for_refresh(cache, 'other')
+        self.assertEquals(cache.get('other', fetch, timeout=0.1), 'b')
+
+        # Without a timeout, the lookup waits
+        self.assertEquals(cache.get('waited', Fetcher(['c'], delay=0.2), timeout=None), 'c')
+
+    def testHostname(self):
+        self.assertEquals(get_hostname({'hostname': 'myhost'}), 'myhost')
+        hostname = get_hostname({})
+        self.assertEquals(host_metadata_cache.get('hostname', None), hostname)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from checks import AgentCheck
+from checks.check_status import CheckStatus, CollectorStatus
+from checks.metric_filters import MetricFilter
+
+
+class FilteredCheck(AgentCheck):
+
+    def check(self, instance):
+        self.gauge('haproxy.frontend.bytes', 1, tags=['frontend:web'])
+        self.gauge('haproxy.backend.bytes', 1, tags=['backend:web'])
+        self.increment('haproxy.backend.hits', tags=['backend:tmp-1'])
+        self.submit_metrics([('haproxy.backend.errors', 1, 'gauge'),
+            ('haproxy.backend.errors.hist', 1, 'histogram')], tags=['backend:db'])
+
+
+class TestMetricFilter(unittest.TestCase):
+
+    def testNoFilter(self):
+        self.assertEquals(MetricFilter.from_config({}), None)
+        self.assertEquals(MetricFilter.from_config(None), None)
+
+    def testNames(self):
+        f = MetricFilter(include_metrics=['haproxy.*'], exclude_metrics=['*.hist', 're:.*\.percentile_\d+'])
+        self.assertTrue(f.keep('haproxy.backend.bytes'))
+        self.assertFalse(f.keep('haproxy.backend.bytes.hist'))
+        self.assertFalse(f.keep('haproxy.backend.percentile_95'))
+        self.assertFalse(f.keep('varnish.hits'))
+        # Cached
+        self.assertFalse(f.keep('varnish.hits'))
+        self.assertEquals(f.get_dropped_count(), 4)
+
+    def testRegexMatchesWholeName(self):
+        f = MetricFilter(exclude_metrics='re:backend')
+        self.assertTrue(f.keep('haproxy.backend.bytes'))
+        self.assertFalse(f.keep('backend'))
+
+    def testInvalidRegex(self):
+        f = MetricFilter.from_config({'exclude_metrics': ['re:haproxy.(', '*.hist']})
+        self.assertEquals(len(f.exclude_metrics), 1)
+        self.assertFalse(f.keep('haproxy.backend.hist'))
+        # The check still loads
+        AgentCheck('haproxy', {'include_metrics': 're:[a-'}, {}, [{}])
+
+    def testTags(self):
+        f = MetricFilter(include_tags=['backend:*'], exclude_tags=['backend:tmp-*'])
+        self.assertTrue(f.keep('a', ['env:prod', 'backend:web']))
+        self.assertFalse(f.keep('a', ['backend:tmp-1']))
+        self.assertFalse(f.keep('a', ['env:prod']))
+        self.assertFalse(f.keep('a'))
+
+    def testCheck(self):
+        check = FilteredCheck('haproxy', {'exclude_metrics': ['*.hist'], 'exclude_tags': ['backend:tmp-*'],
+            'include_tags': ['backend:*']}, {}, [{}])
+        statuses = check.run()
+        # Dropped metrics don't get a context
+        self.assertEquals(len(check.aggregator.metrics), 2)
+        metrics = sorted([m[0] for m in check.get_metrics()])
+        self.assertEquals(metrics, ['haproxy.backend.bytes', 'haproxy.backend.errors'])
+        self.assertEquals(statuses[0].dropped_metrics, 3)
+
+        status = CollectorStatus([CheckStatus('haproxy', statuses, 2, 0)])
+        status.verbose = False
+        self.assertTrue([l for l in status.body_lines() if '3 metrics dropped' in l])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from util import RunScheduler
+
+
+class TestRunScheduler(unittest.TestCase):
+
+    def testCadence(self):
+        """Runs start on the boundaries, whatever their duration"""
+        s = RunScheduler(15, now=100)
+        self.assertEquals(s.get_sleep_time(now=100), 0)
+
+        s.start_run(now=100)
+        # A 4s run waits 11s
+        self.assertEquals(s.get_sleep_time(now=104), 11)
+        s.start_run(now=115.5)
+        self.assertEquals(s.lag, 0.5)
+        self.assertEquals(s.actual_period, 15.5)
+        # The lag doesn't accumulate
+        self.assertEquals(s.get_sleep_time(now=120), 10)
+
+    def testMergeOverrun(self):
+        """A run which is a bit late starts right away"""
+        s = RunScheduler(15, now=100)
+        s.start_run(now=100)
+        self.assertEquals(s.get_sleep_time(now=120), 0)
+        s.start_run(now=120)
+        self.assertEquals(s.lag, 5)
+        self.assertEquals(s.skipped_runs, 0)
+        # And the next one is back on the boundary
+        self.assertEquals(s.get_sleep_time(now=125), 5)
+
+    def testSkipOverrun(self):
+        """Runs which are too late are skipped"""
+        s = RunScheduler(15, now=100)
+        s.start_run(now=100)
+        # The runs due at 115 and 130 are skipped
+        self.assertEquals(s.get_sleep_time(now=140), 5)
+        self.assertEquals(s.skipped_runs, 2)
+        s.start_run(now=145)
+        self.assertEquals(s.lag, 0)
+        self.assertEquals(s.last_skipped_runs, 2)
+
+        stats = s.get_stats()
+        self.assertEquals(stats['actual_period'], 45)
+        self.assertEquals(stats['skipped_runs'], 2)
+
+        s.start_run(now=160)
+        self.assertEquals(s.get_stats()['last_skipped_runs'], 0)
+
+    def testClockChange(self):
+        s = RunScheduler(15, now=100)
+        s.start_run(now=100)
+        self.assertEquals(s.get_sleep_time(now=50), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,15 @@
+import logging
+import os
+import tempfile
 import unittest
+import zlib
 from datetime import timedelta, datetime
 import time
 
-from transaction import Transaction, TransactionManager
-from ddagent import MAX_WAIT_FOR_REPLAY, MAX_QUEUE_SIZE, THROTTLING_DELAY
+from transaction import Transaction, TransactionManager, EndpointStats, CircuitBreaker
+from ddagent import MAX_WAIT_FOR_REPLAY, MAX_QUEUE_SIZE, THROTTLING_DELAY, MetricTransaction
+from ddagent import EmitterThread, EmitterDecoderThread
+from ddagent import persist_transactions, load_persisted_transactions
 
 class memTransaction(Transaction):
     def __init__(self, size, manager):
@@ -23,6 +29,42 @@ class memTransaction(Transaction):
 
         self._trManager.flush_next()
 
+class FakeResponse(object):
+    def __init__(self, code=200, error=None, time_info=None):
+        self.code = code
+        self.error = error
+        self.time_info = time_info or {}
+
+class FakeHTTPClient(object):
+    """Answers the requests right away, failing the ones sent to `failing`
+    and raising for the ones sent to `raising`"""
+    def __init__(self):
+        self.failing = set()
+        self.raising = set()
+        self.requests = []
+
+    def fetch(self, request, callback):
+        self.requests.append(request.url)
+        endpoint = request.url.split('/')[2]
+        if endpoint in self.raising:
+            raise Exception("Unable to send")
+        if endpoint in self.failing:
+            callback(FakeResponse(code=500, error=Exception("500")))
+        else:
+            callback(FakeResponse())
+
+class FakeApplication(object):
+    _agentConfig = {
+        'api_key': 'foo',
+        'dd_url': 'http://dd_url',
+        'pup_url': 'http://pup_url',
+    }
+
+class FakeMetricTransaction(MetricTransaction):
+    _application = FakeApplication()
+    _endpoints = ['dd_url', 'pup_url']
+    _emitter_manager = None
+
 class TestTransaction(unittest.TestCase):
 
     def setUp(self):
@@ -92,6 +134,224 @@ class TestTransaction(unittest.TestCase):
         self.assertTrue( (after-before) > 3 * THROTTLING_DELAY - timedelta(microseconds=100000), 
             "before = %s after = %s" % (before, after))
             
+    def testEndpointStats(self):
+        """Test the connection reuse statistics of an endpoint"""
+        stats = EndpointStats('dd_url')
+
+        # simple client: no connection information
+        stats.record_response(FakeResponse())
+        # curl client: first request then a kept-alive connection
+        stats.record_response(FakeResponse(time_info={'connect': 0.2}))
+        stats.record_response(FakeResponse(time_info={'connect': 0}))
+        # no response at all
+        stats.record_response(FakeResponse(code=599, error=Exception("timeout")))
+
+        self.assertEqual(stats.request_count, 4)
+        self.assertEqual(stats.error_count, 1)
+        self.assertEqual(stats.new_connections, 2)
+        self.assertEqual(stats.reused_connections, 1)
+        self.assertAlmostEqual(stats.get_reuse_ratio(), 1 / 3.0)
+
+        trManager = TransactionManager(timedelta(seconds=0), MAX_QUEUE_SIZE, timedelta(seconds=0))
+        self.assertTrue(trManager.get_endpoint_stats('dd_url') is trManager.get_endpoint_stats('dd_url'))
+
+    def testBackoff(self):
+        """Test the exponential, jittered, replay delays"""
+        tr = Transaction()
+        max_delay = timedelta(seconds=90)
+        for error_count, low, high in [(1, 5, 10), (2, 10, 20), (3, 20, 40), (10, 45, 90)]:
+            tr._error_count = error_count
+            tr.compute_next_flush(max_delay)
+            delay = tr.get_next_flush() - datetime.now()
+            self.assertTrue(timedelta(seconds=low - 1) <= delay <= timedelta(seconds=high), (error_count, delay))
+
+    def testCircuitBreaker(self):
+        breaker = CircuitBreaker('dd_url', failure_threshold=2, reset_timeout=timedelta(seconds=10))
+        self.assertTrue(breaker.allow_request())
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+        # A single probe is allowed once the timeout expired
+        later = datetime.now() + timedelta(seconds=11)
+        self.assertTrue(breaker.allow_request(later))
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow_request(later))
+
+        # A failed probe re-opens the breaker for longer
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request(later))
+        self.assertTrue(breaker.get_retry_date() > later)
+
+        # And a successful one closes it
+        self.assertTrue(breaker.allow_request(datetime.now() + timedelta(seconds=21)))
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow_request())
+
+    def testCircuitBreakerInFlightFailures(self):
+        breaker = CircuitBreaker('dd_url', failure_threshold=5, reset_timeout=timedelta(seconds=30))
+        for i in xrange(10):
+            breaker.record_failure()
+        # The requests which were in flight when it opened don't make it back off
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker._open_count, 1)
+        self.assertTrue(breaker.get_retry_date() <= datetime.now() + timedelta(seconds=30))
+
+    def testEndpointDelivery(self):
+        """Test that endpoints are delivered and retried independently"""
+        trManager = TransactionManager(timedelta(seconds=0), MAX_QUEUE_SIZE, timedelta(seconds=0))
+        http_client = FakeHTTPClient()
+        FakeMetricTransaction.set_tr_manager(trManager)
+        FakeMetricTransaction._http_client = http_client
+
+        # pup is best effort, its failures don't keep the transaction around
+        http_client.failing = set(['pup_url'])
+        FakeMetricTransaction("data", {})
+        self.assertEqual(len(trManager.get_transactions()), 0)
+
+        # dd_url failures do
+        http_client.failing = set(['dd_url'])
+        tr = FakeMetricTransaction("data", {})
+        self.assertEqual(len(trManager.get_transactions()), 1)
+        self.assertEqual(tr._pending_endpoints, ['dd_url'])
+
+        # once the breaker is open, the endpoint isn't hit anymore
+        for i in xrange(CircuitBreaker.FAILURE_THRESHOLD):
+            trManager.flush()
+        self.assertEqual(trManager.get_circuit_breaker('dd_url').state, CircuitBreaker.OPEN)
+        request_count = len(http_client.requests)
+        tr.defer(datetime.now() - timedelta(seconds=1))
+        trManager.flush()
+        self.assertEqual(len(http_client.requests), request_count)
+        self.assertEqual(tr.get_next_flush(), trManager.get_circuit_breaker('dd_url').get_retry_date())
+
+    def testFetchErrors(self):
+        """Test that a request which can't be sent isn't left in flight"""
+        trManager = TransactionManager(timedelta(seconds=0), MAX_QUEUE_SIZE, timedelta(seconds=0))
+        http_client = FakeHTTPClient()
+        FakeMetricTransaction.set_tr_manager(trManager)
+        FakeMetricTransaction._http_client = http_client
+
+        http_client.raising = set(['dd_url'])
+        tr = FakeMetricTransaction("data", {})
+        self.assertFalse(tr.is_in_flight())
+        self.assertEqual(tr._pending_endpoints, ['dd_url'])
+        self.assertEqual(tr.get_error_count(), 1)
+        self.assertEqual(trManager.get_stats()['in_flight'], 0)
+
+        # It's flushed again once the client works
+        http_client.raising = set()
+        tr.defer(datetime.now() - timedelta(seconds=1))
+        trManager.flush()
+        self.assertEqual(len(trManager.get_transactions()), 0)
+
+    def testStats(self):
+        """Test the statistics exposed by the forwarder status endpoint"""
+        trManager = TransactionManager(timedelta(seconds=0), MAX_QUEUE_SIZE, timedelta(seconds=0))
+        http_client = FakeHTTPClient()
+        FakeMetricTransaction.set_tr_manager(trManager)
+        FakeMetricTransaction._http_client = http_client
+
+        FakeMetricTransaction("x" * 100, {})
+        http_client.failing = set(['dd_url'])
+        FakeMetricTransaction("x" * 100, {})
+
+        stats = trManager.get_stats()
+        self.assertEqual(stats['queue_length'], 1)
+        self.assertTrue(stats['bytes_in'] >= 200)
+        # Both endpoints got both transactions
+        self.assertEqual(stats['bytes_out'], 400)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['endpoints']['dd_url']['request_count'], 2)
+        self.assertEqual(stats['endpoints']['dd_url']['error_count'], 1)
+        self.assertEqual(stats['endpoints']['dd_url']['error_ratio'], 0.5)
+        self.assertEqual(stats['endpoints']['pup_url']['error_count'], 0)
+        self.assertTrue(stats['flush_duration'] is not None)
+
+        # Only the acknowledged transaction has a latency
+        self.assertEqual(len(trManager._latencies), 1)
+        self.assertTrue(stats['latency']['p50'] >= 0)
+        self.assertEqual(stats['latency']['p50'], stats['latency']['p99'])
+
+    def testDrain(self):
+        """Test that a drain flushes everything at once, with no throttling"""
+        trManager = TransactionManager(timedelta(seconds=0), MAX_QUEUE_SIZE, THROTTLING_DELAY)
+        for i in xrange(3):
+            tr = memTransaction(10, trManager)
+            tr.is_flushable = i != 1
+            trManager.append(tr)
+            # Not due yet
+            tr.defer(datetime.now() + timedelta(seconds=60))
+
+        drained = []
+        before = datetime.now()
+        trManager.drain(lambda: drained.append(True))
+        self.assertTrue(datetime.now() - before < THROTTLING_DELAY)
+        self.assertEqual(drained, [True])
+        self.assertEqual(len(trManager.get_transactions()), 1)
+        self.assertTrue(trManager.is_draining())
+
+        # The queue isn't flushed normally anymore
+        trManager.flush()
+        self.assertEqual(trManager.get_transactions()[0]._flush_count, 1)
+
+    def testPersistence(self):
+        path = os.path.join(tempfile.mkdtemp(), 'dd-forwarder-queue.json')
+        trManager = TransactionManager(timedelta(seconds=0), MAX_QUEUE_SIZE, timedelta(seconds=0))
+        http_client = FakeHTTPClient()
+        http_client.failing = set(['dd_url'])
+        FakeMetricTransaction.set_tr_manager(trManager)
+        FakeMetricTransaction._http_client = http_client
+        data = zlib.compress("data")
+        FakeMetricTransaction(data, {'Content-Encoding': 'deflate'})
+
+        persist_transactions(trManager.get_transactions(), path)
+        self.assertEqual(os.stat(path).st_mode & 0777, 0600)
+        self.assertEqual(load_persisted_transactions(path),
+            [('FakeMetricTransaction', data, {'Content-Encoding': 'deflate'})])
+        # Transactions are only replayed once
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(load_persisted_transactions(path), [])
+
+        # Files other users can write to aren't loaded
+        persist_transactions(trManager.get_transactions(), path)
+        os.chmod(path, 0666)
+        self.assertEqual(load_persisted_transactions(path), [])
+        os.rmdir(os.path.dirname(path))
+
+    def testEmitterDecoding(self):
+        """Test that payloads are decoded once for all the custom emitters"""
+        received = []
+        def emitter(data, logger, config):
+            received.append(data)
+
+        emitter_threads = [EmitterThread(name='emitter%s' % i, emitter=emitter,
+            logger=logging, config={}) for i in xrange(2)]
+        decoder = EmitterDecoderThread(name='decoder', emitter_threads=emitter_threads,
+            logger=logging, max_queue_size=1)
+
+        # Nothing consumes the queue yet, packets over the backlog are dropped
+        payload = zlib.compress('{"metrics": [1, 2]}')
+        decoder.enqueue(payload, {'Content-Encoding': 'deflate'})
+        decoder.enqueue(payload, {'Content-Encoding': 'deflate'})
+        self.assertEqual(decoder.get_backlog(), 1)
+        self.assertEqual(decoder.get_dropped_count(), 1)
+
+        for t in emitter_threads + [decoder]:
+            t.start()
+        for i in xrange(50):
+            if len(received) == 2:
+                break
+            time.sleep(0.1)
+
+        self.assertEqual(received, [{'metrics': [1, 2]}] * 2)
+        self.assertTrue(received[0] is received[1])
+        self.assertEqual(decoder.get_backlog(), 0)
 
 if __name__ == '__main__':
     unittest.main()
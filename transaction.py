@@ -1,4 +1,5 @@
 # stdlib
+import random
 import sys
 import time
 from datetime import datetime, timedelta
@@ -20,14 +21,146 @@ def plural(count):
 
 class ImplementationError(Exception): pass
 
+class EndpointStats(object):
+    """Delivery statistics for one of the forwarder's endpoints"""
+
+    def __init__(self, name):
+        self.name = name
+        self.request_count = 0
+        self.error_count = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.bytes_sent = 0
+        self.in_flight = 0
+
+    def record_request(self, size):
+        self.in_flight += 1
+        self.bytes_sent += size
+
+    def record_response(self, response):
+        self.in_flight = max(self.in_flight - 1, 0)
+        self.request_count += 1
+        if response.error:
+            self.error_count += 1
+
+        # 599 is tornado's code for a request that never got a response
+        if response.code == 599:
+            return
+        # curl reports a null connect time when it reused a kept-alive
+        # connection. The simple client never reuses its connections.
+        if response.time_info.get('connect', None) == 0:
+            self.reused_connections += 1
+        else:
+            self.new_connections += 1
+
+    def get_reuse_ratio(self):
+        total = self.new_connections + self.reused_connections
+        if total == 0:
+            return 0.0
+        return float(self.reused_connections) / total
+
+    def get_error_ratio(self):
+        if self.request_count == 0:
+            return 0.0
+        return float(self.error_count) / self.request_count
+
+    def as_dict(self):
+        return {
+            'request_count': self.request_count,
+            'error_count': self.error_count,
+            'error_ratio': self.get_error_ratio(),
+            'new_connections': self.new_connections,
+            'reused_connections': self.reused_connections,
+            'bytes_sent': self.bytes_sent,
+            'in_flight': self.in_flight,
+        }
+
+def total_seconds(td):
+    # Python 2.7 has this built in, python < 2.7 don't...
+    if hasattr(td,'total_seconds'):
+        return td.total_seconds()
+    return (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / 10.0**6
+
+class CircuitBreaker(object):
+    """Pause the deliveries to an endpoint after repeated failures.
+
+    Once open, the breaker lets a single probe request through after a
+    timeout: it is closed again if the probe succeeds, or re-opened for a
+    longer time if it fails."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    FAILURE_THRESHOLD = 5
+    RESET_TIMEOUT = timedelta(seconds=30)
+    MAX_RESET_TIMEOUT = timedelta(seconds=5 * 60)
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD,
+            reset_timeout=RESET_TIMEOUT, max_reset_timeout=MAX_RESET_TIMEOUT):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._max_reset_timeout = max_reset_timeout
+
+        self.state = self.CLOSED
+        self._failure_count = 0
+        self._open_count = 0 # consecutive openings, used to back off the probes
+        self._retry_date = None
+
+    def allow_request(self, now=None):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and (now or datetime.now()) >= self._retry_date:
+            log.info("Probing endpoint %s" % self.name)
+            self.state = self.HALF_OPEN
+            return True
+        # Open, or a probe is already in flight
+        return False
+
+    def get_retry_date(self):
+        if self.state == self.CLOSED:
+            return datetime.now()
+        return self._retry_date
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            log.info("Endpoint %s is back, closing its circuit breaker" % self.name)
+        self.state = self.CLOSED
+        self._failure_count = 0
+        self._open_count = 0
+
+    def record_failure(self):
+        if self.state == self.OPEN:
+            # A request sent before the breaker opened, it's already paused
+            return
+        self._failure_count += 1
+        if self.state == self.HALF_OPEN or self._failure_count >= self._failure_threshold:
+            self._open()
+
+    def _open(self):
+        timeout = self._reset_timeout * (2 ** self._open_count)
+        if timeout > self._max_reset_timeout:
+            timeout = self._max_reset_timeout
+        else:
+            self._open_count += 1
+        self.state = self.OPEN
+        self._retry_date = datetime.now() + timeout
+        log.warn("Endpoint %s failed %s time%s in a row, pausing it until %s" %
+            (self.name, self._failure_count, plural(self._failure_count), self._retry_date))
+
 class Transaction(object):
 
+    # Replay delays grow exponentially from this value
+    BACKOFF_BASE = timedelta(seconds=10)
+
     def __init__(self):
 
         self._id = None
         self._error_count = 0
         self._next_flush = datetime.now()        
         self._size = None
+        self._created_at = time.time()
 
     def get_id(self):
         return self._id
@@ -42,6 +175,9 @@ class Transaction(object):
     def get_error_count(self):
         return self._error_count 
 
+    def get_age(self):
+        return time.time() - self._created_at
+
     def get_size(self):
         if self._size is None:
             self._size = sys.getsizeof(self)
@@ -54,23 +190,44 @@ class Transaction(object):
     def compute_next_flush(self,max_delay):
         # Transactions are replayed, try to send them faster for newer transactions
         # Send them every MAX_WAIT_FOR_REPLAY at most
-        td = timedelta(seconds=self._error_count * 20)
+        td = self.BACKOFF_BASE * (2 ** max(self._error_count - 1, 0))
         if td > max_delay:
             td = max_delay
 
+        # Add some jitter, so that transactions which failed together
+        # don't all get replayed at the same time
+        delay = total_seconds(td)
+        td = timedelta(seconds=random.uniform(delay / 2, delay))
+
         newdate = datetime.now() + td
         self._next_flush = newdate.replace(microsecond=0)
 
+    def is_in_flight(self):
+        """Whether the transaction is waiting for an answer"""
+        return False
+
+    def defer(self, until):
+        """Don't try to flush the transaction before the given date"""
+        self._next_flush = until
+
     def time_to_flush(self,now = datetime.now()):
         return self._next_flush < now
 
     def flush(self):
         raise ImplementationError("To be implemented in a subclass")
 
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[int(round(p * (len(sorted_values) - 1)))]
+
 class TransactionManager(object):
     """Holds any transaction derived object list and make sure they
        are all commited, without exceeding parameters (throttling, memory consumption) """
 
+    # Number of enqueue-to-ack latencies kept to compute percentiles
+    LATENCY_SAMPLE_SIZE = 1000
+
     def __init__(self, max_wait_for_replay, max_queue_size, throttling_delay):
 
         self._MAX_WAIT_FOR_REPLAY = max_wait_for_replay
@@ -83,6 +240,10 @@ class TransactionManager(object):
         self._total_count = 0 # Maintain size/count not to recompute it everytime
         self._total_size = 0 
         self._flush_count = 0
+        self._bytes_in = 0
+        self._latencies = [] # Seconds between enqueue and ack of the last transactions
+        self._flush_start = None
+        self._last_flush_duration = None
 
         # Global counter to assign a number to each transaction: we may have an issue
         #  if this overlaps
@@ -91,12 +252,56 @@ class TransactionManager(object):
         self._trs_to_flush = None # Current transactions being flushed
         self._last_flush = datetime.now() # Last flush (for throttling)
 
+        self._draining = False
+        self._drain_pending = [] # Transactions the drain is waiting for
+        self._drain_callback = None
+
+        self._endpoint_stats = {} # endpoint name: EndpointStats
+        self._circuit_breakers = {} # endpoint name: CircuitBreaker
+
         # Track an initial status message.
         ForwarderStatus().persist()
 
     def get_transactions(self):
         return self._transactions
 
+    def get_endpoint_stats(self, endpoint):
+        if endpoint not in self._endpoint_stats:
+            self._endpoint_stats[endpoint] = EndpointStats(endpoint)
+        return self._endpoint_stats[endpoint]
+
+    def get_circuit_breaker(self, endpoint):
+        if endpoint not in self._circuit_breakers:
+            self._circuit_breakers[endpoint] = CircuitBreaker(endpoint)
+        return self._circuit_breakers[endpoint]
+
+    def get_endpoint_statuses(self):
+        statuses = {}
+        for name, stats in self._endpoint_stats.items():
+            statuses[name] = stats.as_dict()
+            statuses[name]['circuit_breaker'] = self.get_circuit_breaker(name).state
+        return statuses
+
+    def get_stats(self):
+        latencies = sorted(self._latencies)
+        endpoints = self.get_endpoint_statuses()
+        return {
+            'queue_length': self._total_count,
+            'queue_size': self._total_size,
+            'flush_count': self._flush_count,
+            'flush_duration': self._last_flush_duration,
+            'bytes_in': self._bytes_in,
+            'bytes_out': sum([e['bytes_sent'] for e in endpoints.values()]),
+            'in_flight': sum([e['in_flight'] for e in endpoints.values()]),
+            'latency': {
+                'p50': percentile(latencies, 0.50),
+                'p95': percentile(latencies, 0.95),
+                'p99': percentile(latencies, 0.99),
+                'max': percentile(latencies, 1),
+            },
+            'endpoints': endpoints,
+        }
+
     def print_queue_stats(self):
         log.debug("Queue size: at %s, %s transaction(s), %s KB" % 
             (time.time(), self._total_count, (self._total_size/1024)))
@@ -130,12 +335,17 @@ class TransactionManager(object):
         self._transactions.append(tr)
         self._total_count = self._total_count + 1
         self._total_size = self._total_size + tr_size
+        self._bytes_in = self._bytes_in + tr_size
 
         log.debug("Transaction %s added" % (tr.get_id()))
         self.print_queue_stats()
 
     def flush(self):
 
+        if self._draining:
+            log.debug("Draining the queue, not flushing")
+            return
+
         if self._trs_to_flush is not None:
             log.debug("A flush is already in progress, not doing anything")
             return
@@ -150,6 +360,7 @@ class TransactionManager(object):
         count = len(to_flush)
         if count > 0:
             log.debug("Flushing %s transaction%s" % (count,plural(count)))
+            self._flush_start = time.time()
             self._trs_to_flush = to_flush
             self.flush_next()
         self._flush_count += 1
@@ -157,18 +368,56 @@ class TransactionManager(object):
         ForwarderStatus(
             queue_length=self._total_count,
             queue_size=self._total_size,
-            flush_count=self._flush_count).persist()
+            flush_count=self._flush_count,
+            endpoint_stats=self.get_endpoint_statuses()).persist()
+
+    def drain(self, callback):
+        """Flush every transaction at once, ignoring the throttling and the
+        replay delays. `callback` is called when all of them have completed,
+        failed or been deferred. The queue isn't flushed normally anymore."""
+        log.info("Draining %s transaction%s" % (self._total_count, plural(self._total_count)))
+        self._draining = True
+        self._drain_callback = callback
+        self._trs_to_flush = None
+        self._drain_pending = list(self._transactions)
+
+        for tr in list(self._drain_pending):
+            if tr.is_in_flight():
+                # Its answer will come anyway
+                continue
+            try:
+                tr.flush()
+            except Exception, e:
+                log.exception(e)
+                self.tr_error(tr)
+        self._check_drained()
+
+    def is_draining(self):
+        return self._draining
+
+    def _drain_done(self, tr):
+        if not self._draining:
+            return
+        if tr in self._drain_pending:
+            self._drain_pending.remove(tr)
+        self._check_drained()
+
+    def _check_drained(self):
+        if self._drain_pending or self._drain_callback is None:
+            return
+        callback = self._drain_callback
+        self._drain_callback = None
+        callback()
 
     def flush_next(self):
 
+        if self._draining:
+            return
+
         if len(self._trs_to_flush) > 0:
 
             td = self._last_flush + self._THROTTLING_DELAY - datetime.now()
-            # Python 2.7 has this built in, python < 2.7 don't...
-            if hasattr(td,'total_seconds'):
-                delay = td.total_seconds()
-            else:
-                delay = (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / 10.0**6
+            delay = total_seconds(td)
 
             if delay <= 0:
                 tr = self._trs_to_flush.pop()
@@ -191,6 +440,9 @@ class TransactionManager(object):
                     self.flush_next()
         else:
             self._trs_to_flush = None
+            if self._flush_start is not None:
+                self._last_flush_duration = time.time() - self._flush_start
+                self._flush_start = None
 
     def tr_error(self,tr):
         tr.inc_error_count()
@@ -198,12 +450,22 @@ class TransactionManager(object):
         log.warn("Transaction %d in error (%s error%s), it will be replayed after %s" %
           (tr.get_id(), tr.get_error_count(), plural(tr.get_error_count()), 
            tr.get_next_flush()))
+        self._drain_done(tr)
+
+    def tr_deferred(self, tr, until):
+        tr.defer(until)
+        log.debug("Transaction %d deferred until %s" % (tr.get_id(), until))
+        self._drain_done(tr)
 
     def tr_success(self,tr):
         log.debug("Transaction %d completed" % tr.get_id())
+        self._latencies.append(tr.get_age())
+        if len(self._latencies) > self.LATENCY_SAMPLE_SIZE:
+            del self._latencies[0]
         self._transactions.remove(tr)
         self._total_count = self._total_count - 1
         self._total_size = self._total_size - tr.get_size()
         self.print_queue_stats()
+        self._drain_done(tr)
 
 
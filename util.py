@@ -5,6 +5,7 @@ import socket
 import subprocess
 import sys
 import math
+import threading
 import time
 import types
 import urllib2
@@ -68,6 +69,45 @@ def get_uuid():
     return uuid.uuid5(uuid.NAMESPACE_DNS, platform.node() + str(uuid.getnode())).hex
 
 
+def get_rss():
+    """
+    Return the resident set size of the process in bytes, None if it can't
+    be found.
+    """
+    try:
+        f = open('/proc/self/statm')
+        try:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        finally:
+            f.close()
+    except Exception:
+        pass
+    try:
+        # No /proc, fall back on the peak RSS
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if get_os() == 'mac':
+            return maxrss
+        return maxrss * 1024
+    except Exception:
+        return None
+
+def get_thread_cpu_time():
+    """
+    Return the CPU time used by the calling thread in seconds, None if it
+    can't be measured. time.clock() is the CPU time of the whole process on
+    Unix, and the wall time on Windows.
+    """
+    if get_os() != 'linux':
+        return None
+    try:
+        import resource
+        # RUSAGE_THREAD isn't exposed by python 2, it's 1 since Linux 2.6.26
+        usage = resource.getrusage(getattr(resource, 'RUSAGE_THREAD', 1))
+        return usage.ru_utime + usage.ru_stime
+    except Exception:
+        return None
+
 def get_os():
     "Human-friendly OS name"
     if sys.platform == 'darwin':
@@ -137,6 +177,111 @@ def is_valid_hostname(hostname):
         'ip6-localhost',
     ])
 
+METADATA_CACHE_TTL = 5 * 60 # seconds
+# How long the first lookup of a value waits for it, in seconds
+METADATA_FETCH_TIMEOUT = 5
+
+class MetadataCache(object):
+    """
+    Process-wide cache of the host metadata which is expensive to look up:
+    hostname, fqdn, EC2 metadata.
+
+    Values are fetched by background threads and expire after `ttl`
+    seconds. An expired value is still returned while it's refreshed, so
+    only the first lookup of a value waits for it, for a bounded time.
+    """
+
+    def __init__(self, ttl=METADATA_CACHE_TTL):
+        self.ttl = ttl
+        self._values = {} # key: (value, fetch time)
+        self._refreshing = {} # key: event set when the refresh is over
+        self._lock = threading.Lock()
+
+    def get(self, key, fetch, default=None, timeout=METADATA_FETCH_TIMEOUT):
+        """
+        Return the value of `key`. If it isn't cached yet, it's fetched with
+        `fetch()` in the background, and `default` is returned if that takes
+        more than `timeout` seconds. With a `timeout` of None, the lookup
+        waits for the value, and fetches it in the calling thread if it
+        isn't being fetched already.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._values.get(key)
+            refreshing = self._refreshing.get(key)
+            if refreshing is None and timeout is not None and entry is None:
+                refreshing = self._refresh_async(key, fetch)
+            elif refreshing is None and entry is not None and time.time() - entry[1] > self.ttl:
+                self._refresh_async(key, fetch)
+        finally:
+            self._lock.release()
+
+        if entry is not None:
+            return entry[0]
+
+        if refreshing is not None:
+            # Being fetched in the background, wait for it
+            refreshing.wait(timeout)
+            entry = self._values.get(key)
+            if entry is not None:
+                return entry[0]
+            if timeout is not None:
+                log.warn("Host metadata %s isn't available yet, using %r" % (key, default))
+                return default
+
+        return self._fetch(key, fetch)
+
+    def warm(self, key, fetch):
+        """ Fetch `key` in the background if it isn't cached yet. """
+        self._lock.acquire()
+        try:
+            if key not in self._values and key not in self._refreshing:
+                self._refresh_async(key, fetch)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._values = {}
+        finally:
+            self._lock.release()
+
+    def _fetch(self, key, fetch):
+        value = fetch()
+        self._lock.acquire()
+        try:
+            self._values[key] = (value, time.time())
+        finally:
+            self._lock.release()
+        return value
+
+    def _refresh_async(self, key, fetch):
+        # Called with the lock held, return the event set when it's over
+        done = threading.Event()
+        self._refreshing[key] = done
+
+        def refresh():
+            try:
+                try:
+                    self._fetch(key, fetch)
+                except Exception:
+                    log.exception("Unable to refresh the host metadata: %s" % key)
+            finally:
+                self._lock.acquire()
+                try:
+                    del self._refreshing[key]
+                finally:
+                    self._lock.release()
+                done.set()
+
+        t = threading.Thread(target=refresh, name='metadata-%s' % key)
+        t.setDaemon(True)
+        t.start()
+        return done
+
+host_metadata_cache = MetadataCache()
+
 def get_hostname(config=None):
     """
     Get the canonical host name this agent should identify as. This is
@@ -147,34 +292,46 @@ def get_hostname(config=None):
       * agent config (datadog.conf, "hostname:")
       * 'hostname -f' (on unix)
       * socket.gethostname()
-    """
-    hostname = None
 
+    The detected host name is cached, see `MetadataCache`.
+    """
     # first, try the config
     if config is None:
         from config import get_config
         config = get_config(parse_args=True)
     config_hostname = config.get('hostname')
     if config_hostname and is_valid_hostname(config_hostname):
-        hostname = config_hostname
+        return config_hostname
 
-    # then move on to os-specific detection
-    if hostname is None:
-        def _get_hostname_unix():
-            try:
-                # try fqdn
-                p = subprocess.Popen(['/bin/hostname', '-f'], stdout=subprocess.PIPE)
-                out, err = p.communicate()
-                if p.returncode == 0:
-                    return out.strip()
-            except:
-                return None
+    # The agent can't run without it, wait for it
+    return host_metadata_cache.get('hostname', _detect_hostname, timeout=None)
 
-        os_name = get_os()
-        if os_name in ['mac', 'freebsd', 'linux', 'solaris']:
-            unix_hostname = _get_hostname_unix()
-            if unix_hostname and is_valid_hostname(unix_hostname):
-                hostname = unix_hostname
+def get_fqdn():
+    """
+    Return socket.getfqdn(), cached as it may wait for a DNS lookup. None
+    if it isn't available yet.
+    """
+    return host_metadata_cache.get('fqdn', socket.getfqdn)
+
+def _detect_hostname():
+    hostname = None
+
+    # os-specific detection
+    def _get_hostname_unix():
+        try:
+            # try fqdn
+            p = subprocess.Popen(['/bin/hostname', '-f'], stdout=subprocess.PIPE)
+            out, err = p.communicate()
+            if p.returncode == 0:
+                return out.strip()
+        except:
+            return None
+
+    os_name = get_os()
+    if os_name in ['mac', 'freebsd', 'linux', 'solaris']:
+        unix_hostname = _get_hostname_unix()
+        if unix_hostname and is_valid_hostname(unix_hostname):
+            hostname = unix_hostname
 
     # if we have an ec2 default hostname, see if there's an instance-id available
     if hostname is not None and True in [hostname.lower().startswith(p) for p in [u'ip-', u'domu']]:
@@ -204,6 +361,14 @@ class EC2(object):
 
     @staticmethod
     def get_metadata():
+        """Return the EC2 metadata of the instance, empty if not running on
+        EC2 or if it isn't available yet. The metadata is cached, see
+        `MetadataCache`.
+        """
+        return dict(host_metadata_cache.get('ec2', EC2.fetch_metadata, {}))
+
+    @staticmethod
+    def fetch_metadata():
         """Use the ec2 http service to introspect the instance. This adds latency if not running on EC2
         """
         # >>> import urllib2
@@ -216,29 +381,37 @@ class EC2(object):
         metadata = {}
 
         # Every call may add TIMEOUT seconds in latency so don't abuse this call
-        # python 2.4 does not support an explicit timeout argument so force it here
-        # Rather than monkey-patching urllib2, just lower the timeout globally for these calls
+        # The metadata may be fetched from a background thread, so don't lower
+        # the timeout globally when urllib2 supports a timeout argument.
+        # python 2.4 and 2.5 don't, so force it there
+        timeout_arg = sys.version_info >= (2, 6)
         socket_to = None
-        try:
-            socket_to = socket.getdefaulttimeout()
-            socket.setdefaulttimeout(EC2.TIMEOUT)
-        except:
-            pass
+        if not timeout_arg:
+            try:
+                socket_to = socket.getdefaulttimeout()
+                socket.setdefaulttimeout(EC2.TIMEOUT)
+            except:
+                pass
 
         for k in ('instance-id', 'hostname', 'local-hostname', 'public-hostname', 'ami-id', 'local-ipv4', 'public-keys', 'public-ipv4', 'reservation-id', 'security-groups'):
             try:
-                v = urllib2.urlopen(EC2.URL + "/" + unicode(k)).read().strip()
+                url = EC2.URL + "/" + unicode(k)
+                if timeout_arg:
+                    v = urllib2.urlopen(url, timeout=EC2.TIMEOUT).read().strip()
+                else:
+                    v = urllib2.urlopen(url).read().strip()
                 assert type(v) in (types.StringType, types.UnicodeType) and len(v) > 0, "%s is not a string" % v
                 metadata[k] = v
             except:
                 pass
 
-        try:
-            if socket_to is None:
-                socket_to = 3
-            socket.setdefaulttimeout(socket_to)
-        except:
-            pass
+        if not timeout_arg:
+            try:
+                if socket_to is None:
+                    socket_to = 3
+                socket.setdefaulttimeout(socket_to)
+            except:
+                pass
 
         return metadata
 
@@ -383,6 +556,64 @@ class Timer(object):
         return self._now() - self.start
 
 
+class RunScheduler(object):
+    """
+    Schedule runs at a fixed cadence: runs are due on boundaries spaced by
+    `period` seconds, whatever the duration of each run.
+
+    When a run overruns its slot, the next run starts right away if it's
+    less than half a period late (the missed run is merged with it), else
+    the missed slots are skipped and the next run waits for the next
+    boundary.
+    """
+
+    def __init__(self, period, now=None):
+        if now is None:
+            now = time.time()
+        self.period = float(period)
+        self.next_run = now
+        self.last_start = None
+        self.actual_period = None # seconds between the starts of the 2 last runs
+        self.lag = 0 # seconds between the boundary and the actual start of the last run
+        self.skipped_runs = 0
+        self.last_skipped_runs = 0 # skipped between the 2 last runs
+        self._skipped_since_last_run = 0
+
+    def start_run(self, now=None):
+        """ Record the start of a run, and schedule the next one. """
+        if now is None:
+            now = time.time()
+        self.lag = max(now - self.next_run, 0)
+        if self.last_start is not None:
+            self.actual_period = now - self.last_start
+        self.last_start = now
+        self.last_skipped_runs = self._skipped_since_last_run
+        self._skipped_since_last_run = 0
+        self.next_run += self.period
+
+    def get_sleep_time(self, now=None):
+        """ Return how long to wait before the next run is due. """
+        if now is None:
+            now = time.time()
+        if self.next_run - now > self.period:
+            # The clock went backwards, start over
+            self.next_run = now
+        while now - self.next_run > self.period / 2:
+            self.next_run += self.period
+            self.skipped_runs += 1
+            self._skipped_since_last_run += 1
+        return max(self.next_run - now, 0)
+
+    def get_stats(self):
+        return {
+            'period': self.period,
+            'actual_period': self.actual_period,
+            'lag': self.lag,
+            'skipped_runs': self.skipped_runs,
+            'last_skipped_runs': self.last_skipped_runs,
+        }
+
+
 class AgentSupervisor(object):
     ''' A simple supervisor to keep a restart a child on expected auto-restarts
     '''